@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""
+Animated key images and the scheduler that shows their frames.
+"""
+
+import time
+import logging
+import threading
+from typing import List
+import numpy
+from PIL import Image
+
+logger = logging.getLogger("streamdeck.animation")
+
+
+class Animation:
+    """
+    Frames of a key image with their durations in seconds. Animations with a
+    single frame are static and loop forever otherwise.
+    """
+
+    def __init__(self, frames: List[Image.Image], durations: List[float]):
+        self.frames = frames
+        self.durations = durations
+        self._ends = numpy.cumsum(durations)
+
+    @property
+    def animated(self) -> bool:
+        """
+        Whether there is more than one frame.
+        """
+        return len(self.frames) > 1
+
+    def frame_at(self, elapsed: float) -> int:
+        """
+        Returns the index of the frame shown the given number of seconds after
+        the start of the animation.
+        """
+        if not self.animated or self._ends[-1] <= 0:
+            return 0
+
+        index = numpy.searchsorted(self._ends, elapsed % self._ends[-1], side="right")
+        return min(int(index), len(self.frames) - 1)
+
+
+class FrameScheduler:
+    """
+    Shows the frames of all animated keys at the frontend. All animations are
+    advanced together in ticks, at most max_fps times per second, and only
+    the keys whose frame changed are drawn.
+
+    The given lock is held while the frontend is updated, it has to be the
+    lock that protects all other frontend calls.
+    """
+
+    def __init__(self, frontend, lock, max_fps: float = 15):
+        self._frontend = frontend
+        self._condition = threading.Condition(lock)
+        self._interval = 1 / max_fps
+        self._animations = {}
+
+    def set(self, key_index: int, animation: Animation):
+        """
+        Sets the animation of the key with the given index, restarting it.
+        Static animations are not scheduled.
+        """
+        with self._condition:
+            if not animation.animated:
+                self._animations.pop(key_index, None)
+                return
+
+            self._animations[key_index] = (animation, time.monotonic(), 0)
+            self._condition.notify()
+
+    def clear(self):
+        """
+        Removes all animations.
+        """
+        with self._condition:
+            self._animations.clear()
+
+    def run(self):
+        """
+        Implements the scheduler main loop.
+        """
+        next_tick = time.monotonic()
+        failing = False
+        while True:
+            with self._condition:
+                if not self._animations:
+                    self._condition.wait_for(lambda: self._animations)
+                    next_tick = time.monotonic()
+
+            next_tick += self._interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Too slow, skip the missed ticks:
+                next_tick = time.monotonic()
+
+            with self._condition:
+                try:
+                    self._tick()
+                    failing = False
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # E.g. the deck was disconnected, the next tick tries again.
+                    # Only the first of consecutive failures is logged:
+                    if not failing:
+                        logger.exception("Animation tick failed")
+                    failing = True
+
+    def _tick(self):
+        """
+        Shows the current frame of each animated key. Has to be called with
+        the lock held.
+        """
+        if not self._frontend.enabled:
+            return
+
+        now = time.monotonic()
+        changed = []
+        for key_index, (animation, start, shown) in self._animations.items():
+            frame = animation.frame_at(now - start)
+            if frame != shown:
+                self._frontend.set_key(key_index, animation.frames[frame])
+                self._animations[key_index] = (animation, start, frame)
+                changed.append(key_index)
+
+        if changed:
+            self._frontend.draw_keys(changed)
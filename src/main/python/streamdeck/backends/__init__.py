@@ -3,8 +3,20 @@
 This module contains all available backend implementations. A backend communicates
 with the actual objects that are displayed on and controlled with the Streamdeck,
 e.g. HomeAssistant entitities.
+
+Implementations are only imported when they are accessed, see registry.Registry.
 """
 
-from backends.home_assistant import HomeAssistantBackend
+from registry import Registry
+from backends.backend import Backend
+
+REGISTRY = Registry(
+    "backends",
+    {
+        "HomeAssistantBackend": "backends.home_assistant",
+        "MqttBackend": "backends.mqtt",
+        "HttpPollBackend": "backends.http_poll",
+    },
+)
 
-AVAILABLE = ["HomeAssistantBackend"]
+__getattr__ = REGISTRY.module_getattr(__name__)
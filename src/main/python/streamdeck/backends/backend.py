@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+"""
+Abstract base class for all backends.
+"""
+
+from abc import ABC, abstractmethod
+from collections.abc import Mapping as MappingBase
+from typing import Callable, Iterable, List, Mapping, Optional
+from backends.dispatch import DispatchQueue
+from backends.entity_index import EntityIndex
+from backends.entity_store import EntityStore
+
+
+class Backend(ABC):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Abstract base class for all backends. Keeps the entity infos in an
+    EntityStore and calls the registered state change handlers when the
+    implementing class reports changed entities via _update_entities().
+
+    The handlers are not called by the thread reporting the changes, but by
+    the worker of the dispatch queue, which has to be run in its own thread
+    via dispatcher.run().
+
+    An entity info is a mapping (EntityRecord) containing at least:
+      * entity_id
+      * state
+      * attributes
+
+    All attributes are kept until set_required_attributes() is called.
+    """
+
+    def __init__(self, **kwargs):
+        self._entities = EntityStore()
+        self._indexed_attributes = kwargs.get("indexed_attributes", ["device_class"])
+        self._keep_attributes = kwargs.get("keep_attributes", [])
+        self._index = EntityIndex(self._indexed_attributes)
+        self._handlers = {}
+        self._next_handler_id = 0
+        self._suppressed_dispatches = 0
+        self._dispatcher = DispatchQueue(
+            self._call_handlers,
+            self._call_all_handlers,
+            kwargs.get("dispatch_queue_size", 1000),
+        )
+
+    @abstractmethod
+    def run(self):
+        """
+        Implements the backend main loop.
+        """
+
+    @abstractmethod
+    def call_service(
+        self,
+        domain: str,
+        service: str,
+        data: Optional[dict] = None,
+        target: Optional[dict] = None,
+        *,
+        callback: Optional[Callable[[bool, Optional[dict]], None]] = None,
+    ):
+        # pylint: disable=too-many-arguments
+        """
+        Calls a service, i.e. triggers an action.
+
+        :param domain: domain of the service to call
+        :param service: name of the service to call
+        :param data: data for the service
+        :param target: target for the service
+        :param callback: function that is called with (success, result or error)
+                         when the service call was completed
+        """
+
+    def get_entity_info(self, entity_id):
+        """
+        Returns the info of the entity with the given ID or None if unknown.
+        """
+        return self._entities.get(entity_id)
+
+    def get_entity_version(self, entity_id, state_only=False):
+        """
+        Returns the version of the last change of the entity with the given ID,
+        or 0 if unknown. Changes of volatile fields (last_reported, last_updated,
+        context) are ignored. If state_only is True, attribute-only changes are
+        ignored as well.
+        """
+        return self._entities.get_version(entity_id, state_only)
+
+    def get_changed_entities(self, version, state_only=False):
+        """
+        Returns the IDs of all entities that changed after the given version,
+        see get_entity_version().
+        """
+        return self._entities.changed_since(version, state_only)
+
+    def find_entities(
+        self,
+        domain: Optional[str] = None,
+        area: Optional[str] = None,
+        attributes: Optional[dict] = None,
+        pattern: Optional[str] = None,
+    ) -> List[str]:
+        """
+        Returns the sorted IDs of all entities matching all given criteria,
+        looked up in the secondary indexes of the backend, see EntityIndex.
+
+        :param domain: domain of the entities
+        :param area: ID or name of the area of the entities, if supported by
+                     the backend
+        :param attributes: mapping from attribute names to values, lookups are
+                           fast for the attributes in indexed_attributes
+        :param pattern: glob pattern for the entity IDs, e.g. "light.bedroom_*"
+        """
+        return self._index.query(
+            domain, area, attributes, pattern, get_info=self._entities.get
+        )
+
+    def set_required_attributes(self, attributes: Optional[Iterable[str]]):
+        """
+        Sets the attributes the keys need, only these, the indexed attributes
+        and the ones in keep_attributes are kept in the entity infos. If None,
+        all attributes are kept.
+        """
+        if attributes is not None:
+            attributes = {
+                *attributes,
+                *self._indexed_attributes,
+                *self._keep_attributes,
+            }
+        self._entities.set_attribute_filter(attributes)
+
+    def memory_usage(self) -> dict:
+        """
+        Returns the number of entities and attributes and the approximate
+        number of bytes used by the entity infos.
+        """
+        return self._entities.memory_usage()
+
+    @property
+    def dispatcher(self) -> DispatchQueue:
+        """
+        The queue of pending state changes, see DispatchQueue.
+        """
+        return self._dispatcher
+
+    @property
+    def suppressed_dispatches(self) -> int:
+        """
+        Number of handler calls that were skipped because the projected value
+        of the entity info didn't change.
+        """
+        return self._suppressed_dispatches
+
+    def register_state_change_handler(self, entity_id, callback, projection=None):
+        """
+        Registers a handler that is called when the state of the entity with
+        the given ID changes. Changes of volatile fields (last_reported,
+        last_updated, context) are ignored. The handler is called with the
+        entity info dict as a parameter.
+
+        :param projection: dotted path into the entity info, e.g. "state" or
+                           "attributes.preset_mode"; if given, the handler is
+                           only called if the value at this path changed
+        """
+        if entity_id not in self._handlers:
+            self._handlers[entity_id] = {}
+
+        handler_id = self._next_handler_id
+        self._next_handler_id += 1
+        self._handlers[entity_id][handler_id] = (
+            callback,
+            None if projection is None else projection.split("."),
+        )
+
+        return (entity_id, handler_id)
+
+    def unregister_state_change_handler(self, key):
+        """
+        Unregisters the handler with the given key, which was returned when
+        creating the handler.
+        """
+        self._handlers[key[0]].pop(key[1], None)
+
+    def _update_entities(self, infos: Mapping[str, Optional[dict]]):
+        """
+        Stores the given entity infos, given as mapping from entity IDs to
+        entity infos (None to remove an entity), and queues the entities that
+        changed for calling their handlers.
+        """
+        changed = self._entities.update_many(infos)
+        for entity_id, old_info in changed.items():
+            self._index.update(entity_id, old_info, self._entities.get(entity_id))
+            self._dispatcher.put(entity_id, old_info)
+
+    def _call_handlers(self, entity_id, old_info):
+        """
+        Calls all registered state change handlers for the entity with
+        the given ID, skipping handlers whose projected value didn't change.
+
+        :param old_info: the entity info before the change, or None
+        """
+        entity_info = self._entities.get(entity_id)
+        if entity_info is None:
+            return
+
+        for callback, projection in list(self._handlers.get(entity_id, {}).values()):
+            if projection is not None and self._project(
+                old_info, projection
+            ) == self._project(entity_info, projection):
+                self._suppressed_dispatches += 1
+                continue
+
+            callback(entity_info)
+
+    def _call_all_handlers(self):
+        """
+        Calls the handlers of all entities with their current info, used when
+        changes were dropped by the dispatch queue.
+        """
+        for entity_id in list(self._handlers):
+            self._call_handlers(entity_id, None)
+
+    @staticmethod
+    def _project(entity_info, projection):
+        """
+        Returns the value at the given path (list of keys) in the entity info,
+        or None if it doesn't exist.
+        """
+        value = entity_info
+        for field in projection:
+            if not isinstance(value, MappingBase):
+                return None
+            value = value.get(field)
+
+        return value
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+"""
+Queue that decouples the network threads of the backends from the state
+change handlers of the keys.
+"""
+
+import time
+import logging
+import threading
+import collections
+from typing import Callable
+
+logger = logging.getLogger("streamdeck.backends.dispatch")
+
+
+class DispatchQueue:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Bounded queue of pending entity changes and calls, drained by a worker
+    thread running run().
+
+    Changes of the same entity are collapsed: an entity is queued at most once,
+    keeping its position and the entity info from before the first change, so
+    the handlers see the latest info compared to the one they saw last. If more
+    than max_size entities are queued, all queued changes are dropped and
+    replaced by a single call of resync, which has to dispatch all entities
+    with their current info. Calls, e.g. results of service calls, are never
+    collapsed or dropped.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[str, dict], None],
+        resync: Callable[[], None],
+        max_size: int = 1000,
+    ):
+        self._dispatch = dispatch
+        self._resync = resync
+        self._max_size = max_size
+        self._condition = threading.Condition()
+        self._queue = collections.OrderedDict()
+        self._stopped = False
+        self._entity_count = 0
+        self._next_call_id = 0
+        self._stats = {
+            "queued": 0,
+            "collapsed": 0,
+            "dropped": 0,
+            "dispatched": 0,
+            "max_lag": 0.0,
+            "last_lag": 0.0,
+        }
+
+    @property
+    def stats(self) -> dict:
+        """
+        Statistics of the queue:
+          * queued: number of entity changes and calls currently queued
+          * collapsed: number of entity changes merged into a queued one
+          * dropped: number of entity changes dropped because the queue was
+            full, see resync
+          * dispatched: number of entity changes and calls dispatched
+          * max_lag, last_lag: maximum and last time in seconds between
+            queueing and dispatching
+        """
+        with self._condition:
+            return {**self._stats, "queued": len(self._queue)}
+
+    def put(self, entity_id: str, old_info: dict):
+        """
+        Queues the change of the entity with the given ID.
+
+        :param old_info: the entity info before the change, or None
+        """
+        with self._condition:
+            key = ("entity", entity_id)
+            if key in self._queue:
+                self._stats["collapsed"] += 1
+                return
+
+            if ("resync", None) in self._queue:
+                # All entities will be dispatched anyway:
+                self._stats["collapsed"] += 1
+                return
+
+            if self._entity_count >= self._max_size:
+                logger.warning(
+                    "Dispatch queue full, dropping %d changes and resyncing",
+                    self._entity_count,
+                )
+                for other in [k for k in self._queue if k[0] == "entity"]:
+                    del self._queue[other]
+                self._stats["dropped"] += self._entity_count + 1
+                self._entity_count = 0
+                self._queue[("resync", None)] = (time.monotonic(), None)
+                self._condition.notify()
+                return
+
+            self._queue[key] = (time.monotonic(), old_info)
+            self._entity_count += 1
+            self._condition.notify()
+
+    def put_call(self, function: Callable, *args):
+        """
+        Queues a call of the given function with the given arguments.
+        """
+        with self._condition:
+            self._queue[("call", self._next_call_id)] = (
+                time.monotonic(),
+                (function, args),
+            )
+            self._next_call_id += 1
+            self._condition.notify()
+
+    def stop(self):
+        """
+        Stops the worker after the current dispatch, can be called from any
+        thread. Queued entity changes and calls are dropped.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def run(self):
+        """
+        Implements the worker main loop, dispatching the queued entity changes
+        and calls in order, until stop() was called.
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._stopped)
+                if self._stopped:
+                    return
+                (kind, value), (queued_at, payload) = self._queue.popitem(last=False)
+                if kind == "entity":
+                    self._entity_count -= 1
+
+            lag = time.monotonic() - queued_at
+            try:
+                if kind == "entity":
+                    self._dispatch(value, payload)
+                elif kind == "resync":
+                    self._resync()
+                else:
+                    function, args = payload
+                    function(*args)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Dispatching %s %s failed", kind, value)
+
+            with self._condition:
+                self._stats["dispatched"] += 1
+                self._stats["last_lag"] = lag
+                self._stats["max_lag"] = max(self._stats["max_lag"], lag)
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""
+Secondary indexes over the entities of a backend.
+"""
+
+import fnmatch
+import threading
+from typing import Dict, Iterable, List, Optional
+
+
+class EntityIndex:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Secondary indexes over entity infos, maintained incrementally on each
+    change: entity IDs by domain, by area and by the value of the given
+    attributes. Queries intersect the index entries instead of scanning all
+    entities, only queries for attributes that aren't indexed fall back to a
+    scan of the matching entities.
+
+    Areas are not part of the entity infos, they are set by the backend via
+    set_areas().
+    """
+
+    def __init__(self, attributes: Iterable[str] = ("device_class",)):
+        self._lock = threading.Lock()
+        self._attributes = tuple(attributes)
+        self._all = set()
+        self._by_domain = {}
+        self._by_area = {}
+        self._by_attribute = {}
+        self._areas = {}
+        self._area_ids = {}
+
+    def update(self, entity_id: str, old_info: Optional[dict], info: Optional[dict]):
+        """
+        Updates the indexes for a changed entity, given its info before and
+        after the change (None if it didn't exist or was removed).
+        """
+        with self._lock:
+            if old_info is not None:
+                for name in self._attributes:
+                    self._remove(
+                        self._by_attribute,
+                        (name, _attribute(old_info, name)),
+                        entity_id,
+                    )
+
+            if info is None:
+                self._all.discard(entity_id)
+                self._remove(self._by_domain, _domain(entity_id), entity_id)
+                self._remove(self._by_area, self._areas.get(entity_id), entity_id)
+                return
+
+            if entity_id not in self._all:
+                self._all.add(entity_id)
+                self._by_domain.setdefault(_domain(entity_id), set()).add(entity_id)
+                if entity_id in self._areas:
+                    self._by_area.setdefault(self._areas[entity_id], set()).add(
+                        entity_id
+                    )
+
+            for name in self._attributes:
+                value = _attribute(info, name)
+                if value is not None:
+                    self._by_attribute.setdefault((name, value), set()).add(entity_id)
+
+    def set_areas(self, areas: Dict[str, str], names: Dict[str, str]):
+        """
+        Sets the areas of the entities.
+
+        :param areas: mapping from entity IDs to area IDs
+        :param names: mapping from area IDs to area names, areas can be
+                      queried by both
+        """
+        with self._lock:
+            self._areas = dict(areas)
+            self._area_ids = {name.lower(): area for area, name in names.items()}
+            self._by_area = {}
+            for entity_id in self._all:
+                if entity_id in self._areas:
+                    self._by_area.setdefault(self._areas[entity_id], set()).add(
+                        entity_id
+                    )
+
+    def query(
+        self,
+        domain: Optional[str] = None,
+        area: Optional[str] = None,
+        attributes: Optional[dict] = None,
+        pattern: Optional[str] = None,
+        *,
+        get_info=None,
+    ) -> List[str]:
+        # pylint: disable=too-many-arguments
+        """
+        Returns the sorted IDs of all entities matching all given criteria.
+
+        :param domain: domain of the entities
+        :param area: ID or name of the area of the entities
+        :param attributes: mapping from attribute names to values
+        :param pattern: glob pattern for the entity IDs, e.g. "light.bedroom_*"
+        :param get_info: function returning the entity info for an entity ID,
+                         needed for attributes that aren't indexed
+        """
+        attributes = attributes or {}
+        with self._lock:
+            candidates = [self._all]
+            if domain is not None:
+                candidates.append(self._by_domain.get(domain, set()))
+            if area is not None:
+                area_id = self._area_ids.get(area.lower(), area)
+                candidates.append(self._by_area.get(area_id, set()))
+            for name, value in attributes.items():
+                if name in self._attributes:
+                    candidates.append(self._by_attribute.get((name, value), set()))
+
+            candidates.sort(key=len)
+            result = set(candidates[0]).intersection(*candidates[1:])
+
+        if pattern is not None:
+            result = set(fnmatch.filter(result, pattern))
+
+        for name, value in attributes.items():
+            if name not in self._attributes:
+                result = {
+                    entity_id
+                    for entity_id in result
+                    if _attribute(get_info(entity_id), name) == value
+                }
+
+        return sorted(result)
+
+    @staticmethod
+    def _remove(index, key, entity_id):
+        """
+        Removes the entity from the set of the given key in the index, and the
+        set if it is empty then.
+        """
+        entities = index.get(key)
+        if entities is not None:
+            entities.discard(entity_id)
+            if not entities:
+                del index[key]
+
+
+def _domain(entity_id: str) -> str:
+    """
+    Returns the domain of the given entity ID.
+    """
+    return entity_id.split(".", 1)[0]
+
+
+def _attribute(info: Optional[dict], name: str):
+    """
+    Returns the value of the given attribute in the entity info, or None if it
+    doesn't exist or isn't hashable.
+    """
+    value = ((info or {}).get("attributes") or {}).get(name)
+    try:
+        hash(value)
+    except TypeError:
+        return None
+
+    return value
@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+"""
+Thread-safe store for entity infos with change versioning.
+"""
+
+import sys
+import threading
+from collections.abc import Mapping as MappingBase
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+# Fields of the entity infos that are kept, all others (last_reported,
+# last_updated, context) change without the entity itself changing:
+RECORD_FIELDS = ("entity_id", "state", "attributes", "last_changed")
+INTERN_MAX_LENGTH = 64  # longer attribute values aren't interned
+
+
+class EntityRecord(MappingBase):
+    """
+    Compact, immutable entity info, used instead of the entity info dicts
+    received from the backends. Only the fields in RECORD_FIELDS are kept, in
+    slots, and only the attributes passed to from_info(). Entity IDs, states,
+    attribute names and short attribute values are interned, so the strings
+    repeated across entities (e.g. "on", "friendly_name") exist only once.
+
+    Records are mappings with the same fields as the entity info dicts, so
+    they can be read like them.
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, entity_id, state, attributes, last_changed=None):
+        self.entity_id = entity_id
+        self.state = state
+        self.attributes = attributes
+        self.last_changed = last_changed
+
+    @classmethod
+    def from_info(
+        cls, entity_id: str, info: Mapping, attributes: Optional[FrozenSet[str]]
+    ) -> "EntityRecord":
+        """
+        Creates a record from an entity info, keeping only the given
+        attributes (all if None).
+        """
+        state = info.get("state")
+        return cls(
+            sys.intern(entity_id),
+            sys.intern(state) if isinstance(state, str) else state,
+            {
+                sys.intern(name): _intern(value)
+                for name, value in (info.get("attributes") or {}).items()
+                if attributes is None or name in attributes
+            },
+            info.get("last_changed"),
+        )
+
+    def __getitem__(self, field):
+        if field not in RECORD_FIELDS:
+            raise KeyError(field)
+
+        return getattr(self, field)
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def __len__(self):
+        return len(RECORD_FIELDS)
+
+    def __eq__(self, other):
+        if isinstance(other, EntityRecord):
+            return all(
+                getattr(self, field) == getattr(other, field) for field in RECORD_FIELDS
+            )
+
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"EntityRecord({dict(self)!r})"
+
+
+class EntityStore:
+    """
+    Thread-safe store for entity infos with change versioning.
+
+    The store can be written and read from any thread. Writes are copy-on-write,
+    so the mapping returned by snapshot() never changes and can be read without
+    locking. The stored entity infos must not be modified.
+
+    Each update that actually changes an entity increments the store version
+    and assigns it to the entity. A separate state version is assigned only if
+    the state itself changed, so readers can ignore attribute-only changes.
+
+    The infos are stored as EntityRecord, keeping only the given attributes
+    (all if None), see set_attribute_filter().
+    """
+
+    def __init__(self, attributes: Optional[Iterable[str]] = None):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entities = MappingProxyType({})
+        self._versions = MappingProxyType({})
+        self._attributes = None if attributes is None else frozenset(attributes)
+
+    @property
+    def version(self) -> int:
+        """
+        The current version of the store, i.e. the version of the most recent
+        change.
+        """
+        return self._version
+
+    def snapshot(self) -> Mapping[str, EntityRecord]:
+        """
+        Returns an immutable mapping from entity IDs to entity infos.
+        """
+        return self._entities
+
+    def get(self, entity_id: str) -> Optional[EntityRecord]:
+        """
+        Returns the info of the entity with the given ID or None if unknown.
+        """
+        return self._entities.get(entity_id)
+
+    def get_version(self, entity_id: str, state_only: bool = False) -> int:
+        """
+        Returns the version of the last change of the entity with the given ID,
+        or 0 if unknown.
+
+        :param state_only: only consider changes of the state
+        """
+        return self._versions.get(entity_id, (0, 0))[1 if state_only else 0]
+
+    def changed_since(self, version: int, state_only: bool = False) -> List[str]:
+        """
+        Returns the IDs of all entities that changed after the given version.
+
+        :param state_only: only consider changes of the state
+        """
+        index = 1 if state_only else 0
+        return [
+            entity_id
+            for entity_id, versions in self._versions.items()
+            if versions[index] > version
+        ]
+
+    def set_attribute_filter(self, attributes: Optional[Iterable[str]]):
+        """
+        Sets the attributes that are kept (all if None). Stored entities are
+        filtered as well, without counting as change.
+        """
+        with self._lock:
+            self._attributes = None if attributes is None else frozenset(attributes)
+            self._entities = MappingProxyType(
+                {
+                    entity_id: EntityRecord.from_info(entity_id, info, self._attributes)
+                    for entity_id, info in self._entities.items()
+                }
+            )
+
+    def memory_usage(self) -> dict:
+        """
+        Returns the number of entities and attributes and the approximate
+        number of bytes used by the entity records.
+        """
+        entities = self._entities
+        seen = set()
+        size = 0
+        attributes = 0
+        for record in entities.values():
+            attributes += len(record.attributes)
+            for value in (
+                record,
+                record.attributes,
+                *record.values(),
+                *record.attributes.keys(),
+                *record.attributes.values(),
+            ):
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+
+        return {"entities": len(entities), "attributes": attributes, "bytes": size}
+
+    def update(
+        self, entity_id: str, info: Optional[Mapping]
+    ) -> Tuple[bool, Optional[EntityRecord]]:
+        """
+        Stores the given info for the entity with the given ID. If the info is
+        None, the entity is removed.
+
+        :return: a tuple (changed, previous info)
+        """
+        changed = self.update_many({entity_id: info})
+        if entity_id in changed:
+            return True, changed[entity_id]
+
+        return False, self.get(entity_id)
+
+    def update_many(
+        self, infos: Mapping[str, Optional[Mapping]]
+    ) -> Dict[str, Optional[EntityRecord]]:
+        """
+        Stores the given infos, given as mapping from entity IDs to entity infos.
+        The mappings are only copied once, so this should be used for bulk
+        updates like the initial states. Changes of fields and attributes that
+        aren't kept are ignored.
+
+        :return: a mapping from the IDs of the entities that changed to their
+                 previous infos
+        """
+        with self._lock:
+            entities = None
+            versions = None
+            changed = {}
+
+            for entity_id, info in infos.items():
+                old_info = self._entities.get(entity_id)
+                if info is not None:
+                    info = EntityRecord.from_info(entity_id, info, self._attributes)
+                if old_info == info:
+                    # Only fields that aren't kept changed, keep the old info:
+                    continue
+
+                if entities is None:
+                    entities = dict(self._entities)
+                    versions = dict(self._versions)
+
+                self._version += 1
+                state_version = versions.get(entity_id, (0, 0))[1]
+                if (old_info or {}).get("state") != (info or {}).get("state"):
+                    state_version = self._version
+
+                if info is None:
+                    entities.pop(entity_id, None)
+                else:
+                    entities[entity_id] = info
+                versions[entity_id] = (self._version, state_version)
+                changed[entity_id] = old_info
+
+            if entities is not None:
+                self._entities = MappingProxyType(entities)
+                self._versions = MappingProxyType(versions)
+
+            return changed
+
+
+def _intern(value):
+    """
+    Returns the interned value if it's a short string, otherwise the value.
+    """
+    if isinstance(value, str) and len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+
+    return value
@@ -7,26 +7,66 @@ import ssl
 import time
 import json
 import logging
-from typing import Optional
+import threading
+from functools import partial
+from typing import Callable, Optional
 import websocket
+from backends.backend import Backend
 
 logger = logging.getLogger("streamdeck.backends.home_assistant")
 
+# Events after which the areas of the entities are reloaded:
+REGISTRY_EVENTS = (
+    "area_registry_updated",
+    "device_registry_updated",
+    "entity_registry_updated",
+)
 
-class HomeAssistantBackend:
+
+class HomeAssistantBackend(Backend):
     # pylint: disable=too-many-instance-attributes
     """
     HomeAssistant backend
+
+    After authentication, the coalesce_messages feature is requested, so
+    HomeAssistant may send multiple messages in one frame. Once it's
+    acknowledged, outgoing commands are batched for batch_interval seconds
+    (default: 0.01) and sent as one frame, too. The traffic is recorded, see
+    traffic.
+
+    The areas of the entities are reloaded registry_delay seconds (default: 1)
+    after the last change of the area, device or entity registry, so a burst
+    of registry events results in a single reload.
     """
 
-    def __init__(self, url, token, insecure=False):
+    def __init__(self, url, token, insecure=False, **kwargs):
+        super().__init__(**kwargs)
+
         self._url = url
         self._access_token = token
         self._insecure = insecure
+        self._batch_interval = kwargs.get("batch_interval", 0.01)
+        self._registry_delay = kwargs.get("registry_delay", 1)
+        self._registry_timer = None
         self._id = 1
         self._get_states_id = -1
-        self._entity_info = {}
-        self._handlers = {}
+        self._send_lock = threading.Lock()
+        self._result_callbacks = {}
+        self._batching = False
+        self._outbox = []
+        self._flush_timer = None
+        self._traffic = dict.fromkeys(
+            (
+                "frames_received",
+                "frames_sent",
+                "messages_received",
+                "messages_sent",
+                "bytes_received",
+                "bytes_sent",
+            ),
+            0,
+        )
+        self._connected_at = time.monotonic()
 
         self._connect()
 
@@ -57,7 +97,10 @@ class HomeAssistantBackend:
         service: str,
         data: Optional[dict] = None,
         target: Optional[dict] = None,
+        *,
+        callback: Optional[Callable[[bool, Optional[dict]], None]] = None,
     ):
+        # pylint: disable=too-many-arguments
         """
         Calls a HomeAssistant service.
 
@@ -65,21 +108,44 @@ class HomeAssistantBackend:
         :param service: name of the service to call
         :param data: data for the service
         :param target: target for the service
+        :param callback: function that is called with (success, result or error)
+                         when HomeAssistant answered the call
         """
         if data is None:
             data = {}
         if target is None:
             target = {}
 
-        self._send_with_id(
-            {
-                "type": "call_service",
-                "domain": domain,
-                "service": service,
-                "service_data": data,
-                "target": target,
-            }
-        )
+        try:
+            self._send_with_id(
+                {
+                    "type": "call_service",
+                    "domain": domain,
+                    "service": service,
+                    "service_data": data,
+                    "target": target,
+                },
+                callback,
+            )
+        except websocket.WebSocketException as e:
+            logger.error("Failed to call service %s.%s: %s", domain, service, e)
+            if callback is not None:
+                callback(False, {"code": "not_connected", "message": str(e)})
+
+    @property
+    def traffic(self) -> dict:
+        """
+        Traffic of the current connection: frames, messages and payload bytes
+        received and sent, and frames per second in both directions.
+        """
+        with self._send_lock:
+            traffic = dict(self._traffic)
+        seconds = max(time.monotonic() - self._connected_at, 1e-6)
+        traffic["frames_per_second"] = (
+            traffic["frames_received"] + traffic["frames_sent"]
+        ) / seconds
+
+        return traffic
 
     def get_entity_info(self, entity_id):
         """
@@ -89,78 +155,145 @@ class HomeAssistantBackend:
           * state
           * attributes
           * last_changed
-          * last_reported
-          * last_updated
-          * context
         """
-        return self._entity_info.get(entity_id)
+        return self._entities.get(entity_id)
 
-    def register_state_change_handler(self, entity_id, callback):
+    def _on_message(self, _, message):
         """
-        Registers a handler that is called when the state of the entity with
-        the given ID changes. The handler is called with the entity info dict
-        as a parameter, containing:
-          * entity_id
-          * state
-          * attributes
-          * last_changed
-          * last_reported
-          * last_updated
-          * context
+        Handler for received WebSocket messages. Only parses the message,
+        handlers and callbacks are called via the dispatch queue so the
+        WebSocket thread isn't blocked by them.
         """
-        if entity_id not in self._handlers:
-            self._handlers[entity_id] = []
+        logger.debug("Received message: %s", message)
 
-        self._handlers[entity_id].append(callback)
+        data = json.loads(message)
+        messages = data if isinstance(data, list) else [data]
+        with self._send_lock:
+            self._traffic["frames_received"] += 1
+            self._traffic["messages_received"] += len(messages)
+            self._traffic["bytes_received"] += len(
+                message.encode() if isinstance(message, str) else message
+            )
 
-        return (entity_id, len(self._handlers[entity_id]) - 1)
+        for item in messages:
+            self._handle_message(item)
 
-    def unregister_state_change_handler(self, key):
+    def _handle_message(self, data):
         """
-        Unregisters the handler with the given key, which was returned when
-        creating the handler.
-        """
-        self._handlers[key[0]].pop(key[1])
-
-    def _on_message(self, _, message):
+        Handles a single received message, see _on_message().
         """
-        Handler for received WebSocket messages.
-        """
-        logger.debug("Received message: %s", message)
-
-        data = json.loads(message)
         msg_type = data.get("type", "")
 
         if msg_type == "auth_required":
             # Authentication required, send access token:
-            self._send({"type": "auth", "access_token": self._access_token})
+            with self._send_lock:
+                self._send({"type": "auth", "access_token": self._access_token})
         elif msg_type == "auth_ok":
-            # Authentication succeeded, subscribe to events and get initial states:
+            # Authentication succeeded, request message coalescing, subscribe to
+            # events and get initial states:
+            self._send_with_id(
+                {"type": "supported_features", "features": {"coalesce_messages": 1}},
+                self._features_result,
+            )
             self._send_with_id({"type": "subscribe_events"})
             self._get_states_id = self._send_with_id({"type": "get_states"})
+            self._load_areas()
         elif msg_type == "result":
-            # TODO: What if data["success"] is False?
-            if data["id"] == self._get_states_id:
+            callback = self._result_callbacks.pop(data["id"], None)
+            if not data["success"]:
+                logger.error("Command #%d failed: %s", data["id"], data.get("error"))
+
+            if callback is not None:
+                self._dispatcher.put_call(
+                    callback,
+                    data["success"],
+                    data.get("result") if data["success"] else data.get("error"),
+                )
+            elif data["id"] == self._get_states_id and data["success"]:
                 # Initial states received, store them:
-                for entity in data["result"]:
-                    self._entity_info[entity["entity_id"]] = entity
-                    self._call_handlers(entity["entity_id"])
+                self._update_entities(
+                    {entity["entity_id"]: entity for entity in data["result"]}
+                )
         elif msg_type == "event":
             if data["event"]["event_type"] == "state_changed":
                 # State change received, update entity states:
-                entity_id = data["event"]["data"]["entity_id"]
-                self._entity_info[entity_id] = data["event"]["data"]["new_state"]
-                self._call_handlers(entity_id)
+                event_data = data["event"]["data"]
+                self._update_entities(
+                    {event_data["entity_id"]: event_data["new_state"]}
+                )
+            elif data["event"]["event_type"] in REGISTRY_EVENTS:
+                # Areas might have changed, reload them once the events stop:
+                self._schedule_area_reload()
         else:
-            logger.warning("Unknown message: %s", message)
+            logger.warning("Unknown message: %s", data)
+
+    def _load_areas(self):
+        """
+        Requests the area, device and entity registries, to set the areas of
+        the entities in the index when all of them were received.
+        """
+        registries = {}
+        for name in ("area", "device", "entity"):
+            self._send_with_id(
+                {"type": f"config/{name}_registry/list"},
+                partial(self._registry_received, registries, name),
+            )
 
-    def _call_handlers(self, entity_id):
+    def _schedule_area_reload(self):
         """
-        Calls all registered state change handlers for the entity with
-        the given ID.
+        Reloads the areas after the registry delay, restarting the delay if a
+        reload is already scheduled.
+        """
+        with self._send_lock:
+            if self._registry_timer is not None:
+                self._registry_timer.cancel()
+            self._registry_timer = threading.Timer(
+                self._registry_delay, self._reload_areas
+            )
+            self._registry_timer.daemon = True
+            self._registry_timer.start()
+
+    def _reload_areas(self):
         """
-        for handler in self._handlers.get(entity_id, []):
-            handler(self._entity_info[entity_id])
+        Called when the registry delay passed.
+        """
+        with self._send_lock:
+            if self._registry_timer is None:
+                return
+            self._registry_timer = None
+
+        try:
+            self._load_areas()
+        except websocket.WebSocketException as e:
+            # Areas are loaded again after reconnecting:
+            logger.warning("Failed to reload areas: %s", e)
+
+    def _registry_received(self, registries, name, success, result):
+        """
+        Callback for the registry lists requested by _load_areas(). An entity
+        is in the area of its device, unless it has an area itself.
+        """
+        if not success:
+            logger.warning("Failed to get %s registry: %s", name, result)
+            return
+
+        registries[name] = result
+        if len(registries) < 3:
+            return
+
+        device_areas = {
+            device["id"]: device.get("area_id") for device in registries["device"]
+        }
+        areas = {}
+        for entity in registries["entity"]:
+            area = entity.get("area_id") or device_areas.get(entity.get("device_id"))
+            if area is not None:
+                areas[entity["entity_id"]] = area
+
+        self._index.set_areas(
+            areas, {area["area_id"]: area["name"] for area in registries["area"]}
+        )
+        logger.info("Loaded areas of %d entities", len(areas))
 
     @staticmethod
     def _on_error(_, error):
@@ -174,6 +307,25 @@ class HomeAssistantBackend:
         Handler that is called when the WebSocket connection is closed.
         """
         logger.info("WebSocket connection closed: %s %s", status_code, msg)
+        logger.info("Traffic of the connection: %s", self.traffic)
+
+        # Commands without result won't get one anymore:
+        with self._send_lock:
+            callbacks = list(self._result_callbacks.values())
+            self._result_callbacks.clear()
+            self._batching = False
+            self._outbox = []
+            if self._registry_timer is not None:
+                # Areas are loaded again after reconnecting:
+                self._registry_timer.cancel()
+                self._registry_timer = None
+            self._traffic = dict.fromkeys(self._traffic, 0)
+            self._connected_at = time.monotonic()
+        for callback in callbacks:
+            self._dispatcher.put_call(
+                callback, False, {"code": "connection_closed", "message": str(msg)}
+            )
+
         self._connect()
 
     @staticmethod
@@ -183,18 +335,79 @@ class HomeAssistantBackend:
         """
         logger.info("Websocket connection opened")
 
+    def _features_result(self, success, _):
+        """
+        Callback for the supported_features command, enables batching of
+        outgoing commands if it succeeded.
+        """
+        logger.info("Message coalescing %s", "enabled" if success else "unsupported")
+        with self._send_lock:
+            self._batching = success and self._batch_interval > 0
+
     def _send(self, data):
         """
-        Sends a given object as JSON via WebSocket.
+        Sends a given object (or list of objects) as JSON via WebSocket. Has
+        to be called with the send lock held.
         """
-        self._ws.send(json.dumps(data))
+        message = json.dumps(data)
+        self._ws.send(message)
+        self._traffic["frames_sent"] += 1
+        self._traffic["messages_sent"] += len(data) if isinstance(data, list) else 1
+        self._traffic["bytes_sent"] += len(message.encode())
 
-    def _send_with_id(self, data):
+    def _flush(self):
+        """
+        Sends the batched commands as one frame.
+        """
+        with self._send_lock:
+            outbox = self._outbox
+            self._outbox = []
+            self._flush_timer = None
+            if not outbox:
+                return
+
+            try:
+                self._send(outbox if len(outbox) > 1 else outbox[0])
+                return
+            except websocket.WebSocketException as e:
+                logger.error("Failed to send %d commands: %s", len(outbox), e)
+                error = {"code": "not_connected", "message": str(e)}
+                callbacks = [
+                    self._result_callbacks.pop(data["id"], None) for data in outbox
+                ]
+
+        for callback in callbacks:
+            if callback is not None:
+                self._dispatcher.put_call(callback, False, error)
+
+    def _send_with_id(self, data, callback=None):
         """
         Sends a given object as JSON via WebSocket, adding an incrementing ID.
+
+        :param callback: function that is called with (success, result or error)
+                         when the result for this command is received
         """
-        data["id"] = self._id
-        self._send(data)
-        self._id += 1
+        with self._send_lock:
+            data["id"] = self._id
+            self._id += 1
+            if callback is not None:
+                self._result_callbacks[data["id"]] = callback
+
+            if self._batching:
+                # Send with the other commands of this batch:
+                self._outbox.append(data)
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(
+                        self._batch_interval, self._flush
+                    )
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                return data["id"]
+
+            try:
+                self._send(data)
+            except websocket.WebSocketException:
+                self._result_callbacks.pop(data["id"], None)
+                raise
 
-        return self._id - 1
+        return data["id"]
@@ -0,0 +1,426 @@
+#!/usr/bin/python3
+"""
+HTTP polling backend
+"""
+
+import re
+import time
+import json
+import heapq
+import random
+import logging
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+from backends.backend import Backend
+
+logger = logging.getLogger("streamdeck.backends.http_poll")
+
+JSON_PATH_TOKEN = re.compile(r"\.([^.\[\]]+)|\[(\d+)\]|\['([^']*)'\]")
+
+# Methods whose requests may be sent twice:
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+# Errors of reused connections that show the server closed them while idle,
+# before the request was processed:
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+def compile_json_path(path: str) -> list:
+    """
+    Compiles a JSONPath expression into a list of keys and indices. Supported
+    is the subset $.key.other[0]['key with spaces'].
+
+    :raises ValueError: if the expression is invalid
+    """
+    if not path.startswith("$"):
+        raise ValueError(f"JSONPath has to start with $: {path}")
+
+    steps = []
+    position = 1
+    while position < len(path):
+        match = JSON_PATH_TOKEN.match(path, position)
+        if match is None:
+            raise ValueError(f"Invalid JSONPath at position {position}: {path}")
+
+        key, index, quoted_key = match.groups()
+        if index is not None:
+            steps.append(int(index))
+        else:
+            steps.append(key if key is not None else quoted_key)
+        position = match.end()
+
+    return steps
+
+
+def extract_json_path(document, steps: list):
+    """
+    Returns the value at the given compiled JSONPath in the document, or None
+    if it doesn't exist.
+    """
+    value = document
+    for step in steps:
+        try:
+            value = value[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    return value
+
+
+class ConnectionPool:
+    """
+    Pool of keep-alive HTTP connections, reused per (scheme, host, port).
+    """
+
+    def __init__(self, timeout: float):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._timeout = timeout
+        self._closed = False
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Sends a request and returns a tuple (status, headers, body).
+
+        Requests with idempotent methods reuse idle connections, and are
+        retried once on a new connection if the reused one was closed by the
+        server in the meantime. Other requests, e.g. service calls, always use
+        a new connection and are never retried, as they might have been
+        processed already.
+        """
+        idempotent = method in IDEMPOTENT_METHODS
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+
+        for attempt in range(2):
+            connection, reused = self._acquire(origin, reuse=idempotent)
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if reused and attempt == 0 and isinstance(e, STALE_CONNECTION_ERRORS):
+                    continue
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(origin, connection)
+
+            return response.status, response.headers, data
+
+        raise AssertionError("unreachable")
+
+    def close(self):
+        """
+        Closes the idle connections, and the others when they're released.
+        """
+        with self._lock:
+            self._closed = True
+            idle = [c for connections in self._idle.values() for c in connections]
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def _acquire(self, origin, reuse=True):
+        """
+        Returns a tuple (connection, reused) with an idle connection for the
+        given origin if reuse is set and there is one, or a new one.
+        """
+        with self._lock:
+            if reuse and self._idle.get(origin):
+                return self._idle[origin].pop(), True
+
+        scheme, host, port = origin
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self._timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self._timeout), False
+
+    def _release(self, origin, connection):
+        """
+        Returns the connection to the pool.
+        """
+        with self._lock:
+            if not self._closed:
+                self._idle.setdefault(origin, []).append(connection)
+                return
+        connection.close()
+
+
+class HttpPollBackend(Backend):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Backend that polls HTTP endpoints returning JSON:
+
+      entities:
+        sensor.power:
+          url: http://device/api/status
+          interval: 5  # seconds, default: interval of the backend
+          state: $.power.current  # JSONPath of the state
+          attributes:  # JSONPaths of the attributes
+            unit_of_measurement: $.power.unit
+          services:  # requests for call_service(), data is merged into body
+            turn_on:
+              method: POST
+              url: http://device/api/relay
+              body: {"on": true}
+
+    Entities with the same URL share one request, polled at the shortest of
+    their intervals. Polls are jittered by a random fraction (jitter) of the
+    interval, so they don't synchronize. Unchanged payloads are detected
+    with ETag and Last-Modified. Boolean states are mapped to "on" and "off".
+    """
+
+    def __init__(self, entities, interval=30, jitter=0.1, **kwargs):
+        super().__init__(**kwargs)
+
+        self._jitter = jitter
+        self._headers = {"Accept": "application/json", **kwargs.get("headers", {})}
+        self._pool = ConnectionPool(kwargs.get("timeout", 10))
+        self._executor = ThreadPoolExecutor(
+            max_workers=kwargs.get("workers", 4), thread_name_prefix="http-poll"
+        )
+
+        self._config = {}
+        self._entities_by_url = {}
+        self._interval_by_url = {}
+        for entity_id, config in entities.items():
+            self._config[entity_id] = {
+                "state": compile_json_path(config.get("state", "$")),
+                "attributes": {
+                    name: compile_json_path(path)
+                    for name, path in config.get("attributes", {}).items()
+                },
+                "services": config.get("services", {}),
+            }
+            if config.get("interval", interval) <= 0:
+                raise ValueError(f"Polling interval of {entity_id} has to be positive")
+
+            url = config["url"]
+            self._entities_by_url.setdefault(url, []).append(entity_id)
+            self._interval_by_url[url] = min(
+                config.get("interval", interval),
+                self._interval_by_url.get(url, float("inf")),
+            )
+
+        # Validators (ETag, Last-Modified) of the last response per URL:
+        self._validators = {}
+
+        # Scheduled polls as heap of (due, url), an entry is only valid if it
+        # matches the due time of the URL. URLs being polled are not in _due:
+        self._condition = threading.Condition()
+        self._schedule = []
+        self._due = {}
+        self._repoll = set()
+
+        # Set by stop():
+        self._stopped = threading.Event()
+
+    def run(self):
+        """
+        Implements the backend main loop, which returns after stop() was
+        called.
+        """
+        with self._condition:
+            now = time.monotonic()
+            for url, interval in self._interval_by_url.items():
+                self._schedule_poll(
+                    url, now + random.uniform(0, interval * self._jitter)
+                )
+
+        while True:
+            with self._condition:
+                while not self._schedule or self._schedule[0][0] > time.monotonic():
+                    if self._stopped.is_set():
+                        return
+                    timeout = (
+                        self._schedule[0][0] - time.monotonic()
+                        if self._schedule
+                        else None
+                    )
+                    self._condition.wait(timeout)
+
+                due, url = heapq.heappop(self._schedule)
+                if self._due.get(url) != due:
+                    # Outdated entry:
+                    continue
+                del self._due[url]
+                if self._stopped.is_set():
+                    return
+
+            self._executor.submit(self._poll, url)
+
+    def stop(self):
+        """
+        Stops polling, can be called from any thread. Requests in progress are
+        completed, but their entities aren't polled again.
+        """
+        with self._condition:
+            self._stopped.set()
+            self._condition.notify()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pool.close()
+
+    def call_service(
+        self,
+        domain: str,
+        service: str,
+        data: Optional[dict] = None,
+        target: Optional[dict] = None,
+        *,
+        callback: Optional[Callable[[bool, Optional[dict]], None]] = None,
+    ):
+        # pylint: disable=too-many-arguments
+        """
+        Sends the request configured for the service of the entity in the
+        target, and polls the entity afterwards.
+
+        :param domain: domain of the service to call, ignored
+        :param service: name of the service to call
+        :param data: data for the service, merged into the configured body
+        :param target: target for the service, containing entity_id
+        :param callback: function that is called with (success, result or
+                         error) when the request was completed
+        """
+        entity_id = (target or {}).get("entity_id")
+        request = self._config.get(entity_id, {}).get("services", {}).get(service)
+        if request is None:
+            logger.error(
+                "No request configured for %s.%s on %s", domain, service, entity_id
+            )
+            if callback is not None:
+                callback(False, {"code": "unknown_service", "message": service})
+            return
+
+        try:
+            self._executor.submit(self._call, entity_id, request, data, callback)
+        except RuntimeError as e:
+            # The executor was shut down by stop():
+            logger.error("Failed to call %s on %s: %s", service, entity_id, e)
+            if callback is not None:
+                callback(False, {"code": "stopped", "message": str(e)})
+
+    def _call(self, entity_id, request, data, callback):
+        """
+        Sends the request of a service call, see call_service().
+        """
+        body = request.get("body")
+        if isinstance(body, dict) or (body is None and data):
+            body = {**(body or {}), **(data or {})}
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+
+        try:
+            status, _, _ = self._pool.request(
+                request.get("method", "POST"),
+                request["url"],
+                body,
+                {
+                    **self._headers,
+                    "Content-Type": "application/json",
+                    **request.get("headers", {}),
+                },
+            )
+        except (http.client.HTTPException, OSError) as e:
+            logger.error("Request for %s failed: %s", entity_id, e)
+            success, result = False, {"code": "request_failed", "message": str(e)}
+        else:
+            success, result = 200 <= status < 300, {"status": status}
+
+        if callback is not None:
+            self._dispatcher.put_call(callback, success, result)
+
+        # Poll the entity to get its new state:
+        for url, entity_ids in self._entities_by_url.items():
+            if entity_id in entity_ids:
+                with self._condition:
+                    if url in self._due:
+                        self._schedule_poll(url, time.monotonic())
+                    else:
+                        self._repoll.add(url)
+
+    def _poll(self, url):
+        """
+        Polls the given URL and updates its entities, then schedules the next
+        poll.
+        """
+        headers = dict(self._headers)
+        etag, last_modified = self._validators.get(url, (None, None))
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            status, response_headers, body = self._pool.request(
+                "GET", url, None, headers
+            )
+            if status == 304:
+                logger.debug("Not modified: %s", url)
+            elif status == 200:
+                self._validators[url] = (
+                    response_headers.get("ETag"),
+                    response_headers.get("Last-Modified"),
+                )
+                self._update_url(url, json.loads(body))
+            else:
+                logger.warning("Polling %s failed with status %d", url, status)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            logger.warning("Polling %s failed: %s", url, e)
+        finally:
+            with self._condition:
+                if url in self._repoll:
+                    self._repoll.discard(url)
+                    due = time.monotonic()
+                else:
+                    interval = self._interval_by_url[url]
+                    due = time.monotonic() + interval * (
+                        1 + random.uniform(-self._jitter, self._jitter)
+                    )
+                self._schedule_poll(url, due)
+
+    def _update_url(self, url, document):
+        """
+        Extracts the entity infos of all entities of the given URL from the
+        document and updates them.
+        """
+        infos = {}
+        for entity_id in self._entities_by_url[url]:
+            config = self._config[entity_id]
+            state = extract_json_path(document, config["state"])
+            if isinstance(state, bool):
+                state = "on" if state else "off"
+            elif state is not None:
+                state = str(state)
+
+            infos[entity_id] = {
+                "entity_id": entity_id,
+                "state": state,
+                "attributes": {
+                    name: extract_json_path(document, path)
+                    for name, path in config["attributes"].items()
+                },
+            }
+
+        self._update_entities(infos)
+
+    def _schedule_poll(self, url, due):
+        """
+        Schedules the next poll of the given URL. Has to be called with the
+        condition held.
+        """
+        self._due[url] = due
+        heapq.heappush(self._schedule, (due, url))
+        self._condition.notify()
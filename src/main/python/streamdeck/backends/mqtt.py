@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+"""
+MQTT backend
+"""
+
+import json
+import logging
+import threading
+import collections
+from typing import Callable, Optional
+from backends.backend import Backend
+
+logger = logging.getLogger("streamdeck.backends.mqtt")
+
+try:
+    import paho.mqtt.client as mqtt
+except ModuleNotFoundError as e:
+    logger.warning("MQTT backend is disabled because of missing modules: %s", e)
+    MODULE_FOUND = False
+else:
+    MODULE_FOUND = True
+
+
+class MqttBackend(Backend):
+    # pylint: disable=too-many-instance-attributes
+    """
+    MQTT backend. Each entity is mapped to a state topic and a command topic:
+
+      entities:
+        light.desk:
+          state_topic: zigbee2mqtt/desk_lamp
+          command_topic: zigbee2mqtt/desk_lamp/set  # default: <state_topic>/set
+          state_key: state  # key of the state in JSON payloads
+          payload_on: "ON"
+          payload_off: "OFF"
+          qos: 0
+
+    The entity info contains the state (payload_on and payload_off are mapped
+    to "on" and "off") and, for JSON object payloads, the payload as
+    attributes. Retained messages provide the initial states.
+
+    The backend subscribes to the state topics exactly, so it only receives
+    the messages of the entities in the layout. Received messages are queued
+    by the network thread and processed by the backend main loop, messages to
+    a topic that is already queued replace the queued one, as only the latest
+    state matters. Published messages are batched for batch_interval seconds,
+    messages with QoS 0 to the same topic are collapsed to the latest one.
+    """
+
+    def __init__(
+        self,
+        host,
+        entities,
+        port=1883,
+        username=None,
+        password=None,
+        **kwargs,
+    ):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        if not MODULE_FOUND:
+            raise RuntimeError("Missing Python modules for MQTT backend")
+
+        super().__init__(**kwargs)
+
+        self._host = host
+        self._port = port
+        self._keepalive = kwargs.get("keepalive", 60)
+        self._batch_interval = kwargs.get("batch_interval", 0.05)
+
+        self._entities_by_topic = {}
+        self._config = {}
+        for entity_id, config in entities.items():
+            config = {
+                "command_topic": f"{config['state_topic']}/set",
+                "state_key": "state",
+                "payload_on": "ON",
+                "payload_off": "OFF",
+                "qos": 0,
+                **config,
+            }
+            self._config[entity_id] = config
+            self._entities_by_topic.setdefault(config["state_topic"], []).append(
+                entity_id
+            )
+
+        self._condition = threading.Condition()
+        self._inbox = collections.OrderedDict()
+        self._outbox = []
+        self._publish_callbacks = {}
+        self._early_acknowledgements = {}
+        self._publishing = 0
+        self._collapsed_messages = 0
+
+        self._client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2, client_id=kwargs.get("client_id", "")
+        )
+        if username is not None:
+            self._client.username_pw_set(username, password)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_message = self._on_message
+        self._client.on_publish = self._on_publish
+
+    @property
+    def collapsed_messages(self) -> int:
+        """
+        Number of received messages that were replaced by a later message to
+        the same topic before they were processed.
+        """
+        return self._collapsed_messages
+
+    def run(self):
+        """
+        Implements the backend main loop.
+        """
+        self._client.connect_async(self._host, self._port, self._keepalive)
+        self._client.loop_start()
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: len(self._inbox) > 0, self._batch_interval
+                )
+                messages = list(self._inbox.items())
+                self._inbox.clear()
+
+            if messages:
+                self._process_messages(messages)
+            self._flush_outbox()
+
+    def call_service(
+        self,
+        domain: str,
+        service: str,
+        data: Optional[dict] = None,
+        target: Optional[dict] = None,
+        *,
+        callback: Optional[Callable[[bool, Optional[dict]], None]] = None,
+    ):
+        # pylint: disable=too-many-arguments
+        """
+        Publishes a command for the entities in the target. turn_on and
+        turn_off publish payload_on and payload_off, all other services publish
+        the data as JSON object.
+
+        :param domain: domain of the service to call, ignored
+        :param service: name of the service to call
+        :param data: data for the service
+        :param target: target for the service, containing entity_id
+        :param callback: function that is called with (success, error) when
+                         the messages were published (QoS 0) or acknowledged
+                         by the broker (QoS 1 and 2)
+        """
+        entity_ids = (target or {}).get("entity_id", [])
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+
+        unknown = [
+            entity_id for entity_id in entity_ids if entity_id not in self._config
+        ]
+        if unknown or not entity_ids:
+            logger.error("Unknown entities for %s.%s: %s", domain, service, unknown)
+            if callback is not None:
+                callback(False, {"code": "unknown_entity", "message": str(unknown)})
+            return
+
+        # Report the result when all messages are done:
+        done = _Countdown(len(entity_ids), callback)
+
+        with self._condition:
+            for entity_id in entity_ids:
+                config = self._config[entity_id]
+                if service == "turn_on":
+                    payload = config["payload_on"]
+                elif service == "turn_off":
+                    payload = config["payload_off"]
+                else:
+                    payload = json.dumps(data or {})
+
+                self._outbox.append(
+                    (config["command_topic"], payload, config["qos"], done)
+                )
+
+    def _subscriptions(self):
+        """
+        Returns the state topics to subscribe to, with the highest QoS of
+        their entities. Wildcards aren't used, as they could match topics of
+        devices that aren't in the layout.
+        """
+        return [
+            (
+                topic,
+                max(self._config[entity_id]["qos"] for entity_id in entity_ids),
+            )
+            for topic, entity_ids in self._entities_by_topic.items()
+        ]
+
+    def _process_messages(self, messages):
+        """
+        Parses the received messages and updates the entities.
+        """
+        infos = {}
+        for topic, payload in messages:
+            for entity_id in self._entities_by_topic.get(topic, []):
+                infos[entity_id] = self._parse_payload(entity_id, payload)
+
+        self._update_entities(infos)
+
+    def _parse_payload(self, entity_id, payload):
+        """
+        Returns the entity info for the given payload.
+        """
+        config = self._config[entity_id]
+        text = payload.decode("utf8", errors="replace")
+
+        attributes = {}
+        state = text
+        try:
+            value = json.loads(text)
+        except ValueError:
+            pass
+        else:
+            if isinstance(value, dict):
+                attributes = value
+                state = value.get(config["state_key"])
+            else:
+                state = value
+
+        if state == config["payload_on"]:
+            state = "on"
+        elif state == config["payload_off"]:
+            state = "off"
+        elif state is not None and not isinstance(state, str):
+            state = str(state)
+
+        return {"entity_id": entity_id, "state": state, "attributes": attributes}
+
+    def _flush_outbox(self):
+        """
+        Publishes the batched messages. Only the latest message with QoS 0 to
+        each topic is published, the others are reported as done.
+        """
+        with self._condition:
+            outbox = self._outbox
+            self._outbox = []
+        if not outbox:
+            return
+
+        latest = {}
+        for index, (topic, _, qos, _) in enumerate(outbox):
+            if qos == 0:
+                latest[topic] = index
+
+        for index, (topic, payload, qos, done) in enumerate(outbox):
+            if qos == 0 and latest[topic] != index:
+                # Superseded by a later message:
+                done(True)
+                continue
+
+            if qos == 0:
+                info = self._client.publish(topic, payload, qos)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    logger.error("Failed to publish to %s: %s", topic, info.rc)
+                    done(False, {"code": "publish_failed", "message": str(info.rc)})
+                else:
+                    done(True)
+            else:
+                self._publish_acknowledged(topic, payload, qos, done)
+
+    def _publish_acknowledged(self, topic, payload, qos, done):
+        """
+        Publishes a message with QoS 1 or 2, done is called when the broker
+        acknowledged it.
+
+        The acknowledgement can arrive before publish() returned the message
+        ID. publish() isn't called with the lock held, as paho calls
+        _on_publish() holding its own lock, which publish() takes as well.
+        Instead, _on_publish() keeps the acknowledgements of unknown messages
+        while messages are being published, which are checked here.
+        """
+        with self._condition:
+            self._publishing += 1
+
+        info = self._client.publish(topic, payload, qos)
+
+        with self._condition:
+            self._publishing -= 1
+            reason_code = self._early_acknowledgements.pop(info.mid, None)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS and reason_code is None:
+                self._publish_callbacks[info.mid] = done
+            if self._publishing == 0:
+                # The rest belongs to messages with QoS 0:
+                self._early_acknowledgements.clear()
+
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error("Failed to publish to %s: %s", topic, info.rc)
+            done(False, {"code": "publish_failed", "message": str(info.rc)})
+        elif reason_code is not None:
+            self._acknowledge(done, reason_code)
+
+    def _on_connect(self, client, _, __, reason_code, ___):
+        """
+        Handler that is called when the connection to the broker is established.
+        """
+        if reason_code.is_failure:
+            logger.error("MQTT connection failed: %s", reason_code)
+            return
+
+        logger.info("MQTT connection opened")
+        subscriptions = self._subscriptions()
+        logger.debug("Subscribing to %s", subscriptions)
+        client.subscribe(subscriptions)
+
+    def _on_disconnect(self, _, __, ___, reason_code, ____):
+        """
+        Handler that is called when the connection to the broker is closed.
+        """
+        logger.info("MQTT connection closed: %s", reason_code)
+
+        # Messages without acknowledgement won't get one anymore:
+        with self._condition:
+            callbacks = list(self._publish_callbacks.values())
+            self._publish_callbacks.clear()
+            self._early_acknowledgements.clear()
+        for done in callbacks:
+            self._dispatcher.put_call(
+                done, False, {"code": "connection_closed", "message": str(reason_code)}
+            )
+
+    def _on_message(self, _, __, message):
+        """
+        Handler for received messages, called by the network thread.
+        """
+        with self._condition:
+            if message.topic in self._inbox:
+                self._collapsed_messages += 1
+            self._inbox[message.topic] = message.payload
+            self._condition.notify()
+
+    def _on_publish(self, _, __, mid, reason_code, ___):
+        """
+        Handler that is called when a published message was acknowledged,
+        called by the network thread.
+        """
+        with self._condition:
+            done = self._publish_callbacks.pop(mid, None)
+            if done is None:
+                if self._publishing:
+                    # Reported by _publish_acknowledged():
+                    self._early_acknowledgements[mid] = reason_code
+                return
+
+        self._acknowledge(done, reason_code)
+
+    def _acknowledge(self, done, reason_code):
+        """
+        Reports the acknowledgement of a published message via the dispatch
+        queue.
+        """
+        if reason_code.is_failure:
+            self._dispatcher.put_call(
+                done, False, {"code": "publish_failed", "message": str(reason_code)}
+            )
+        else:
+            self._dispatcher.put_call(done, True)
+
+
+class _Countdown:
+    # pylint: disable=too-few-public-methods
+    """
+    Calls the callback once it was called the given number of times, with
+    success only if all calls succeeded.
+    """
+
+    def __init__(self, count, callback):
+        self._lock = threading.Lock()
+        self._count = count
+        self._error = None
+        self._callback = callback
+
+    def __call__(self, success, error=None):
+        with self._lock:
+            if not success and self._error is None:
+                self._error = error
+            self._count -= 1
+            if self._count != 0:
+                return
+
+        if self._callback is not None:
+            self._callback(self._error is None, self._error)
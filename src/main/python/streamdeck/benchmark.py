@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""
+Compares rendering in process with rendering in a worker process, by the
+render throughput and by the latency of a thread running concurrently, which
+stands in for key press handling and the backends.
+"""
+
+import time
+import threading
+import statistics
+import yaml
+import typer
+from image import ImageRenderer
+from render import collect_appearances
+from render_worker import RenderWorker
+
+app = typer.Typer()
+
+
+class _LatencyProbe(threading.Thread):
+    """
+    Thread that repeatedly sleeps for a short interval and records how much
+    later than requested it wakes up.
+    """
+
+    def __init__(self, interval=0.001):
+        super().__init__(name="latency-probe", daemon=True)
+        self.delays = []
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            time.sleep(self._interval)
+            self.delays.append(time.perf_counter() - start - self._interval)
+
+    def stop(self):
+        """
+        Stops the thread and waits for it.
+        """
+        self._stopped.set()
+        self.join()
+
+
+def run_benchmark(renderer, appearances, rounds):
+    """
+    Renders the appearances the given number of times, each time with a
+    unique title so no cache is hit, and returns a tuple (renders per second,
+    mean and maximum delay of the latency probe in seconds).
+    """
+    probe = _LatencyProbe()
+    probe.start()
+
+    start = time.perf_counter()
+    count = 0
+    for round_index in range(rounds):
+        for appearance in appearances:
+            renderer.render_animation(
+                {**appearance, "title": f"{appearance['title']} {round_index}"}
+            )
+            count += 1
+    seconds = time.perf_counter() - start
+
+    probe.stop()
+    return count / seconds, statistics.mean(probe.delays), max(probe.delays)
+
+
+@app.command()
+def main(
+    layout: str = typer.Argument(..., help="path to the layout YAML file"),
+    rounds: int = typer.Option(5, help="number of times each appearance is rendered"),
+    size: int = typer.Option(72, help="edge length of the key images in pixels"),
+):
+    """
+    Compares rendering in process with rendering in a worker process.
+    """
+    with open(layout, encoding="utf8") as file_handle:
+        layout_data = yaml.safe_load(file_handle)
+
+    appearances = [
+        entry["appearance"] for entry in collect_appearances(layout_data["keys"])
+    ]
+    print(f"Rendering {len(appearances)} appearances {rounds} times:")
+
+    renderers = {
+        "in process": ImageRenderer((size, size), layout_data["style"]),
+        "worker process": RenderWorker((size, size), layout_data["style"]),
+    }
+    for name, renderer in renderers.items():
+        renders, mean_delay, max_delay = run_benchmark(renderer, appearances, rounds)
+        print(
+            f"  {name:15} {renders:8.1f} renders/s  probe delay "
+            f"{mean_delay * 1000:6.2f} ms mean, {max_delay * 1000:6.2f} ms max"
+        )
+
+
+if __name__ == "__main__":
+    app()
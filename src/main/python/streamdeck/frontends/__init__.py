@@ -2,10 +2,21 @@
 """
 This module contains all available frontend implementations. A frontend displays the
 keys and informs the main application when a key is pressed.
+
+Implementations are only imported when they are accessed, see registry.Registry.
 """
 
+from registry import Registry
+from frontends.input import PressType
 from frontends.frontend import Frontend
-from frontends.gtk import GtkFrontend
-from frontends.elgato import ElgatoFrontend
 
-AVAILABLE = ["GtkFrontend", "ElgatoFrontend"]
+REGISTRY = Registry(
+    "frontends",
+    {
+        "GtkFrontend": "frontends.gtk",
+        "ElgatoFrontend": "frontends.elgato",
+        "VirtualFrontend": "frontends.virtual",
+    },
+)
+
+__getattr__ = REGISTRY.module_getattr(__name__)
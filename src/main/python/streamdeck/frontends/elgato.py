@@ -4,7 +4,6 @@ Frontend using the python-elgato-streamdeck library, see
 https://github.com/abcminiuser/python-elgato-streamdeck
 """
 
-import time
 import logging
 from PIL import Image
 from StreamDeck.DeviceManager import DeviceManager
@@ -88,18 +87,28 @@ class ElgatoFrontend(Frontend):
 
     def draw(self):
         # pylint: disable=missing-function-docstring
-        with self._deck:
-            for i, image in enumerate(self._images):
+        self.draw_keys(range(len(self._images)))
+
+    def draw_keys(self, key_indices):
+        # pylint: disable=missing-function-docstring
+        deck = self._deck
+        if deck is None:
+            # Disconnected, the keys are drawn again after reconnecting:
+            return
+
+        with deck:
+            for i in key_indices:
+                image = self._images[i]
                 if image is None:
-                    native_img = self._deck.BLANK_KEY_IMAGE
+                    native_img = deck.BLANK_KEY_IMAGE
                 else:
-                    native_img = PILHelper.to_native_format(self._deck, image)
+                    native_img = PILHelper.to_native_format(deck, image.convert("RGB"))
 
-                self._deck.set_key_image(i, native_img)
+                deck.set_key_image(i, native_img)
 
     def run(self):
         # pylint: disable=missing-function-docstring
-        while True:  # TODO: Add stop signal?
+        while not self._stopped.is_set():
             if self._deck is None:
                 if self._connect():
                     self.draw()
@@ -107,7 +116,7 @@ class ElgatoFrontend(Frontend):
                 self._disconnect()
 
             self._timer_callback()
-            time.sleep(1)
+            self._stopped.wait(1)
 
     def set_key(self, key_index: int, image: Image):
         # pylint: disable=missing-function-docstring
@@ -127,6 +136,7 @@ class ElgatoFrontend(Frontend):
         """
         Callback function for key presses.
         """
-        self._update_last_action()
         if state:
-            self._callback(key_index)
+            self._key_down(key_index)
+        else:
+            self._key_up(key_index)
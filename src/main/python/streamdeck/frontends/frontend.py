@@ -5,8 +5,11 @@ Abstract base class for all frontends.
 
 import time
 import logging
+import threading
 from abc import ABC, abstractmethod
+from typing import List
 from PIL import Image
+from frontends.input import KeyInput, PressType
 
 REQUIRED_PARAMETERS = ["rows", "columns"]
 logger = logging.getLogger("streamdeck.frontends.frontend")
@@ -38,6 +41,17 @@ class Frontend(ABC):
         # Store last action:
         self._last_action = time.monotonic()
 
+        # Set by stop():
+        self._stopped = threading.Event()
+
+        # Create input pipeline:
+        self._input = KeyInput(
+            self._pressed,
+            debounce=kwargs.get("debounce", 0),
+            long_press=kwargs.get("long_press"),
+            double_press=kwargs.get("double_press"),
+        )
+
     @abstractmethod
     def clear(self):
         """
@@ -51,12 +65,27 @@ class Frontend(ABC):
         set_key().
         """
 
+    def draw_keys(self, key_indices: List[int]):
+        # pylint: disable=unused-argument
+        """
+        Updates only the keys with the given indices, e.g. for animations.
+        Defaults to draw().
+        """
+        self.draw()
+
     @abstractmethod
     def run(self):
         """
-        Implements the frontend main loop.
+        Implements the frontend main loop, which returns after stop() was
+        called.
         """
 
+    def stop(self):
+        """
+        Stops the frontend main loop, can be called from any thread.
+        """
+        self._stopped.set()
+
     @abstractmethod
     def set_key(self, key_index: int, image: Image):
         """
@@ -84,6 +113,13 @@ class Frontend(ABC):
         """
         return self._enabled
 
+    def set_key_handlers(self, key_index: int, long_press: bool, double_press: bool):
+        """
+        Sets whether the key with the given index handles long presses and
+        double presses, keys that handle neither are pressed on key down.
+        """
+        self._input.set_handlers(key_index, long_press, double_press)
+
     def _timer_callback(self) -> bool:
         """
         Callback function that has to be called by the implementing
@@ -107,3 +143,25 @@ class Frontend(ABC):
         be called by the implementing class at each keypress.
         """
         self._last_action = time.monotonic()
+
+    def _key_down(self, key_index: int):
+        """
+        Feeds a key down event into the input pipeline. Has to be called by
+        the implementing class when a key is pushed down.
+        """
+        self._update_last_action()
+        self._input.key_down(key_index)
+
+    def _key_up(self, key_index: int):
+        """
+        Feeds a key up event into the input pipeline. Has to be called by
+        the implementing class when a key is released.
+        """
+        self._update_last_action()
+        self._input.key_up(key_index)
+
+    def _pressed(self, key_index: int, press_type: PressType):
+        """
+        Callback of the input pipeline, informs the main application.
+        """
+        self._callback(key_index, press_type)
@@ -3,6 +3,7 @@
 Gtk frontend, useful for development purposes
 """
 
+import sys
 import logging
 from PIL import Image
 from frontends import Frontend
@@ -12,11 +13,13 @@ logger = logging.getLogger("streamdeck.frontends.gtk")
 try:
     import gi
 
+    import cairo
+
     gi.require_version("Gtk", "3.0")
-    gi.require_version("GdkPixbuf", "2.0")
+    gi.require_version("Gdk", "3.0")
     from gi.repository import (
         Gtk,
-        GdkPixbuf,
+        Gdk,
         GLib,
     )  # pylint: disable=wrong-import-position
 except ModuleNotFoundError as e:
@@ -25,6 +28,9 @@ except ModuleNotFoundError as e:
 else:
     MODULE_FOUND = True
 
+# Byte order of the pixels of cairo's RGB24 format, native 32-bit integers:
+CAIRO_RAW_MODE = "BGRX" if sys.byteorder == "little" else "XRGB"
+
 
 class GtkFrontend(Frontend):
     """
@@ -49,60 +55,141 @@ class GtkFrontend(Frontend):
         self._grid.set_column_homogeneous(True)
         self._window.add(self._grid)
 
-        # Initialize buttons:
+        # Initialize buttons, each with a drawing area that shows an image
+        # surface of the key, whose pixels are updated in place:
         self._buttons = []
+        self._areas = []
         for row in range(self._layout[0]):
             for col in range(self._layout[1]):
                 button = Gtk.Button()
+                area = Gtk.DrawingArea()
+                area.set_size_request(*self.image_size)
+                button.add(area)
 
                 key_index = row * self._layout[1] + col
-                button.connect("clicked", self._keypress, key_index)
+                area.connect("draw", self._draw_key, key_index)
+                button.connect("button-press-event", self._keypress, key_index)
+                button.connect("button-release-event", self._keyrelease, key_index)
+                # Activation via keyboard:
+                button.connect("clicked", self._clicked, key_index)
 
                 self._buttons.append(button)
+                self._areas.append(area)
                 self._grid.attach(button, col, row, 1, 1)
 
+        # Image data set via set_key() and image data currently shown, as tuples
+        # (size, bytes) or None, and the surfaces of the keys:
+        self._pending = [None] * len(self._buttons)
+        self._shown = [None] * len(self._buttons)
+        self._surfaces = [None] * len(self._buttons)
+        self._window.show_all()
+
         # Initialize regular timer:
         GLib.timeout_add(1000, self._timer_callback)
 
     def clear(self):
         # pylint: disable=missing-function-docstring
-        for button in self._buttons:
-            button.set_label("")
-            button.set_image(None)
+        for i, _ in enumerate(self._pending):
+            self._pending[i] = None
 
     def draw(self):
         # pylint: disable=missing-function-docstring
-        self._window.show_all()
+        # Gtk may only be used from the main loop, but draw() is also called
+        # from other threads:
+        GLib.idle_add(self._update_images, list(self._pending))
 
     @staticmethod
     def run():
         # pylint: disable=missing-function-docstring
         Gtk.main()
 
+    def stop(self):
+        # pylint: disable=missing-function-docstring
+        super().stop()
+        GLib.idle_add(Gtk.main_quit)
+
     def set_key(self, key_index: int, image: Image):
         # pylint: disable=missing-function-docstring
-        # See https://gist.github.com/mozbugbox/10cd35b2872628246140
-        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
-            GLib.Bytes.new(image.tobytes()),
-            GdkPixbuf.Colorspace.RGB,
-            False,
-            8,
-            image.size[0],
-            image.size[1],
-            image.size[0] * 3,
-        ).copy()
-        gtk_image = Gtk.Image.new_from_pixbuf(pixbuf)
-        self._buttons[key_index].set_image(gtk_image)
-        self._buttons[key_index].set_always_show_image(True)
+        self._pending[key_index] = (
+            image.size,
+            image.convert("RGB").tobytes("raw", CAIRO_RAW_MODE),
+        )
 
     def disable(self):
         # pylint: disable=missing-function-docstring
         self.clear()
+        self.draw()
         super().disable()
 
-    def _keypress(self, _, key_index):
+    def _update_images(self, frames):
+        """
+        Updates the images of all keys whose image data changed. Must be called
+        from the main loop.
+
+        :param frames: list of image data as tuples (size, bytes) or None
+        """
+        for key_index, frame in enumerate(frames):
+            if frame == self._shown[key_index]:
+                continue
+
+            if frame is not None:
+                size, data = frame
+                surface = self._surfaces[key_index]
+                if (
+                    surface is None
+                    or (surface.get_width(), surface.get_height()) != size
+                ):
+                    # Rows of RGB24 are never padded, so the data fits as is:
+                    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, *size)
+                    self._surfaces[key_index] = surface
+                    self._areas[key_index].set_size_request(*size)
+
+                surface.flush()
+                surface.get_data()[:] = data
+                surface.mark_dirty()
+
+            self._shown[key_index] = frame
+            self._areas[key_index].queue_draw()
+
+        return False
+
+    def _draw_key(self, _, context, key_index):
+        """
+        Callback function for drawing the image of a key.
+        """
+        if self._shown[key_index] is not None:
+            context.set_source_surface(self._surfaces[key_index], 0, 0)
+            context.paint()
+
+        return False
+
+    def _clicked(self, _, key_index):
+        """
+        Callback function for activations of a button. Clicks with the mouse
+        are handled by _keypress() and _keyrelease() instead, so only
+        activations via keyboard are pressed here.
+        """
+        event = Gtk.get_current_event()
+        if event is not None and event.type == Gdk.EventType.BUTTON_RELEASE:
+            return
+
+        self._key_down(key_index)
+        self._key_up(key_index)
+
+    def _keypress(self, _, event, key_index):
         """
         Callback function for key presses.
         """
-        self._update_last_action()
-        self._callback(key_index)
+        if event.button == 1:
+            self._key_down(key_index)
+
+        return False
+
+    def _keyrelease(self, _, event, key_index):
+        """
+        Callback function for key releases.
+        """
+        if event.button == 1:
+            self._key_up(key_index)
+
+        return False
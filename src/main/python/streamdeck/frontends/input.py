@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+"""
+Input pipeline that turns raw key events into presses.
+"""
+
+import enum
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger("streamdeck.frontends.input")
+
+
+class PressType(enum.Enum):
+    """
+    Type of a key press.
+
+    PRESS: Key was pressed and released
+    LONG_PRESS: Key was held down for at least the long press duration
+    DOUBLE_PRESS: Key was pressed twice within the double press duration
+    """
+
+    PRESS = 1
+    LONG_PRESS = 2
+    DOUBLE_PRESS = 3
+
+
+class KeyInput:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Input pipeline that turns raw key events into presses.
+
+    Key down events within the debounce duration after the last accepted key
+    down event of the same key are ignored. If a long press duration is set,
+    holding a key for that duration results in a long press. If a double press
+    duration is set, a press is delayed by that duration to detect a second
+    press, which results in a double press. Both only apply to keys that
+    handle them, see set_handlers(), keys that handle neither are pressed on
+    key down already.
+
+    The callback is called with the key index and the press type, either from
+    the thread that reported the key event or from a timer thread.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[int, PressType], None],
+        debounce: float = 0,
+        long_press: Optional[float] = None,
+        double_press: Optional[float] = None,
+    ):
+        self._callback = callback
+        self._debounce = debounce
+        self._long_press = long_press
+        self._double_press = double_press
+
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._down = set()
+        self._pressed_on_down = set()
+        self._last_down = {}
+        self._long_pressed = set()
+        self._long_press_timers = {}
+        self._double_press_timers = {}
+
+    def set_handlers(self, key_index: int, long_press: bool, double_press: bool):
+        """
+        Sets whether the key with the given index handles long presses and
+        double presses. By default, keys handle both.
+        """
+        with self._lock:
+            self._handlers[key_index] = (long_press, double_press)
+
+    def key_down(self, key_index: int):
+        """
+        Reports that the key with the given index was pushed down.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if key_index in self._down:
+                return
+            if now < self._last_down.get(key_index, -self._debounce) + self._debounce:
+                logger.debug("Ignoring bouncing key #%d", key_index)
+                return
+
+            self._down.add(key_index)
+            self._last_down[key_index] = now
+
+            long_press, double_press = self._detect(key_index)
+            press = not long_press and not double_press
+            if press:
+                # No long or double press to wait for, the release is ignored:
+                self._pressed_on_down.add(key_index)
+            elif long_press:
+                timer = threading.Timer(
+                    self._long_press, self._long_press_elapsed, [key_index, now]
+                )
+                timer.daemon = True
+                self._long_press_timers[key_index] = timer
+                timer.start()
+
+        if press:
+            self._callback(key_index, PressType.PRESS)
+
+    def key_up(self, key_index: int):
+        """
+        Reports that the key with the given index was released.
+        """
+        with self._lock:
+            if key_index not in self._down:
+                return
+            self._down.discard(key_index)
+            if key_index in self._pressed_on_down:
+                self._pressed_on_down.discard(key_index)
+                return
+
+            timer = self._long_press_timers.pop(key_index, None)
+            if timer is not None:
+                timer.cancel()
+            if key_index in self._long_pressed:
+                # Release after a long press:
+                self._long_pressed.discard(key_index)
+                return
+
+            if not self._detect(key_index)[1]:
+                press_type = PressType.PRESS
+            elif key_index in self._double_press_timers:
+                self._double_press_timers.pop(key_index).cancel()
+                press_type = PressType.DOUBLE_PRESS
+            else:
+                timer = threading.Timer(
+                    self._double_press, self._double_press_elapsed, [key_index]
+                )
+                timer.daemon = True
+                self._double_press_timers[key_index] = timer
+                timer.start()
+                return
+
+        self._callback(key_index, press_type)
+
+    def _detect(self, key_index: int):
+        """
+        Returns whether long presses and double presses are detected for the
+        key with the given index. Has to be called with the lock held.
+        """
+        long_press, double_press = self._handlers.get(key_index, (True, True))
+        return (
+            long_press and self._long_press is not None,
+            double_press and self._double_press is not None,
+        )
+
+    def _long_press_elapsed(self, key_index: int, down_time: float):
+        """
+        Called when a key was held down for the long press duration.
+        """
+        with self._lock:
+            if key_index not in self._down or self._last_down[key_index] != down_time:
+                return
+            self._long_press_timers.pop(key_index, None)
+            self._long_pressed.add(key_index)
+
+        self._callback(key_index, PressType.LONG_PRESS)
+
+    def _double_press_elapsed(self, key_index: int):
+        """
+        Called when no second press followed within the double press duration.
+        """
+        with self._lock:
+            if self._double_press_timers.pop(key_index, None) is None:
+                return
+
+        self._callback(key_index, PressType.PRESS)
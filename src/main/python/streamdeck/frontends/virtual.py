@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+"""
+Virtual frontend without GUI, serves the key images via HTTP and accepts key
+presses the same way. Useful for servers, browsers and load tests.
+"""
+
+import io
+import json
+import math
+import hashlib
+import logging
+import threading
+import socketserver
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+from frontends import Frontend
+
+logger = logging.getLogger("streamdeck.frontends.virtual")
+
+MAX_POLL_TIMEOUT = 60  # seconds
+
+INDEX_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>streamdeck-yaml</title>
+<style>
+body { background: #222; }
+#keys { display: grid; gap: 8px; grid-template-columns: repeat(%(columns)d, %(width)dpx); }
+#keys img { background: black; cursor: pointer; }
+#keys.disabled { opacity: 0.2; }
+</style>
+</head>
+<body>
+<div id="keys"></div>
+<script>
+const keys = document.getElementById("keys");
+for (let i = 0; i < %(count)d; i++) {
+  const img = document.createElement("img");
+  img.width = %(width)d;
+  img.height = %(height)d;
+  img.onclick = () => fetch(`keys/${i}/press`, {method: "POST"});
+  keys.appendChild(img);
+}
+async function poll(generation) {
+  try {
+    const response = await fetch(`frames?since=${generation}`);
+    const frames = await response.json();
+    keys.className = frames.enabled ? "" : "disabled";
+    frames.keys.forEach((etag, i) => {
+      keys.children[i].src = etag === null ? "" : `keys/${i}.png?etag=${etag}`;
+    });
+    generation = frames.generation;
+  } catch (e) {
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+  poll(generation);
+}
+poll(-1);
+</script>
+</body>
+</html>
+"""
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    """
+    HTTP server listening on a Unix socket.
+    """
+
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the virtual frontend, see VirtualFrontend.
+    """
+
+    protocol_version = "HTTP/1.1"
+    frontend = None
+
+    def do_GET(self):
+        # pylint: disable=invalid-name,missing-function-docstring
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        if parts == [""]:
+            self._send(HTTPStatus.OK, "text/html", self.frontend.index_html())
+        elif parts == ["frames"]:
+            try:
+                since = int(query.get("since", ["-1"])[0])
+                timeout = float(query.get("timeout", ["30"])[0])
+            except ValueError:
+                self._send(HTTPStatus.BAD_REQUEST)
+                return
+            if timeout < 0 or math.isnan(timeout):
+                self._send(HTTPStatus.BAD_REQUEST)
+                return
+
+            frames = self.frontend.wait_for_frames(
+                since, min(timeout, MAX_POLL_TIMEOUT)
+            )
+            self._send(
+                HTTPStatus.OK,
+                "application/json",
+                json.dumps(frames).encode(),
+                {"Cache-Control": "no-store"},
+            )
+        elif len(parts) == 2 and parts[0] == "keys" and "." in parts[1]:
+            key_index, image_format = parts[1].split(".", 1)
+            frame = self.frontend.get_frame(self._parse_index(key_index))
+            if frame is None or image_format not in ("png", "raw"):
+                self._send(HTTPStatus.NOT_FOUND)
+                return
+
+            etag = f'"{frame.etag}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if etag in self.headers.get("If-None-Match", ""):
+                self._send(HTTPStatus.NOT_MODIFIED, headers=headers)
+            elif image_format == "png":
+                self._send(HTTPStatus.OK, "image/png", frame.png, headers)
+            else:
+                headers["X-Image-Size"] = f"{frame.size[0]}x{frame.size[1]}"
+                self._send(
+                    HTTPStatus.OK, "application/octet-stream", frame.raw, headers
+                )
+        else:
+            self._send(HTTPStatus.NOT_FOUND)
+
+    def do_POST(self):
+        # pylint: disable=invalid-name,missing-function-docstring
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "keys":
+            self._send(HTTPStatus.NOT_FOUND)
+            return
+
+        key_index = self._parse_index(parts[1])
+        if key_index is None:
+            self._send(HTTPStatus.NOT_FOUND)
+        elif parts[2] in ("press", "down", "up"):
+            self.frontend.key_event(key_index, parts[2])
+            self._send(HTTPStatus.NO_CONTENT)
+        else:
+            self._send(HTTPStatus.NOT_FOUND)
+
+    def address_string(self):
+        # pylint: disable=missing-function-docstring
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin,missing-function-docstring
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _parse_index(self, text):
+        """
+        Returns the key index in the given text, or None if invalid.
+        """
+        try:
+            key_index = int(text)
+        except ValueError:
+            return None
+
+        return key_index if 0 <= key_index < self.frontend.key_count else None
+
+    def _send(self, status, content_type=None, body=b"", headers=None):
+        """
+        Sends a response with the given status, content type, body and headers.
+        """
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.wfile.write(body)
+
+
+class _Frame:
+    # pylint: disable=too-few-public-methods
+    """
+    Image of a key as served by the virtual frontend. The PNG is only encoded
+    when it is requested for the first time, from a copy of the image, as the
+    image itself may be reused by the renderer.
+    """
+
+    def __init__(self, image: Image):
+        self.size = image.size
+        self.raw = image.convert("RGB").tobytes()
+        self.etag = hashlib.blake2b(self.raw, digest_size=12).hexdigest()
+        self._png = None
+
+    @property
+    def png(self) -> bytes:
+        """
+        The image encoded as PNG.
+        """
+        if self._png is None:
+            buffer = io.BytesIO()
+            Image.frombytes("RGB", self.size, self.raw).save(buffer, "PNG")
+            self._png = buffer.getvalue()
+
+        return self._png
+
+
+class VirtualFrontend(Frontend):
+    """
+    Virtual frontend without GUI, serves the key images via HTTP and accepts key
+    presses the same way. Useful for servers, browsers and load tests.
+
+    Listens on host and port (default: 127.0.0.1:8080), or on a Unix socket if
+    socket is set. Endpoints:
+      * GET /: HTML page that shows the keys
+      * GET /frames?since=<generation>&timeout=<seconds>: waits until the
+        frames are newer than the given generation (long poll, at most 60
+        seconds, default: 30) and returns the generation, whether the
+        frontend is enabled and the ETag of each key image
+      * GET /keys/<index>.png, /keys/<index>.raw: key image as PNG or raw RGB
+        bytes, supports conditional requests with If-None-Match
+      * POST /keys/<index>/press, /keys/<index>/down, /keys/<index>/up: key
+        press, or key pushed down and released separately
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.image_size = tuple(kwargs.get("image_size", (72, 72)))
+        self.key_count = self._layout[0] * self._layout[1]
+
+        self._pending = [None] * self.key_count
+        self._frames = [None] * self.key_count
+        self._generation = 0
+        self._condition = threading.Condition()
+
+        handler = type("RequestHandler", (_RequestHandler,), {"frontend": self})
+        if "socket" in kwargs:
+            self._server = _UnixHTTPServer(kwargs["socket"], handler)
+            logger.info("Listening on Unix socket %s", kwargs["socket"])
+        else:
+            address = (kwargs.get("host", "127.0.0.1"), kwargs.get("port", 8080))
+            self._server = ThreadingHTTPServer(address, handler)
+            logger.info("Listening on http://%s:%d/", *address)
+
+    def clear(self):
+        # pylint: disable=missing-function-docstring
+        for i, _ in enumerate(self._pending):
+            self._pending[i] = None
+
+    def draw(self):
+        # pylint: disable=missing-function-docstring
+        with self._condition:
+            changed = False
+            for i, frame in enumerate(self._pending):
+                old_etag = None if self._frames[i] is None else self._frames[i].etag
+                new_etag = None if frame is None else frame.etag
+                if old_etag != new_etag:
+                    self._frames[i] = frame
+                    changed = True
+
+            if changed:
+                self._publish()
+
+    def run(self):
+        # pylint: disable=missing-function-docstring
+        threading.Thread(
+            target=self._server.serve_forever, name="virtual-frontend", daemon=True
+        ).start()
+
+        while not self._stopped.wait(1):
+            self._timer_callback()
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_key(self, key_index: int, image: Image):
+        # pylint: disable=missing-function-docstring
+        self._pending[key_index] = _Frame(image)
+
+    def disable(self):
+        # pylint: disable=missing-function-docstring
+        with self._condition:
+            super().disable()
+            self._publish()
+
+    def enable(self):
+        # pylint: disable=missing-function-docstring
+        with self._condition:
+            super().enable()
+            self._publish()
+
+    def index_html(self) -> bytes:
+        """
+        Returns the HTML page that shows the keys.
+        """
+        return (
+            INDEX_HTML
+            % {
+                "columns": self._layout[1],
+                "count": self.key_count,
+                "width": self.image_size[0],
+                "height": self.image_size[1],
+            }
+        ).encode()
+
+    def get_frame(self, key_index):
+        """
+        Returns the currently shown frame of the key with the given index, or
+        None if there is none.
+        """
+        if key_index is None:
+            return None
+
+        return self._frames[key_index]
+
+    def wait_for_frames(self, since: int, timeout: float) -> dict:
+        """
+        Waits until the generation of the frames is newer than the given one,
+        or the timeout passed, and returns the current state of the frames.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._generation > since, timeout)
+
+            return {
+                "generation": self._generation,
+                "enabled": self.enabled,
+                "keys": [
+                    None if frame is None else frame.etag for frame in self._frames
+                ],
+            }
+
+    def key_event(self, key_index: int, event: str):
+        """
+        Feeds a key event ("press", "down" or "up") into the input pipeline.
+        """
+        if event in ("press", "down"):
+            self._key_down(key_index)
+        if event in ("press", "up"):
+            self._key_up(key_index)
+
+    def _publish(self):
+        """
+        Increments the generation and wakes up waiting long polls. Has to be
+        called with the condition held.
+        """
+        self._generation += 1
+        self._condition.notify_all()
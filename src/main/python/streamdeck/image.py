@@ -3,16 +3,54 @@
 Class that renders the information about a key (icon, title, ...) as an image.
 """
 
+import io
 import os.path
+import collections
+import hashlib
+import logging
+from typing import List, Tuple
 import numpy
-from PIL import Image, ImageFont, ImageDraw, ImageColor
+from PIL import Image, ImageDraw, ImageColor, ImageSequence
 from keys import KeyBase
+from animation import Animation
+from text import TextEngine
 
 ICON_PATH = os.path.join(os.path.dirname(__file__), "../../resources/icons")
+ICON_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "streamdeck-yaml",
+    "icons",
+)
+ICON_SIZE_RATIO = 0.6  # icon edge length relative to the key size
+SPARKLINE_WIDTH = 2  # line width of sparklines in pixels
+SPINNER_FRAMES = 12  # frames of the spinner shown for pending actions
+SPINNER_PERIOD = 1  # seconds per spinner revolution
+ANIMATION_CACHE_SIZE = 128  # rendered appearances kept in memory
+TITLE_HEIGHT_RATIO = 0.5  # maximum title height relative to the key size
+DEFAULT_MAX_LINES = 2  # lines titles are wrapped to
+DEFAULT_MIN_FONTSIZE = 8  # font size below which titles are truncated instead
+logger = logging.getLogger("streamdeck.image")
+
+try:
+    import cairosvg
+except (ModuleNotFoundError, OSError) as e:
+    logger.info("SVG icons are disabled because of missing modules: %s", e)
+    SVG_SUPPORTED = False
+else:
+    SVG_SUPPORTED = True
+
+
+def cacheable(appearance: dict) -> bool:
+    """
+    Returns whether the frames of the given appearance are cached. Appearances
+    with a sparkline aren't, as they change with every new value and would
+    evict all others.
+    """
+    return not appearance.get("sparkline")
 
 
 class ImageRenderer:
-    # pylint: disable=too-few-public-methods
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
     """
     Class that renders the information about a key (icon, title, ...) as an image.
     """
@@ -20,14 +58,69 @@ class ImageRenderer:
     def __init__(self, size, config):
         self._config = config
         self._size = size
+        self._icon_size = self._config.get(
+            "icon_size", round(min(self._size) * ICON_SIZE_RATIO)
+        )
+        self._icon_cache_path = self._config.get("icon_cache", ICON_CACHE_PATH)
+        self._icons = {}
+        self._icon_frames = {}
+        self._animations = collections.OrderedDict()
+        self._text = TextEngine(
+            self._config["font"],
+            self._config["max_fontsize"],
+            self._config.get("min_fontsize", DEFAULT_MIN_FONTSIZE),
+        )
 
     def render(self, key: KeyBase) -> Image:
         """
-        Renders an image for the given key and returns the Pillow image.
+        Renders an image for the given key and returns the Pillow image. For
+        animated keys, this is the first frame.
         """
-        # Get the key's appearance:
-        appearance = key.appearance
+        return self.render_animation(key.appearance).frames[0]
+
+    def render_animation(self, appearance: dict, key_index=None) -> Animation:
+        # pylint: disable=unused-argument
+        """
+        Renders the frames for the given appearance of a key. Static
+        appearances result in a single frame. The frames are cached per
+        appearance (least recently used ones are evicted, see cacheable()), so
+        each animation is only rendered once. The index of the key the frames
+        are shown on is only used by RenderWorker.
+        """
+        cache_key = tuple(sorted(appearance.items()))
+        if cache_key in self._animations:
+            self._animations.move_to_end(cache_key)
+            return self._animations[cache_key]
+
+        icon_frames, durations = self._get_icon_frames(appearance["icon"])
+        if appearance.get("pending") and len(icon_frames) == 1:
+            icon_frames = icon_frames * SPINNER_FRAMES
+            durations = [SPINNER_PERIOD / SPINNER_FRAMES] * SPINNER_FRAMES
+
+        frames = []
+        start = 0
+        for icon, duration in zip(icon_frames, durations):
+            frame = self._render_frame(appearance, icon)
+            if appearance.get("pending"):
+                self._draw_spinner(
+                    frame, appearance["icon_color"], 360 * start / SPINNER_PERIOD
+                )
+            frames.append(frame.convert("RGB"))
+            start += duration
+
+        animation = Animation(frames, durations)
+        if cacheable(appearance):
+            if len(self._animations) >= ANIMATION_CACHE_SIZE:
+                # Drop the least recently used entry:
+                self._animations.popitem(last=False)
+            self._animations[cache_key] = animation
+
+        return animation
 
+    def _render_frame(self, appearance: dict, icon: Image) -> Image:
+        """
+        Renders a single frame of the given appearance with the given icon.
+        """
         # Create blank, black image:
         result = Image.new("RGBA", self._size, (0, 0, 0))
         result_draw = ImageDraw.Draw(result)
@@ -40,42 +133,184 @@ class ImageRenderer:
         )
         # ^- TODO: Don't hardcode corner radius?
 
-        # Add icon:
-        with Image.open(os.path.join(ICON_PATH, f"{appearance['icon']}.png")).convert(
-            "RGBA"
-        ) as icon:
+        padding = self._config["padding"]
+        title = self._text.layout(
+            appearance["title"],
+            self._size[0] - 2 * padding,
+            round((self._size[1] - 2 * padding) * TITLE_HEIGHT_RATIO),
+            self._config.get("max_lines", DEFAULT_MAX_LINES),
+        )
+        title_top = self._size[1] - padding - title.height
+
+        if appearance.get("value") is not None:
+            # Add value and sparkline instead of the icon:
+            self._draw_value(result, appearance, title_top)
+        else:
+            # Add icon, scaled down if the title has multiple lines and needs
+            # the space:
+            if len(title.lines) > 1 and icon.size[1] > title_top - padding:
+                size = max(title_top - padding, 1)
+                icon = icon.resize((size, size), Image.Resampling.LANCZOS)
             icon_color = self._colorize_image(icon, appearance["icon_color"])
             result.alpha_composite(
                 icon_color,
-                ((result.size[0] - icon.size[0]) // 2, self._config["padding"]),
+                ((result.size[0] - icon.size[0]) // 2, padding),
             )
 
         # Add text:
-        font = self._get_fitting_font(appearance["title"])
-        result_draw.text(
-            (result.size[0] // 2, result.size[1] - self._config["padding"]),
-            appearance["title"],
-            font=font,
-            anchor="ms",
-            fill=(0, 0, 0),
+        self._text.draw(result, title, (padding, title_top), (0, 0, 0))
+
+        return result
+
+    def _draw_spinner(self, image: Image, color: str, angle: float):
+        """
+        Draws a spinner, rotated by the given angle, in the top right corner
+        of the image.
+        """
+        padding = self._config["padding"]
+        radius = min(self._size) // 10
+        ImageDraw.Draw(image).arc(
+            [
+                (self._size[0] - padding - 2 * radius, padding),
+                (self._size[0] - padding, padding + 2 * radius),
+            ],
+            angle,
+            angle + 270,
+            fill=color,
+            width=max(radius // 2, 1),
         )
 
-        return result.convert("RGB")
+    def _draw_value(self, image: Image, appearance: dict, bottom: int):
+        """
+        Draws the value of the appearance at the top and its sparkline below,
+        down to the given y coordinate.
+        """
+        padding = self._config["padding"]
+        value = self._text.layout(
+            appearance["value"], self._size[0] - 2 * padding, bottom - padding
+        )
+        self._text.draw(image, value, (padding, padding), (0, 0, 0))
 
-    def _get_fitting_font(self, text: str):
+        self._draw_sparkline(
+            ImageDraw.Draw(image),
+            appearance.get("sparkline", ()),
+            (padding, padding * 3 // 2 + value.size, self._size[0] - padding, bottom),
+            appearance["icon_color"],
+        )
+
+    @staticmethod
+    def _draw_sparkline(draw: ImageDraw, values, box, color: str):
+        """
+        Draws the values as line graph into the given box (left, top, right,
+        bottom), scaled so that the minimum and maximum touch its edges.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        left, top, right, bottom = box
+        if len(values) < 2 or bottom <= top:
+            return
+
+        low, high = values.min(), values.max()
+        if high > low:
+            y = bottom - (values - low) * ((bottom - top) / (high - low))
+        else:
+            y = numpy.full_like(values, (top + bottom) / 2)
+        x = numpy.linspace(left, right, len(values))
+
+        draw.line(
+            numpy.column_stack((x, y)).ravel().tolist(),
+            fill=color,
+            width=SPARKLINE_WIDTH,
+            joint="curve",
+        )
+
+    def _get_icon_frames(self, name: str) -> Tuple[List[Image], List[float]]:
+        """
+        Returns the frames of the icon with the given name, scaled to the icon
+        size, and their durations in seconds. GIF icons can have multiple
+        frames, all other icons have a single frame.
+        """
+        gif_path = os.path.join(ICON_PATH, f"{name}.gif")
+        if not os.path.exists(gif_path):
+            return [self._get_icon(name)], [0]
+
+        if name not in self._icon_frames:
+            frames = []
+            durations = []
+            with Image.open(gif_path) as image:
+                for frame in ImageSequence.Iterator(image):
+                    frames.append(
+                        frame.convert("RGBA").resize(
+                            (self._icon_size, self._icon_size),
+                            Image.Resampling.LANCZOS,
+                        )
+                    )
+                    # Like browsers, use 100 ms for frames without duration:
+                    durations.append((frame.info.get("duration") or 100) / 1000)
+
+            self._icon_frames[name] = (frames, durations)
+
+        return self._icon_frames[name]
+
+    def _get_icon(self, name: str) -> Image:
         """
-        Returns the largest font that fits on the image with the given text, capped
-        by the configured maximum fontsize.
+        Returns the icon with the given name, scaled to the icon size. SVG icons
+        are preferred over PNG icons if SVG support is available.
+        """
+        if name not in self._icons:
+            svg_path = os.path.join(ICON_PATH, f"{name}.svg")
+            if SVG_SUPPORTED and os.path.exists(svg_path):
+                icon = self._rasterize_svg(svg_path)
+            else:
+                with Image.open(os.path.join(ICON_PATH, f"{name}.png")) as image:
+                    icon = image.convert("RGBA")
+
+            if icon.size != (self._icon_size, self._icon_size):
+                icon = icon.resize(
+                    (self._icon_size, self._icon_size), Image.Resampling.LANCZOS
+                )
+
+            self._icons[name] = icon
+
+        return self._icons[name]
+
+    def _rasterize_svg(self, path: str) -> Image:
         """
-        last_font = None
-        for size in range(1, self._config["max_fontsize"] + 1):
-            font = ImageFont.truetype(self._config["font"], size)
+        Rasterizes the SVG file at the given path to the icon size. The result is
+        stored in the icon cache directory, named by the hash of the SVG file and
+        the target size, so it is only rasterized again if one of them changes.
+        """
+        with open(path, "rb") as file_handle:
+            svg = file_handle.read()
+
+        digest = hashlib.sha256(svg).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(path))[0]
+        cache_file = os.path.join(
+            self._icon_cache_path,
+            f"{name}-{self._icon_size}x{self._icon_size}-{digest}.png",
+        )
+
+        if os.path.exists(cache_file):
+            logger.debug("Using cached rasterization %s", cache_file)
+            with Image.open(cache_file) as image:
+                return image.convert("RGBA")
+
+        logger.info("Rasterizing icon %s at %dpx", name, self._icon_size)
+        png = cairosvg.svg2png(
+            bytestring=svg,
+            output_width=self._icon_size,
+            output_height=self._icon_size,
+        )
 
-            if font.getlength(text) > (self._size[0] - 2 * self._config["padding"]):
-                return last_font
-            last_font = font
+        try:
+            os.makedirs(self._icon_cache_path, exist_ok=True)
+            with open(f"{cache_file}.tmp", "wb") as file_handle:
+                file_handle.write(png)
+            os.replace(f"{cache_file}.tmp", cache_file)
+        except OSError as e:
+            logger.warning("Failed to write icon cache %s: %s", cache_file, e)
 
-        return font
+        with Image.open(io.BytesIO(png)) as image:
+            return image.convert("RGBA")
 
     @staticmethod
     def _colorize_image(image: Image, color: str) -> Image:
@@ -1,17 +1,27 @@
 #!/usr/bin/python3
 """
 This module contains all available key implementations.
+
+Implementations are only imported when they are accessed, see registry.Registry.
 """
 
-import pkgutil
-import inspect
-import importlib
+from registry import Registry
 from keys.base import KeyBase, KeyPressResult
 
-AVAILABLE = []
-for _, module_name, _ in pkgutil.iter_modules(__path__):
-    module = importlib.import_module(f"{__name__}.{module_name}")
-    for class_name, class_obj in inspect.getmembers(module, inspect.isclass):
-        if class_name.endswith("Key"):
-            AVAILABLE.append(class_name)
-            locals()[class_name] = class_obj
+REGISTRY = Registry(
+    "keys",
+    {
+        "SubMenuKey": "keys.generic",
+        "BackKey": "keys.generic",
+        "PreviousPageKey": "keys.generic",
+        "NextPageKey": "keys.generic",
+        "MacroKey": "keys.macro",
+        "HomeAssistantToggleKey": "keys.home_assistant",
+        "HomeAssistantScriptKey": "keys.home_assistant",
+        "HomeAssistantClimatePresetKey": "keys.home_assistant",
+        "HomeAssistantSensorKey": "keys.home_assistant",
+        "HomeAssistantQueryMenuKey": "keys.home_assistant",
+    },
+)
+
+__getattr__ = REGISTRY.module_getattr(__name__)
@@ -5,7 +5,7 @@ Contains an abstract base class for key classes.
 
 import enum
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import List, Optional, Set, Tuple
 
 
 class KeyPressResult(enum.Enum):
@@ -14,12 +14,16 @@ class KeyPressResult(enum.Enum):
 
     MENU_ENTER: Enter the submenu given as `details`
     MENU_BACK: Return from submenu, `details` is None
-    REDRAW: Redraw the display, `details` is None
+    REDRAW: Redraw the key, `details` is None
+    PAGE_PREVIOUS: Show the previous page of the submenu, `details` is None
+    PAGE_NEXT: Show the next page of the submenu, `details` is None
     """
 
     MENU_ENTER = 1
     MENU_BACK = 2
     REDRAW = 3
+    PAGE_PREVIOUS = 4
+    PAGE_NEXT = 5
 
 
 class KeyBase(ABC):
@@ -27,9 +31,11 @@ class KeyBase(ABC):
     Abstract base class for key classes.
     """
 
-    def __init__(self, values, backend):
+    def __init__(self, values, backend, redraw_callback=None, backends=None):
         self._values = values
         self._backend = backend
+        self._backends = backends or {}
+        self._redraw_callback = redraw_callback
 
         if "icon" in self._values:
             self._icon = self._values["icon"]
@@ -57,6 +63,34 @@ class KeyBase(ABC):
             "icon_color": self._icon_color,
         }
 
+    @classmethod
+    def appearances(cls, values) -> List[dict]:
+        """
+        Returns all appearances a key with the given values can have, without
+        needing a backend, e.g. to pre-render them. Defaults to the single
+        appearance given by the values.
+        """
+        return [
+            {
+                "title": values.get("title", getattr(cls, "_title", cls.__name__)),
+                "icon": values.get("icon", getattr(cls, "_icon", "help")),
+                "icon_color": values.get(
+                    "icon_color", getattr(cls, "_icon_color", "black")
+                ),
+            }
+        ]
+
+    @classmethod
+    def required_attributes(cls, values) -> Optional[Set[str]]:
+        # pylint: disable=unused-argument
+        """
+        Returns the names of the entity attributes a key with the given values
+        reads, so backends can drop all others, or None if it needs all of
+        them. Defaults to the class attribute _required_attributes, or None.
+        """
+        required = getattr(cls, "_required_attributes", None)
+        return None if required is None else set(required)
+
     @abstractmethod
     def pressed(self) -> Tuple[KeyPressResult, dict]:
         """
@@ -65,8 +99,48 @@ class KeyBase(ABC):
         :return: a tuple (result, details)
         """
 
+    def long_pressed(self) -> Tuple[KeyPressResult, dict]:
+        """
+        This method is called when the key is held down for the long press
+        duration of the frontend. Defaults to pressed().
+
+        :return: a tuple (result, details)
+        """
+        return self.pressed()
+
+    def double_pressed(self) -> Tuple[KeyPressResult, dict]:
+        """
+        This method is called when the key is pressed twice within the double
+        press duration of the frontend. Defaults to pressed().
+
+        :return: a tuple (result, details)
+        """
+        return self.pressed()
+
+    @property
+    def handles_long_press(self) -> bool:
+        """
+        Whether the key has its own long press handler.
+        """
+        return type(self).long_pressed is not KeyBase.long_pressed
+
+    @property
+    def handles_double_press(self) -> bool:
+        """
+        Whether the key has its own double press handler.
+        """
+        return type(self).double_pressed is not KeyBase.double_pressed
+
+    def release(self):
+        """
+        This method is called when the key is no longer shown. Keys have to
+        unregister their state change handlers here, so hidden keys don't
+        keep them.
+        """
+
     def _trigger_redraw(self):
         """
-        Triggers a redraw of all keys.
+        Triggers a redraw of this key.
         """
-        # TODO: Implement!
+        if self._redraw_callback is not None:
+            self._redraw_callback(self)
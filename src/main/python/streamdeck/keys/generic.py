@@ -12,6 +12,8 @@ class SubMenuKey(KeyBase):
     A key that enters a submenu.
     """
 
+    _required_attributes = ()
+
     def pressed(self):
         # pylint: disable=missing-function-docstring
         return KeyPressResult.MENU_ENTER, self._values["keys"]
@@ -25,7 +27,40 @@ class BackKey(KeyBase):
 
     _title = "Back"
     _icon = "arrow-left"
+    _required_attributes = ()
 
     def pressed(self):
         # pylint: disable=missing-function-docstring
         return KeyPressResult.MENU_BACK, None
+
+
+class PreviousPageKey(KeyBase):
+    # pylint: disable=too-few-public-methods
+    """
+    A key that shows the previous page of a submenu with more keys than the
+    deck. Added automatically by the application.
+    """
+
+    _title = "Previous"
+    _icon = "arrow-up"
+    _required_attributes = ()
+
+    def pressed(self):
+        # pylint: disable=missing-function-docstring
+        return KeyPressResult.PAGE_PREVIOUS, None
+
+
+class NextPageKey(KeyBase):
+    # pylint: disable=too-few-public-methods
+    """
+    A key that shows the next page of a submenu with more keys than the deck.
+    Added automatically by the application.
+    """
+
+    _title = "Next"
+    _icon = "arrow-down"
+    _required_attributes = ()
+
+    def pressed(self):
+        # pylint: disable=missing-function-docstring
+        return KeyPressResult.PAGE_NEXT, None
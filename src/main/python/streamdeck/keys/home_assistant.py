@@ -4,12 +4,16 @@ Keys for integration with HomeAssistant.
 """
 
 import logging
+from functools import partial
 from keys.base import KeyBase, KeyPressResult
+from keys.optimistic import CoalescedAction, OptimisticValue, ThrottledAction
+from keys.ring_buffer import RingBuffer
 
 logger = logging.getLogger("streamdeck.keys.home_assistant")
 
 
 class HomeAssistantToggleKey(KeyBase):
+    # pylint: disable=too-many-instance-attributes
     """
     A key that represents the state of a HomeAssistant entity that can be toggled.
     Currently, lights and switches are supported.
@@ -41,11 +45,13 @@ class HomeAssistantToggleKey(KeyBase):
         },
     }
 
+    _required_attributes = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self._handler_key = self._backend.register_state_change_handler(
-            self._values["entity_id"], self._statechange
+            self._values["entity_id"], self._statechange, "state"
         )
 
         self._domain = self._values["entity_id"].split(".")[0]
@@ -59,30 +65,59 @@ class HomeAssistantToggleKey(KeyBase):
             self._icon_by_state = self._icon_by_domain_and_state[self._domain]
         self._icon_color_by_state = self._icon_color_by_domain_and_state[self._domain]
 
-        state = self._get_state()
-        self._set_icon(state)
+        self._state = OptimisticValue(
+            self._get_state(),
+            self._rollback,
+            self._values.get("confirm_timeout", 10),
+        )
+        self._set_icon(self._state.value)
+
+        self._token = None
+        self._service_call = CoalescedAction(
+            self._call_service, self._values.get("coalesce", 0.25)
+        )
 
-    def __del__(self):
+    def release(self):
+        # pylint: disable=missing-function-docstring
         self._backend.unregister_state_change_handler(self._handler_key)
 
-        super().__del__()
+    @property
+    def appearance(self):
+        """
+        Returns the appearance of the key, including whether an action is
+        pending, which is shown as spinner.
+        """
+        return {**super().appearance, "pending": self._state.pending}
 
-    def pressed(self):
+    @classmethod
+    def appearances(cls, values):
         # pylint: disable=missing-function-docstring
-        state = self._get_state()
+        domain = values["entity_id"].split(".")[0]
+        (base,) = super().appearances(values)
+        return [
+            {
+                **base,
+                "icon": values.get(
+                    "icon", cls._icon_by_domain_and_state[domain][state]
+                ),
+                "icon_color": cls._icon_color_by_domain_and_state[domain][state],
+                "pending": pending,
+            }
+            for state in ("on", "off", "unknown")
+            for pending in (False, True)
+        ]
 
-        if state == "off":
-            self._backend.call_service(
-                self._domain, "turn_on", target={"entity_id": self._values["entity_id"]}
-            )
-            self._set_icon("on")
-        elif state == "on":
-            self._backend.call_service(
-                self._domain,
-                "turn_off",
-                target={"entity_id": self._values["entity_id"]},
-            )
-            self._set_icon("off")
+    def pressed(self):
+        # pylint: disable=missing-function-docstring
+        state = self._state.value
+
+        if state in ("on", "off"):
+            # Show the new state immediately, but delay the service call to
+            # coalesce repeated presses:
+            next_state = "on" if state == "off" else "off"
+            self._token = self._state.predict(next_state)
+            self._set_icon(next_state)
+            self._service_call.trigger()
         else:
             logger.warning(
                 "Entity %s is in unknown state: %s", self._values["entity_id"], state
@@ -91,14 +126,47 @@ class HomeAssistantToggleKey(KeyBase):
 
         return KeyPressResult.REDRAW, None
 
+    def _call_service(self):
+        """
+        Calls the service for the state set by the last press(es).
+        """
+        token = self._token
+        state = self._state.value
+        if state == self._state.confirmed:
+            # Presses cancelled each other out:
+            self._state.result(token, True)
+            self._trigger_redraw()
+            return
+
+        self._backend.call_service(
+            self._domain,
+            "turn_on" if state == "on" else "turn_off",
+            target={"entity_id": self._values["entity_id"]},
+            callback=partial(self._state.result, token),
+        )
+
     def _get_state(self):
-        return self._backend.get_entity_info(self._values["entity_id"])["state"]
+        entity_info = self._backend.get_entity_info(self._values["entity_id"])
+        if entity_info is None:
+            # Not received from the backend (yet):
+            return "unknown"
+
+        return entity_info["state"]
 
     def _statechange(self, entity_info):
         """
         Callback for entity state changes.
         """
-        self._set_icon(entity_info["state"])
+        self._state.confirm(entity_info["state"])
+        self._set_icon(self._state.value)
+
+        self._trigger_redraw()
+
+    def _rollback(self, state):
+        """
+        Callback for rollbacks of the optimistic state.
+        """
+        self._set_icon(state)
 
         self._trigger_redraw()
 
@@ -120,6 +188,8 @@ class HomeAssistantScriptKey(KeyBase):
     A key that can trigger a HomeAssistant script.
     """
 
+    _required_attributes = ()
+
     def pressed(self):
         # pylint: disable=missing-function-docstring
         self._backend.call_service(
@@ -131,7 +201,8 @@ class HomeAssistantScriptKey(KeyBase):
 
 class HomeAssistantClimatePresetKey(KeyBase):
     """
-    A key that can switch the climate preset in HomeAssistant.
+    A key that can switch the climate preset in HomeAssistant. A press selects
+    the next preset, a long press the previous one.
     """
 
     _icon_by_state = {
@@ -161,54 +232,139 @@ class HomeAssistantClimatePresetKey(KeyBase):
         "unknown": "frost",
     }
 
+    _previous_preset_by_state = {
+        "none": "boost",
+        "frost": "boost",
+        "eco": "frost",
+        "comfort": "eco",
+        "boost": "comfort",
+        "unknown": "boost",
+    }
+
+    _required_attributes = ("preset_mode",)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self._handler_key = self._backend.register_state_change_handler(
-            self._values["entity_id"], self._statechange
+            self._values["entity_id"], self._statechange, "attributes.preset_mode"
         )
 
-        preset_mode = self._get_preset_mode()
-        self._set_icon(preset_mode)
+        self._preset_mode = OptimisticValue(
+            self._get_preset_mode(),
+            self._rollback,
+            self._values.get("confirm_timeout", 10),
+        )
+        self._set_icon(self._preset_mode.value)
+
+        self._token = None
+        self._service_call = CoalescedAction(
+            self._call_service, self._values.get("coalesce", 0.25)
+        )
 
-    def __del__(self):
+    def release(self):
+        # pylint: disable=missing-function-docstring
         self._backend.unregister_state_change_handler(self._handler_key)
 
-        super().__del__()
+    @property
+    def appearance(self):
+        """
+        Returns the appearance of the key, including whether an action is
+        pending, which is shown as spinner.
+        """
+        return {**super().appearance, "pending": self._preset_mode.pending}
+
+    @classmethod
+    def appearances(cls, values):
+        # pylint: disable=missing-function-docstring
+        (base,) = super().appearances(values)
+        return [
+            {
+                **base,
+                "icon": icon,
+                "icon_color": cls._icon_color_by_state[preset_mode],
+                "pending": pending,
+            }
+            for preset_mode, icon in cls._icon_by_state.items()
+            for pending in (False, True)
+        ]
 
     def pressed(self):
         # pylint: disable=missing-function-docstring
-        preset_mode = self._get_preset_mode()
-        if preset_mode in self._next_preset_by_state:
-            next_preset_mode = self._next_preset_by_state[preset_mode]
+        return self._select_preset(self._next_preset_by_state)
+
+    def long_pressed(self):
+        # pylint: disable=missing-function-docstring
+        return self._select_preset(self._previous_preset_by_state)
+
+    def _select_preset(self, preset_by_state):
+        """
+        Selects the preset mode that follows the current one in the given
+        mapping.
+        """
+        preset_mode = self._preset_mode.value
+        if preset_mode in preset_by_state:
+            next_preset_mode = preset_by_state[preset_mode]
         else:
-            next_preset_mode = self._next_preset_by_state["unknown"]
+            next_preset_mode = preset_by_state["unknown"]
             logger.warning(
                 "Entity %s is in unknown preset mode: %s",
                 self._values["entity_id"],
                 preset_mode,
             )
 
+        # Show the new preset mode immediately, but delay the service call to
+        # coalesce repeated presses:
+        self._token = self._preset_mode.predict(next_preset_mode)
+        self._set_icon(next_preset_mode)
+        self._service_call.trigger()
+
+        return KeyPressResult.REDRAW, None
+
+    def _call_service(self):
+        """
+        Calls the service for the preset mode set by the last press(es).
+        """
+        token = self._token
+        preset_mode = self._preset_mode.value
+        if preset_mode == self._preset_mode.confirmed:
+            # Presses cycled back to the current preset mode:
+            self._preset_mode.result(token, True)
+            self._trigger_redraw()
+            return
+
         self._backend.call_service(
             "climate",
             "set_preset_mode",
             target={"entity_id": self._values["entity_id"]},
-            data={"preset_mode": next_preset_mode},
+            data={"preset_mode": preset_mode},
+            callback=partial(self._preset_mode.result, token),
         )
-        self._set_icon(next_preset_mode)
-
-        return KeyPressResult.REDRAW, None
 
     def _get_preset_mode(self):
-        return self._backend.get_entity_info(self._values["entity_id"])["attributes"][
-            "preset_mode"
-        ]
+        entity_info = self._backend.get_entity_info(self._values["entity_id"])
+        if entity_info is None:
+            # Not received from the backend (yet):
+            return "unknown"
+
+        return entity_info["attributes"].get("preset_mode", "unknown")
 
     def _statechange(self, entity_info):
         """
         Callback for entity state changes.
         """
-        self._set_icon(entity_info["attributes"]["preset_mode"])
+        self._preset_mode.confirm(
+            entity_info["attributes"].get("preset_mode", "unknown")
+        )
+        self._set_icon(self._preset_mode.value)
+
+        self._trigger_redraw()
+
+    def _rollback(self, preset_mode):
+        """
+        Callback for rollbacks of the optimistic preset mode.
+        """
+        self._set_icon(preset_mode)
 
         self._trigger_redraw()
 
@@ -222,3 +378,194 @@ class HomeAssistantClimatePresetKey(KeyBase):
         else:
             self._icon = self._icon_by_state["unknown"]
             self._icon_color = self._icon_color_by_state["unknown"]
+
+
+class HomeAssistantSensorKey(KeyBase):
+    """
+    A key that shows the current value of a numeric HomeAssistant sensor and a
+    sparkline of its recent values.
+
+    The last history values (default: 60) are kept, redraws happen at most
+    every redraw_interval seconds (default: 1). The value is shown with the
+    given precision (default: 1) and unit (default: unit_of_measurement).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        try:
+            self._history = RingBuffer(self._values.get("history", 60))
+        except ValueError as e:
+            raise ValueError(
+                f"Invalid history of {self._values['entity_id']}: {e}"
+            ) from e
+        self._precision = self._values.get("precision", 1)
+        self._throttled_redraw = ThrottledAction(
+            self._trigger_redraw, self._values.get("redraw_interval", 1)
+        )
+
+        self._state = None
+        self._unit = self._values.get("unit")
+        entity_info = self._backend.get_entity_info(self._values["entity_id"])
+        if entity_info is not None:
+            self._update(entity_info)
+
+        self._handler_key = self._backend.register_state_change_handler(
+            self._values["entity_id"], self._statechange, "state"
+        )
+
+    def release(self):
+        # pylint: disable=missing-function-docstring
+        self._backend.unregister_state_change_handler(self._handler_key)
+
+    @property
+    def appearance(self):
+        """
+        Returns the appearance of the key, including the formatted value and
+        the recent values as tuple (sparkline).
+        """
+        return {
+            **super().appearance,
+            "value": self._format_state(),
+            "sparkline": tuple(self._history.values().tolist()),
+        }
+
+    @classmethod
+    def appearances(cls, values):
+        """
+        Returns a single appearance without value, as the values of the sensor
+        aren't known in advance.
+        """
+        (base,) = super().appearances(values)
+        return [{**base, "value": "-", "sparkline": ()}]
+
+    @classmethod
+    def required_attributes(cls, values):
+        # pylint: disable=missing-function-docstring
+        return set() if "unit" in values else {"unit_of_measurement"}
+
+    def pressed(self):
+        # pylint: disable=missing-function-docstring
+        return None, None
+
+    def _statechange(self, entity_info):
+        """
+        Callback for entity state changes.
+        """
+        self._update(entity_info)
+
+        self._throttled_redraw.trigger()
+
+    def _update(self, entity_info):
+        """
+        Stores the state of the given entity info and appends it to the
+        history if it is numeric.
+        """
+        self._state = entity_info["state"]
+        if "unit" not in self._values:
+            self._unit = entity_info["attributes"].get("unit_of_measurement")
+
+        try:
+            self._history.append(float(self._state))
+        except (TypeError, ValueError):
+            logger.debug(
+                "Entity %s has non-numeric state: %s",
+                self._values["entity_id"],
+                self._state,
+            )
+
+    def _format_state(self):
+        """
+        Returns the state formatted for display.
+        """
+        try:
+            text = f"{float(self._state):.{self._precision}f}"
+        except (TypeError, ValueError):
+            return str(self._state)
+
+        return text if self._unit is None else f"{text} {self._unit}"
+
+
+class HomeAssistantQueryMenuKey(KeyBase):
+    # pylint: disable=too-few-public-methods
+    """
+    A key that enters a submenu with a key for each entity matching a query,
+    evaluated when the key is pressed:
+
+      query:
+        domain: light
+        area: Bedroom  # ID or name of the area
+        pattern: light.bedroom_*  # glob pattern for the entity IDs
+        attributes:
+          device_class: outlet
+
+    The keys are created with kind (default: by domain of the entity) and
+    values merged with the entity ID and, unless given, the friendly name as
+    title. A back key is added at the end.
+    """
+
+    _kind_by_domain = {
+        "light": "HomeAssistantToggleKey",
+        "switch": "HomeAssistantToggleKey",
+        "script": "HomeAssistantScriptKey",
+        "climate": "HomeAssistantClimatePresetKey",
+        "sensor": "HomeAssistantSensorKey",
+    }
+
+    @classmethod
+    def required_attributes(cls, values):
+        """
+        Returns the attributes read by the query and the friendly name, and
+        the ones the keys of all kinds it can create need.
+        """
+        from keys import REGISTRY  # pylint: disable=import-outside-toplevel
+
+        required = {"friendly_name", *values.get("query", {}).get("attributes", {})}
+        kinds = [values["kind"]] if "kind" in values else cls._kind_by_domain.values()
+        for kind in set(kinds):
+            try:
+                key_class = REGISTRY.load(kind)
+            except KeyError:
+                return None
+            key_required = key_class.required_attributes(values.get("values", {}))
+            if key_required is None:
+                return None
+            required |= key_required
+
+        return required
+
+    def pressed(self):
+        # pylint: disable=missing-function-docstring
+        query = self._values.get("query", {})
+        entity_ids = self._backend.find_entities(
+            query.get("domain"),
+            query.get("area"),
+            query.get("attributes"),
+            query.get("pattern"),
+        )
+        logger.info("Query %s matched %d entities", query, len(entity_ids))
+
+        key_configs = []
+        for entity_id in entity_ids:
+            kind = self._values.get(
+                "kind", self._kind_by_domain.get(entity_id.split(".")[0])
+            )
+            if kind is None:
+                logger.debug("No key kind for %s, skipping", entity_id)
+                continue
+
+            entity_info = self._backend.get_entity_info(entity_id) or {}
+            title = entity_info.get("attributes", {}).get("friendly_name", entity_id)
+            key_configs.append(
+                {
+                    "kind": kind,
+                    "values": {
+                        "title": title,
+                        **self._values.get("values", {}),
+                        "entity_id": entity_id,
+                    },
+                }
+            )
+        key_configs.append({"kind": "BackKey"})
+
+        return KeyPressResult.MENU_ENTER, key_configs
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""
+Contains a key that runs multiple service calls.
+"""
+
+import time
+import logging
+import threading
+from functools import partial
+from keys.base import KeyBase, KeyPressResult
+
+logger = logging.getLogger("streamdeck.keys.macro")
+
+
+class MacroKey(KeyBase):
+    """
+    A key that runs service calls on one or more backends, in stages:
+
+      stages:
+        - - domain: switch  # first stage, both calls run concurrently
+            service: turn_on
+            target: {entity_id: switch.projector}
+          - domain: light
+            service: turn_off
+            target: {entity_id: light.bedroom}
+            backend: other  # default: backend of the key
+        - domain: script  # second stage, started when the first completed
+          service: turn_on
+          target: {entity_id: script.cinema}
+
+    Each call has to complete within timeout seconds (default: 10), after a
+    failed or timed out call, the remaining stages are skipped unless
+    continue_on_error is set. Calls on unknown backends fail. The key shows a
+    spinner while running.
+    """
+
+    _required_attributes = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._stages = [
+            stage if isinstance(stage, list) else [stage]
+            for stage in self._values.get("stages", [])
+        ]
+        self._timeout = self._values.get("timeout", 10)
+        self._running = False
+
+        for stage in self._stages:
+            for step in stage:
+                if "backend" in step and step["backend"] not in self._backends:
+                    logger.error(
+                        "Macro %s: unknown backend %s for %s.%s",
+                        self._title,
+                        step["backend"],
+                        step["domain"],
+                        step["service"],
+                    )
+
+    @property
+    def appearance(self):
+        """
+        Returns the appearance of the key, including whether the macro is
+        running, which is shown as spinner.
+        """
+        return {**super().appearance, "pending": self._running}
+
+    @classmethod
+    def appearances(cls, values):
+        # pylint: disable=missing-function-docstring
+        (base,) = super().appearances(values)
+        return [{**base, "pending": pending} for pending in (False, True)]
+
+    def pressed(self):
+        # pylint: disable=missing-function-docstring
+        if self._running:
+            logger.warning("Macro %s is already running", self._title)
+            return None, None
+
+        self._running = True
+        threading.Thread(
+            target=self._run, name=f"macro-{self._title}", daemon=True
+        ).start()
+
+        return KeyPressResult.REDRAW, None
+
+    def _run(self):
+        """
+        Runs all stages, see the class documentation.
+        """
+        start = time.perf_counter()
+        success = True
+        try:
+            for index, stage in enumerate(self._stages):
+                if not self._run_stage(stage):
+                    success = False
+                    if not self._values.get("continue_on_error", False):
+                        logger.warning(
+                            "Macro %s stopped after stage %d", self._title, index
+                        )
+                        break
+        finally:
+            self._running = False
+
+        logger.info(
+            "Macro %s %s after %.0f ms",
+            self._title,
+            "completed" if success else "failed",
+            (time.perf_counter() - start) * 1000,
+        )
+        self._trigger_redraw()
+
+    def _run_stage(self, stage) -> bool:
+        """
+        Starts all calls of the stage and waits until they completed or timed
+        out.
+
+        :return: whether all calls succeeded
+        """
+        results = [None] * len(stage)
+        done = [threading.Event() for _ in stage]
+        for index, step in enumerate(stage):
+            if "backend" not in step:
+                backend = self._backend
+            elif step["backend"] in self._backends:
+                backend = self._backends[step["backend"]]
+            else:
+                # Don't fall back to the default backend for a misspelled name:
+                self._step_done(
+                    results,
+                    done,
+                    index,
+                    False,
+                    {"code": "unknown_backend", "message": step["backend"]},
+                )
+                continue
+
+            backend.call_service(
+                step["domain"],
+                step["service"],
+                data=step.get("data"),
+                target=step.get("target"),
+                callback=partial(self._step_done, results, done, index),
+            )
+
+        deadline = time.monotonic() + self._timeout
+        success = True
+        for index, step in enumerate(stage):
+            if not done[index].wait(max(deadline - time.monotonic(), 0)):
+                logger.error(
+                    "Macro %s: %s.%s timed out",
+                    self._title,
+                    step["domain"],
+                    step["service"],
+                )
+                success = False
+            elif not results[index][0]:
+                logger.error(
+                    "Macro %s: %s.%s failed: %s",
+                    self._title,
+                    step["domain"],
+                    step["service"],
+                    results[index][1],
+                )
+                success = False
+
+        return success
+
+    @staticmethod
+    def _step_done(results, done, index, success, details=None):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        Callback of a service call, records its result.
+        """
+        results[index] = (success, details)
+        done[index].set()
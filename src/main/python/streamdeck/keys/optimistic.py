@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+"""
+Contains a helper for keys that show the expected result of an action before
+the backend confirmed it, and helpers to coalesce and rate-limit actions.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger("streamdeck.keys.optimistic")
+
+
+class OptimisticValue:
+    # pylint: disable=too-many-instance-attributes
+    """
+    A value that is optimistically updated when an action is triggered, and
+    reconciled with the value confirmed by the backend afterwards.
+
+    After predict() was called, the predicted value is pending until either
+    * the backend confirms the predicted value via confirm(), or
+    * the backend reports a failure for the action, or
+    * the backend acknowledged the action, but confirms a different value, or
+    * the deadline passes without confirmation.
+    In all but the first case, the value is rolled back to the confirmed one.
+    If the predicted value already equals the confirmed one, a successful
+    result settles it immediately.
+    The on_rollback callback is called with the confirmed value in that case,
+    it is called from the thread that caused the rollback.
+    """
+
+    def __init__(self, value, on_rollback, timeout: float = 10):
+        self._lock = threading.Lock()
+        self._confirmed = value
+        self._pending = None
+        self._acknowledged = False
+        self._timer = None
+        self._token = 0
+        self._on_rollback = on_rollback
+        self._timeout = timeout
+
+    @property
+    def value(self):
+        """
+        The pending value if there is one, the confirmed value otherwise.
+        """
+        with self._lock:
+            return self._confirmed if self._pending is None else self._pending
+
+    @property
+    def confirmed(self):
+        """
+        The value confirmed by the backend.
+        """
+        return self._confirmed
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether there is a pending value.
+        """
+        return self._pending is not None
+
+    def predict(self, value) -> int:
+        """
+        Sets the given value as pending and starts the deadline.
+
+        :return: a token that has to be passed to result()
+        """
+        with self._lock:
+            self._cancel_timer()
+            self._token += 1
+            self._pending = value
+            self._acknowledged = False
+            self._timer = threading.Timer(self._timeout, self._expire, [self._token])
+            self._timer.daemon = True
+            self._timer.start()
+
+            return self._token
+
+    def result(self, token: int, success: bool, details=None):
+        """
+        Reports the result of the action that was started with the given token.
+        Can be used as callback for call_service() with functools.partial.
+        """
+        with self._lock:
+            if token != self._token or self._pending is None:
+                # Result of an outdated action:
+                return
+
+            if success:
+                self._acknowledged = True
+                if self._pending == self._confirmed:
+                    self._settle()
+                return
+
+            logger.warning("Action failed, rolling back: %s", details)
+            self._settle()
+        self._on_rollback(self._confirmed)
+
+    def confirm(self, value):
+        """
+        Sets the value confirmed by the backend, e.g. on a state change.
+        """
+        with self._lock:
+            self._confirmed = value
+            if self._pending is None:
+                return
+
+            if value == self._pending:
+                self._settle()
+                return
+
+            if not self._acknowledged:
+                # Backend didn't process the action yet, keep waiting:
+                return
+
+            logger.info(
+                "Backend settled on %s instead of %s, rolling back",
+                value,
+                self._pending,
+            )
+            self._settle()
+        self._on_rollback(value)
+
+    def _expire(self, token: int):
+        """
+        Called when the deadline passed.
+        """
+        with self._lock:
+            if token != self._token or self._pending is None:
+                return
+
+            logger.warning(
+                "No confirmation for %s after %s seconds, rolling back",
+                self._pending,
+                self._timeout,
+            )
+            self._settle()
+        self._on_rollback(self._confirmed)
+
+    def _settle(self):
+        """
+        Clears the pending value and the deadline. Has to be called with the
+        lock held.
+        """
+        self._cancel_timer()
+        self._pending = None
+        self._acknowledged = False
+
+    def _cancel_timer(self):
+        """
+        Cancels the deadline timer, if running. Has to be called with the lock
+        held.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class CoalescedAction:
+    # pylint: disable=too-few-public-methods
+    """
+    An action that is run once after a burst of triggers, i.e. when no further
+    trigger happened within the delay. With a delay of zero, the action is run
+    immediately on each trigger.
+
+    The action is called from a timer thread, unless the delay is zero.
+    """
+
+    def __init__(self, action, delay: float = 0):
+        self._lock = threading.Lock()
+        self._action = action
+        self._delay = delay
+        self._timer = None
+
+    def trigger(self):
+        """
+        Triggers the action, restarting the delay.
+        """
+        if self._delay <= 0:
+            self._action()
+            return
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self._delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        """
+        Called when the delay passed.
+        """
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer = None
+
+        self._action()
+
+
+class ThrottledAction:
+    # pylint: disable=too-few-public-methods
+    """
+    An action that is run at most once per interval. A trigger within the
+    interval after the last run is deferred to the end of the interval, where
+    all deferred triggers result in a single run.
+
+    The action is called from a timer thread if it was deferred.
+    """
+
+    def __init__(self, action, interval: float = 0):
+        self._lock = threading.Lock()
+        self._action = action
+        self._interval = interval
+        self._last_run = None
+        self._timer = None
+
+    def trigger(self):
+        """
+        Triggers the action, running it now or at the end of the interval.
+        """
+        with self._lock:
+            if self._timer is not None:
+                # Already deferred:
+                return
+
+            now = time.monotonic()
+            if self._last_run is not None and now - self._last_run < self._interval:
+                self._timer = threading.Timer(
+                    self._last_run + self._interval - now, self._run
+                )
+                self._timer.daemon = True
+                self._timer.start()
+                return
+
+            self._last_run = now
+
+        self._action()
+
+    def _run(self):
+        """
+        Called at the end of the interval if triggers were deferred.
+        """
+        with self._lock:
+            self._timer = None
+            self._last_run = time.monotonic()
+
+        self._action()
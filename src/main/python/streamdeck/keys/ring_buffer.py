@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""
+Contains a fixed-size ring buffer for numeric values.
+"""
+
+import threading
+import numpy
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent numeric values, backed by a
+    preallocated numpy array. Appending overwrites the oldest value once the
+    buffer is full.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :raises ValueError: if the capacity is less than 1
+        """
+        if not isinstance(capacity, int) or capacity < 1:
+            raise ValueError(f"Capacity has to be an integer of at least 1: {capacity}")
+
+        self._lock = threading.Lock()
+        self._data = numpy.zeros(capacity, dtype=numpy.float64)
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value: float):
+        """
+        Appends a value, dropping the oldest one if the buffer is full.
+        """
+        with self._lock:
+            capacity = len(self._data)
+            self._data[(self._start + self._count) % capacity] = value
+            if self._count < capacity:
+                self._count += 1
+            else:
+                self._start = (self._start + 1) % capacity
+
+    def values(self) -> numpy.ndarray:
+        """
+        Returns a copy of the values, from the oldest to the newest.
+        """
+        with self._lock:
+            end = self._start + self._count
+            if end <= len(self._data):
+                return self._data[self._start : end].copy()
+
+            return numpy.concatenate(
+                (self._data[self._start :], self._data[: end - len(self._data)])
+            )
@@ -3,20 +3,32 @@
 Main application entrypoint.
 """
 
+import os
 import sys
+import json
+import time
 import enum
+import signal
 import logging
+import tempfile
 import threading
+from typing import Optional
 import yaml
 import typer
 import frontends
 import backends
 import keys
 from image import ImageRenderer
+from render_worker import RenderWorker
+from animation import FrameScheduler
+from profiler import SamplingProfiler
+from registry import timed, TIMINGS
 
 logger = logging.getLogger("streamdeck.main")
 app = typer.Typer()
 
+DEFAULT_PROFILE_SECONDS = 30
+
 
 class LogLevel(str, enum.Enum):
     """
@@ -31,18 +43,39 @@ class LogLevel(str, enum.Enum):
 
 
 class Main:
+    # pylint: disable=too-many-instance-attributes
     """
     Main application entrypoint.
     """
 
-    def __init__(self, layout_file: str, loglevel: str):
+    def __init__(
+        self,
+        layout_file: str,
+        loglevel: str,
+        profile_startup=False,
+        *,
+        profile_seconds=0,
+        profile_directory=None,
+        memory_report_seconds=0,
+    ):
+        # pylint: disable=too-many-arguments,too-many-locals,too-many-statements
         logging.basicConfig(level=getattr(logging, loglevel))
+        self._profile_startup = profile_startup
+        self._profile_seconds = profile_seconds
+        self._profile_directory = profile_directory or tempfile.gettempdir()
+        self._profiler = None
+        self._memory_report_seconds = memory_report_seconds
+        self._start_time = time.perf_counter()
 
         with open(layout_file, encoding="utf8") as file_handle:
             self.layout = yaml.safe_load(file_handle)
 
         self._submenu_stack = [self.layout["keys"]]
+        self._page_stack = [0]
+        self._key_configs = []
         self._keys = []
+        self._appearances = []
+        self._lock = threading.RLock()
 
         # Load frontend:
         logger.info("Available frontends: %s", ", ".join(frontends.AVAILABLE))
@@ -50,85 +83,365 @@ class Main:
         if frontend_kind not in frontends.AVAILABLE:
             logger.error("Unknown frontend: %s", frontend_kind)
             sys.exit(1)
-        self._frontend = getattr(frontends, frontend_kind)(
-            self._callback,
-            **self.layout["frontend"],
-        )
+        frontend_class = getattr(frontends, frontend_kind)
+        with timed(f"init frontend {frontend_kind}"):
+            self._frontend = frontend_class(
+                self._callback,
+                **self.layout["frontend"],
+            )
         logger.info("Loaded frontend %s", frontend_kind)
 
-        # Load backends:
+        # Load backends, sharing one instance between entries with the same
+        # kind and values:
         logger.info("Available backends: %s", ", ".join(backends.AVAILABLE))
         self._backends = {}
+        self._backend_instances = {}
         for key, backend in self.layout["backends"].items():
             backend_kind = backend["kind"]
             if backend_kind not in backends.AVAILABLE:
                 logger.error("Unknown backend: %s", backend_kind)
                 sys.exit(1)
-            self._backends[key] = getattr(backends, backend_kind)(**backend["values"])
+
+            instance_key = (
+                backend_kind,
+                json.dumps(backend["values"], sort_keys=True, default=str),
+            )
+            if instance_key in self._backend_instances:
+                name, instance = self._backend_instances[instance_key]
+                self._backends[key] = instance
+                logger.info(
+                    "Loaded backend %s as %s, shared with %s", backend_kind, key, name
+                )
+                continue
+
+            backend_class = getattr(backends, backend_kind)
+            with timed(f"init backend {key}"):
+                self._backends[key] = backend_class(**backend["values"])
+            self._backend_instances[instance_key] = (key, self._backends[key])
             logger.info("Loaded backend %s as %s", backend_kind, key)
 
         # Print available keys:
         logger.info("Available keys: %s", ", ".join(keys.AVAILABLE))
 
         # Create image renderer:
-        self._renderer = ImageRenderer(self._frontend.image_size, self.layout["style"])
+        with timed("init renderer"):
+            if self.layout["style"].get("render_process", False):
+                self._renderer = RenderWorker(
+                    self._frontend.image_size,
+                    self.layout["style"],
+                    self.layout["style"].get("render_slots", 1024),
+                )
+            else:
+                self._renderer = ImageRenderer(
+                    self._frontend.image_size, self.layout["style"]
+                )
+        self._scheduler = FrameScheduler(
+            self._frontend, self._lock, self.layout["frontend"].get("max_fps", 15)
+        )
 
     def run(self):
         """
         Starts the application main loops.
         """
-        # Start a thread for each backend:
-        for key, backend in self._backends.items():
+        # Keep only the entity attributes the keys need:
+        with timed("collect required attributes"):
+            self._set_required_attributes()
+
+        # Start a thread for each backend instance and its dispatch queue:
+        subsystems = {
+            threading.main_thread().name: "frontend",
+            "virtual-frontend": "frontend",
+            "animations": "animations",
+            "render-worker": "rendering",
+            "macro-*": "keys",
+        }
+        for key, backend in self._backend_instances.values():
             threading.Thread(target=backend.run, name=key, daemon=True).start()
+            threading.Thread(
+                target=backend.dispatcher.run, name=f"{key}-dispatch", daemon=True
+            ).start()
+            subsystems[key] = "backend"
+            subsystems[f"{key}-dispatch"] = "dispatch"
+
+        # Profile on SIGUSR1 and, if requested, right from the start:
+        self._profiler = SamplingProfiler(subsystems)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: self._start_profile())
+        if self._profile_seconds > 0:
+            self._start_profile()
+
+        # Log a memory report on SIGUSR2 and, if requested, after startup:
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, lambda *_: self._log_memory_report())
+        if self._memory_report_seconds > 0:
+            timer = threading.Timer(
+                self._memory_report_seconds, self._log_memory_report
+            )
+            timer.daemon = True
+            timer.start()
 
         # Create key objects, update layout and run frontend main loop:
-        self._create_keys()
-        self._draw()
+        with timed("create keys"):
+            self._create_keys()
+        with timed("first draw"):
+            self._draw()
+
+        if self._profile_startup:
+            self._print_startup_profile()
+
+        # Stop the frontend main loop on SIGTERM, so the render worker and
+        # its shared memory are cleaned up at exit:
+        signal.signal(signal.SIGTERM, lambda *_: self._frontend.stop())
+
+        # Start a thread for the animations and run frontend main loop:
+        threading.Thread(
+            target=self._scheduler.run, name="animations", daemon=True
+        ).start()
         self._frontend.run()
 
+    def _log_memory_report(self):
+        """
+        Logs the resident memory of the process and the memory used by the
+        entity infos of each backend instance.
+        """
+        resident = _resident_memory()
+        logger.info(
+            "Resident memory: %s",
+            "unknown" if resident is None else f"{resident / 2**20:.1f} MiB",
+        )
+        for name, backend in self._backend_instances.values():
+            usage = backend.memory_usage()
+            logger.info(
+                "Backend %s: %d entities with %d attributes, %.1f KiB",
+                name,
+                usage["entities"],
+                usage["attributes"],
+                usage["bytes"] / 2**10,
+            )
+
+    def _set_required_attributes(self):
+        """
+        Sets the entity attributes each backend instance has to keep, which are
+        the ones required by the keys of the whole layout using it.
+        """
+        required = {}
+        self._collect_required_attributes(self.layout["keys"], None, required)
+
+        for name, instance in self._backend_instances.values():
+            attributes = set()
+            for key, backend in self._backends.items():
+                if backend is instance and key in required:
+                    if required[key] is None:
+                        attributes = None
+                        break
+                    attributes |= required[key]
+
+            logger.info(
+                "Keys of backend %s need %s",
+                name,
+                "all attributes" if attributes is None else sorted(attributes),
+            )
+            instance.set_required_attributes(attributes)
+
+    def _collect_required_attributes(self, key_configs, backend, required):
+        """
+        Adds the entity attributes required by the given keys and the keys in
+        their submenus to the given mapping from backend names to attribute
+        sets (None if all attributes are required). Keys in submenus use the
+        backend of the submenu key unless they have one.
+        """
+        for key_config in key_configs:
+            if key_config is None or key_config["kind"] not in keys.AVAILABLE:
+                continue
+
+            key_backend = key_config.get("backend", backend)
+            values = key_config.get("values", {})
+            if key_backend is not None:
+                attributes = getattr(keys, key_config["kind"]).required_attributes(
+                    values
+                )
+                current = required.setdefault(key_backend, set())
+                required[key_backend] = (
+                    None
+                    if current is None or attributes is None
+                    else current | attributes
+                )
+
+            if isinstance(values.get("keys"), list):
+                self._collect_required_attributes(values["keys"], key_backend, required)
+
+    def _print_startup_profile(self):
+        """
+        Prints the import and initialization timings of the startup. The key
+        imports are included in the key creation.
+        """
+        print("Startup profile:")
+        for label, seconds in TIMINGS:
+            print(f"  {seconds * 1000:9.1f} ms  {label}")
+        total = time.perf_counter() - self._start_time
+        print(f"  {total * 1000:9.1f} ms  total")
+
+    def _start_profile(self):
+        """
+        Starts the sampling profiler, writing to a new file in the profile
+        directory.
+        """
+        output = os.path.join(
+            self._profile_directory,
+            time.strftime("streamdeck-yaml-%Y%m%d-%H%M%S.folded"),
+        )
+        if not self._profiler.start(
+            self._profile_seconds or DEFAULT_PROFILE_SECONDS, output
+        ):
+            logger.warning("Profiler is already running")
+
     def _create_keys(self):
         """
-        Creates the key objects.
+        Creates the key objects of the visible page, releasing the ones that
+        were shown before.
         """
+        for key in self._keys:
+            if key is not None:
+                key.release()
+
+        self._key_configs = self._page_layout()
         self._keys = []
-        for row in range(self.layout["frontend"]["rows"]):
-            for col in range(self.layout["frontend"]["columns"]):
-                key_index = row * self.layout["frontend"]["columns"] + col
-
-                if key_index >= len(self.submenu_layout):
-                    break
-                key_config = self.submenu_layout[key_index]
-                if key_config is None:
-                    self._keys.append(None)
-                    continue
-
-                # Create key object:
-                key_kind = key_config["kind"]
-                if key_kind not in keys.AVAILABLE:
-                    logger.error("Unknown key: %s", key_kind)
-                    sys.exit(1)
-                key = getattr(keys, key_kind)(
-                    key_config.get("values", {}),
-                    self._backends.get(key_config.get("backend")),
-                )
-                logger.info("Loaded key %s at position (%d,%d)", key_kind, row, col)
-                self._keys.append(key)
+        for key_index, key_config in enumerate(self._key_configs):
+            row, col = divmod(key_index, self.layout["frontend"]["columns"])
+            if key_config is None:
+                self._keys.append(None)
+                continue
+
+            # Create key object:
+            key_kind = key_config["kind"]
+            if key_kind not in keys.AVAILABLE:
+                logger.error("Unknown key: %s", key_kind)
+                sys.exit(1)
+            key = getattr(keys, key_kind)(
+                key_config.get("values", {}),
+                self._backends.get(key_config.get("backend")),
+                self._redraw,
+                backends=self._backends,
+            )
+            logger.info("Loaded key %s at position (%d,%d)", key_kind, row, col)
+            self._keys.append(key)
+
+        # Keys that don't handle long or double presses are pressed on key down:
+        key_count = self.layout["frontend"]["rows"] * self.layout["frontend"]["columns"]
+        for key_index in range(key_count):
+            key = self._keys[key_index] if key_index < len(self._keys) else None
+            self._frontend.set_key_handlers(
+                key_index,
+                key is not None and key.handles_long_press,
+                key is not None and key.handles_double_press,
+            )
+
+    def _page_layout(self):
+        """
+        Returns the key configs of the visible page of the current submenu.
+        Submenus with more keys than the deck are split into pages, the last
+        two keys of each page are reserved for the previous and next page keys.
+        """
+        layout = self.submenu_layout
+        key_count = self.layout["frontend"]["rows"] * self.layout["frontend"]["columns"]
+        if len(layout) <= key_count:
+            return layout
+        if key_count < 3:
+            logger.warning("Deck is too small for pages, only showing the first keys")
+            return layout[:key_count]
+
+        page_size = key_count - 2
+        page_count = (len(layout) + page_size - 1) // page_size
+        page = self._page_stack[-1]
+
+        result = layout[page * page_size : (page + 1) * page_size]
+        result += [None] * (page_size - len(result))
+        result.append(
+            {
+                "kind": "PreviousPageKey",
+                "values": {"title": f"{page}/{page_count}"},
+            }
+            if page > 0
+            else None
+        )
+        result.append(
+            {
+                "kind": "NextPageKey",
+                "values": {"title": f"{page + 2}/{page_count}"},
+            }
+            if page + 1 < page_count
+            else None
+        )
+
+        return result
 
     def _draw(self):
         """
         Updates the layout at the frontend.
         """
-        self._frontend.clear()
-        for key_index, key in enumerate(self._keys):
-            if key is not None:
-                self._frontend.set_key(key_index, self._renderer.render(key))
-        self._frontend.draw()
+        with self._lock:
+            self._frontend.clear()
+            self._scheduler.clear()
+            self._appearances = [None] * len(self._keys)
+            for key_index, key in enumerate(self._keys):
+                if key is not None:
+                    self._set_key(key_index, key.appearance)
+            self._frontend.draw()
 
-    def _callback(self, key_index):
+    def _redraw(self, key):
+        """
+        Updates a single key at the frontend, if it is currently shown and its
+        appearance changed. This method is called by the keys, possibly from
+        backend threads.
+
+        :param key: the key object to redraw
+        """
+        with self._lock:
+            if not self._frontend.enabled:
+                return
+
+            key_index = next(
+                (index for index, other in enumerate(self._keys) if other is key),
+                None,
+            )
+            if key_index is None:
+                logger.debug("Ignoring redraw of key that is not shown")
+                return
+
+            appearance = key.appearance
+            if appearance == self._appearances[key_index]:
+                return
+
+            self._set_key(key_index, appearance)
+            self._frontend.draw_keys([key_index])
+
+    def _set_key(self, key_index, appearance):
+        """
+        Renders the given appearance and sets it for the key with the given
+        index at the frontend, without drawing it. Animated appearances are
+        passed on to the frame scheduler. Has to be called with the lock held.
+        """
+        animation = self._renderer.render_animation(appearance, key_index)
+        self._appearances[key_index] = appearance
+        self._frontend.set_key(key_index, animation.frames[0])
+        self._scheduler.set(key_index, animation)
+
+    def _callback(self, key_index, press_type=frontends.PressType.PRESS):
         """
         This method is called by the frontend when a key is pressed.
 
         :param key_index: index of the key that was pressed
+        :param press_type: type of the key press
+        """
+        with self._lock:
+            self._handle_keypress(key_index, press_type)
+
+    def _handle_keypress(self, key_index, press_type):
+        """
+        Handles a key press, see _callback().
+
+        :param key_index: index of the key that was pressed
+        :param press_type: type of the key press
         """
         # Enable frontend and skip action if it was disabled:
         if not self._frontend.enabled:
@@ -137,19 +450,27 @@ class Main:
             self._draw()
             return
 
-        if key_index >= len(self.submenu_layout):
+        if key_index >= len(self._key_configs):
             logger.info("Key #%d pressed, but it has no mapping", key_index)
             return
-        key_config = self.submenu_layout[key_index]
+        key_config = self._key_configs[key_index]
         if key_config is None:
             logger.info("Key #%d pressed, but its mapping is null", key_index)
             return
 
         key = self._keys[key_index]
         logger.info(
-            "Key #%d (%s) pressed, calling handler", key_index, type(key).__name__
+            "Key #%d (%s) pressed (%s), calling handler",
+            key_index,
+            type(key).__name__,
+            press_type.name,
         )
-        result, details = key.pressed()
+        if press_type == frontends.PressType.LONG_PRESS:
+            result, details = key.long_pressed()
+        elif press_type == frontends.PressType.DOUBLE_PRESS:
+            result, details = key.double_pressed()
+        else:
+            result, details = key.pressed()
         logger.debug(
             "Keypress handler for key #%d (%s) returned %s",
             key_index,
@@ -157,7 +478,18 @@ class Main:
             result,
         )
         if result == keys.KeyPressResult.MENU_ENTER:
-            self._submenu_stack.append(details)
+            # Keys without backend use the backend of the submenu key:
+            self._submenu_stack.append(
+                [
+                    (
+                        {"backend": key_config.get("backend"), **config}
+                        if config is not None
+                        else None
+                    )
+                    for config in details
+                ]
+            )
+            self._page_stack.append(0)
             logger.info("Entering submenu at level %d", len(self._submenu_stack) - 1)
             self._create_keys()
             self._draw()
@@ -167,13 +499,22 @@ class Main:
                 return
 
             self._submenu_stack.pop()
+            self._page_stack.pop()
             logger.info(
                 "Going back to submenu at level %d", len(self._submenu_stack) - 1
             )
             self._create_keys()
             self._draw()
         elif result == keys.KeyPressResult.REDRAW:
-            logger.info("Redrawing frontend")
+            logger.info("Redrawing key #%d", key_index)
+            self._redraw(key)
+        elif result in (
+            keys.KeyPressResult.PAGE_PREVIOUS,
+            keys.KeyPressResult.PAGE_NEXT,
+        ):
+            self._page_stack[-1] += 1 if result == keys.KeyPressResult.PAGE_NEXT else -1
+            logger.info("Showing page %d", self._page_stack[-1])
+            self._create_keys()
             self._draw()
 
     @property
@@ -184,15 +525,56 @@ class Main:
         return self._submenu_stack[-1]
 
 
+def _resident_memory() -> Optional[int]:
+    """
+    Returns the resident memory of the process in bytes, or None if unknown
+    (only supported on Linux).
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as file_handle:
+            pages = int(file_handle.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
 @app.command()
 def main(
     layout: str = typer.Argument(..., help="path to the layout YAML file"),
     loglevel: LogLevel = typer.Option("INFO", help="loglevel to use"),
+    profile_startup: bool = typer.Option(
+        False, help="print import and initialization timings after startup"
+    ),
+    profile: float = typer.Option(
+        0,
+        metavar="SECONDS",
+        help="sample all threads for this many seconds after startup and write "
+        "collapsed stacks, SIGUSR1 starts sampling again (default: "
+        f"{DEFAULT_PROFILE_SECONDS} seconds)",
+    ),
+    profile_directory: str = typer.Option(
+        tempfile.gettempdir(), help="directory to write the profiles to"
+    ),
+    memory_report: float = typer.Option(
+        0,
+        metavar="SECONDS",
+        help="log the memory usage this many seconds after startup, SIGUSR2 "
+        "logs it at any time",
+    ),
 ):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
     """
     Wrapper around the main class, used for typer.
     """
-    instance = Main(layout, loglevel)
+    instance = Main(
+        layout,
+        loglevel,
+        profile_startup,
+        profile_seconds=profile,
+        profile_directory=profile_directory,
+        memory_report_seconds=memory_report,
+    )
     instance.run()
 
 
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+"""
+Sampling profiler for the running application.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+logger = logging.getLogger("streamdeck.profiler")
+
+# Subsystems of threads started by libraries, by a directory in the paths of
+# the files on their stack:
+LIBRARY_SUBSYSTEMS = {
+    f"{os.sep}StreamDeck{os.sep}": "hid",
+    f"{os.sep}paho{os.sep}": "mqtt",
+    f"{os.sep}websocket{os.sep}": "websocket",
+}
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of all threads via sys._current_frames(),
+    which only costs time in the profiler thread, and counts identical
+    stacks. The result is written as collapsed stacks, one line per stack
+    with its frames separated by semicolons and the number of samples, as
+    used by flamegraph.pl and speedscope.
+
+    Each stack starts with the subsystem of its thread and the thread name.
+    The subsystem is looked up by the thread name in the given mapping from
+    thread names (or name prefixes ending with "*") to subsystems, then by the
+    files on the stack, see LIBRARY_SUBSYSTEMS, otherwise it's "other".
+    """
+
+    def __init__(
+        self, subsystems: Optional[Dict[str, str]] = None, interval: float = 0.01
+    ):
+        self._subsystems = subsystems or {}
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the profiler is currently sampling.
+        """
+        with self._lock:
+            return self._thread is not None
+
+    def start(self, seconds: float, output: str) -> bool:
+        """
+        Starts sampling for the given number of seconds in a separate thread,
+        the collapsed stacks are written to the given path afterwards.
+        Returns False if the profiler is already running.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, output), name="profiler", daemon=True
+            )
+            self._thread.start()
+
+        logger.info("Profiling for %g seconds", seconds)
+        return True
+
+    def sample(self, stacks: Counter):
+        """
+        Takes one sample of the stacks of all other threads and adds them to
+        the given counter.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own_ident = threading.get_ident()
+        frames = sys._current_frames()  # pylint: disable=protected-access
+
+        for ident, frame in frames.items():
+            if ident == own_ident:
+                continue
+
+            files = []
+            labels = []
+            while frame is not None:
+                code = frame.f_code
+                files.append(code.co_filename)
+                labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            labels.reverse()
+
+            name = names.get(ident, str(ident))
+            subsystem = self._subsystem(name, files)
+            stacks[";".join([subsystem, name.replace(";", ","), *labels])] += 1
+
+    def _subsystem(self, thread_name, files):
+        """
+        Returns the subsystem of a thread, see SamplingProfiler.
+        """
+        if thread_name in self._subsystems:
+            return self._subsystems[thread_name]
+        for name, subsystem in self._subsystems.items():
+            if name.endswith("*") and thread_name.startswith(name[:-1]):
+                return subsystem
+
+        for directory, subsystem in LIBRARY_SUBSYSTEMS.items():
+            if any(directory in path for path in files):
+                return subsystem
+
+        return "other"
+
+    def _run(self, seconds, output):
+        """
+        Samples for the given number of seconds and writes the result.
+        """
+        stacks = Counter()
+        samples = 0
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < seconds:
+                self.sample(stacks)
+                samples += 1
+                time.sleep(self._interval)
+
+            with open(output, "w", encoding="utf8") as file_handle:
+                for stack, count in stacks.most_common():
+                    file_handle.write(f"{stack} {count}\n")
+            logger.info("Wrote profile of %d samples to %s", samples, output)
+        except OSError as e:
+            logger.error("Failed to write profile to %s: %s", output, e)
+        finally:
+            with self._lock:
+                self._thread = None
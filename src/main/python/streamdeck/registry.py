@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Registry of frontend, backend and key implementations, which are only imported
+when they are used.
+"""
+
+import time
+import logging
+import importlib
+import contextlib
+from importlib.metadata import entry_points
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("streamdeck.registry")
+
+ENTRY_POINT_GROUP = "streamdeck_yaml.{}"
+
+# Import and initialization timings as (label, seconds), see timed():
+TIMINGS: List[Tuple[str, float]] = []
+
+
+@contextlib.contextmanager
+def timed(label: str):
+    """
+    Context manager that measures the time of its body and stores it in
+    TIMINGS with the given label.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.append((label, time.perf_counter() - start))
+
+
+class Registry:
+    """
+    Registry of the implementations of one kind (frontends, backends or keys).
+
+    Built-in implementations are given as mapping from class name to module
+    name. Additional implementations can be provided by other packages as
+    entry points in the group streamdeck_yaml.<kind>, named like the class.
+    Nothing is imported until an implementation is loaded.
+    """
+
+    def __init__(self, kind: str, builtins: Dict[str, str]):
+        self._kind = kind
+        self._builtins = builtins
+        self._entry_points = None
+        self._loaded = {}
+
+    @property
+    def available(self) -> List[str]:
+        """
+        Names of all available implementations.
+        """
+        return list(self._builtins) + [
+            name for name in self._get_entry_points() if name not in self._builtins
+        ]
+
+    def load(self, name: str):
+        """
+        Imports and returns the implementation with the given name.
+
+        :raises KeyError: if there is no such implementation
+        """
+        if name not in self._loaded:
+            with timed(f"import {self._kind}.{name}"):
+                if name in self._builtins:
+                    module = importlib.import_module(self._builtins[name])
+                    self._loaded[name] = getattr(module, name)
+                elif name in self._get_entry_points():
+                    self._loaded[name] = self._get_entry_points()[name].load()
+                else:
+                    raise KeyError(name)
+
+            logger.debug("Loaded %s implementation %s", self._kind, name)
+
+        return self._loaded[name]
+
+    def module_getattr(self, module_name: str):
+        """
+        Returns a module level __getattr__ function for the package with the
+        given name. It returns the list of available implementations as
+        AVAILABLE and imports implementations on access.
+        """
+
+        def module_getattr(name):
+            if name == "AVAILABLE":
+                return self.available
+
+            try:
+                return self.load(name)
+            except KeyError as e:
+                raise AttributeError(
+                    f"module {module_name!r} has no attribute {name!r}"
+                ) from e
+
+        return module_getattr
+
+    def _get_entry_points(self):
+        """
+        Returns the entry points of other packages as mapping from name to
+        entry point.
+        """
+        if self._entry_points is None:
+            self._entry_points = {
+                entry_point.name: entry_point
+                for entry_point in entry_points(
+                    group=ENTRY_POINT_GROUP.format(self._kind)
+                )
+            }
+
+        return self._entry_points
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+"""
+Pre-renders all key images of a layout for several deck models, without a
+device attached.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+import yaml
+import typer
+from PIL import Image
+import keys
+from image import ImageRenderer
+
+logger = logging.getLogger("streamdeck.render")
+app = typer.Typer()
+
+# Key image formats of the Elgato Stream Deck models, see key_image_format()
+# in python-elgato-streamdeck:
+DEFAULT_PROFILES = {
+    "original": {
+        "size": [72, 72],
+        "format": "BMP",
+        "flip": [True, True],
+        "rotation": 0,
+    },
+    "mini": {
+        "size": [80, 80],
+        "format": "BMP",
+        "flip": [False, True],
+        "rotation": 90,
+    },
+    "mk2": {
+        "size": [72, 72],
+        "format": "JPEG",
+        "flip": [True, True],
+        "rotation": 0,
+    },
+    "xl": {
+        "size": [96, 96],
+        "format": "JPEG",
+        "flip": [True, True],
+        "rotation": 0,
+    },
+}
+
+# Image renderers of a worker process, by profile name. Not shared between
+# profiles of the same size, so the renderer's caches don't skew the timings:
+_renderers = {}
+
+
+def collect_appearances(key_configs, path="keys") -> List[dict]:
+    """
+    Returns all appearances of the given keys and of the keys in their
+    submenus as dicts with the path of the key in the layout, its kind and
+    the appearance.
+    """
+    result = []
+    for index, key_config in enumerate(key_configs):
+        if key_config is None:
+            continue
+
+        key_path = f"{path}[{index}]"
+        values = key_config.get("values", {})
+        key_class = getattr(keys, key_config["kind"])
+        for appearance in key_class.appearances(values):
+            result.append(
+                {"key": key_path, "kind": key_config["kind"], "appearance": appearance}
+            )
+
+        if isinstance(values.get("keys"), list):
+            result.extend(collect_appearances(values["keys"], f"{key_path}.keys"))
+
+    return result
+
+
+def render_chunk(
+    name: str, profile: dict, style: dict, appearances: List[dict], output: str
+):
+    """
+    Renders the given appearances for the profile with the given name and
+    stores them in the output directory, named by the hash of their content.
+    Runs in a worker process.
+
+    :return: a list of tuples (file name, seconds) in the order of the
+             appearances
+    """
+    if name not in _renderers:
+        _renderers[name] = ImageRenderer(tuple(profile["size"]), style)
+    renderer = _renderers[name]
+
+    result = []
+    for appearance in appearances:
+        start = time.perf_counter()
+        image = renderer.render_animation(appearance).frames[0]
+        data = to_native_format(image, profile)
+        extension = profile["format"].lower()
+        file_name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = os.path.join(output, file_name)
+        if not os.path.exists(path):
+            with open(f"{path}.{os.getpid()}.tmp", "wb") as file_handle:
+                file_handle.write(data)
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+        result.append((file_name, time.perf_counter() - start))
+
+    return result
+
+
+def to_native_format(image: Image.Image, profile: dict) -> bytes:
+    """
+    Converts the image into the native format of the given profile, like
+    PILHelper.to_native_format() of python-elgato-streamdeck.
+    """
+    if profile.get("rotation"):
+        image = image.rotate(profile["rotation"])
+    flip = profile.get("flip", [False, False])
+    if flip[0]:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    if flip[1]:
+        image = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+
+    buffer = io.BytesIO()
+    image.save(buffer, profile["format"], quality=100)
+    return buffer.getvalue()
+
+
+def render_layout(
+    layout: dict,
+    profiles: Dict[str, dict],
+    output: str,
+    workers: int,
+    chunk_size: int = 16,
+) -> dict:
+    # pylint: disable=too-many-locals
+    """
+    Renders all appearances of all keys of the layout for all profiles in a
+    process pool, and writes a manifest.json mapping them to the files.
+
+    :return: the timing report as mapping from profile name to a tuple
+             (image count, seconds spent rendering)
+    """
+    entries = collect_appearances(layout["keys"])
+    os.makedirs(output, exist_ok=True)
+
+    manifest = {}
+    report = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for name, profile in profiles.items():
+            for start in range(0, len(entries), chunk_size):
+                chunk = entries[start : start + chunk_size]
+                future = executor.submit(
+                    render_chunk,
+                    name,
+                    profile,
+                    layout["style"],
+                    [entry["appearance"] for entry in chunk],
+                    output,
+                )
+                futures.append((name, chunk, future))
+
+        for name, chunk, future in futures:
+            for entry, (file_name, seconds) in zip(chunk, future.result()):
+                manifest.setdefault(name, []).append({**entry, "file": file_name})
+                count, total = report.get(name, (0, 0))
+                report[name] = (count + 1, total + seconds)
+
+    with open(
+        os.path.join(output, "manifest.json"), "w", encoding="utf8"
+    ) as file_handle:
+        json.dump({"profiles": profiles, "images": manifest}, file_handle, indent=2)
+
+    return report
+
+
+@app.command()
+def main(
+    layout: str = typer.Argument(..., help="path to the layout YAML file"),
+    output: str = typer.Argument(..., help="output directory"),
+    profiles: str = typer.Option(
+        None,
+        help="YAML file mapping profile names to size, format, flip and rotation, "
+        "defaults to the Elgato Stream Deck models",
+    ),
+    workers: int = typer.Option(os.cpu_count(), help="number of worker processes"),
+):
+    """
+    Pre-renders all key images of a layout for several deck models.
+    """
+    logging.basicConfig(level=logging.WARNING)
+
+    with open(layout, encoding="utf8") as file_handle:
+        layout_data = yaml.safe_load(file_handle)
+
+    if profiles is None:
+        profile_data = DEFAULT_PROFILES
+    else:
+        with open(profiles, encoding="utf8") as file_handle:
+            profile_data = yaml.safe_load(file_handle)
+
+    start = time.perf_counter()
+    try:
+        report = render_layout(layout_data, profile_data, output, workers)
+    except (KeyError, AttributeError) as e:
+        logger.error("Invalid layout: %s", e)
+        sys.exit(1)
+    wall_time = time.perf_counter() - start
+
+    print("Render profile:")
+    for name, (count, seconds) in report.items():
+        print(
+            f"  {name:12} {count:5d} images  {seconds * 1000:9.1f} ms  "
+            f"{seconds * 1000 / max(count, 1):7.2f} ms/image"
+        )
+    files = len([name for name in os.listdir(output) if name != "manifest.json"])
+    print(f"  {files} unique files in {output}")
+    print(f"  {wall_time * 1000:9.1f} ms  total with {workers} workers")
+
+
+if __name__ == "__main__":
+    app()
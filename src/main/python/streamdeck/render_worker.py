@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+"""
+Renders key images in a separate process, so rendering doesn't compete with
+the key press handling and the backends for the GIL.
+"""
+
+import atexit
+import logging
+import collections
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from PIL import Image
+from animation import Animation
+from image import ImageRenderer, ANIMATION_CACHE_SIZE, cacheable
+from keys import KeyBase
+
+logger = logging.getLogger("streamdeck.render_worker")
+
+START_TIMEOUT = 30  # seconds
+RENDER_TIMEOUT = 5  # seconds
+
+
+class FrameBuffer(shared_memory.SharedMemory):
+    """
+    Shared memory for the frames. It can't be closed while images still map
+    it, which is expected on exit, where it's released with the process.
+    """
+
+    def __del__(self):
+        try:
+            self.close()
+        except (OSError, BufferError):
+            pass
+
+
+class RenderWorker:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Drop-in replacement for ImageRenderer that renders in a worker process.
+
+    Appearances are sent to the worker over a pipe. The worker writes the
+    frames into a frame buffer in shared memory, which is split into slots
+    of one RGBX image each and used as a ring, and answers with the slots of
+    the frames. The returned images are RGBX views of the shared memory,
+    without copying, and are only valid until close() is called. A slot is reused after all others were used, except for
+    the slots of the animations shown on the keys (see render_animation()),
+    so more slots than frames of all keys shown at once are required.
+
+    If the worker can't be started or fails, rendering falls back to an
+    ImageRenderer in this process.
+    """
+
+    def __init__(self, size, config, slots=1024):
+        self._size = tuple(size)
+        self._config = config
+        self._lock = threading.Lock()
+        self._animations = collections.OrderedDict()
+        self._slot_owners = {}
+        self._pinned = {}
+        self._fallback = None
+
+        frame_size = self._size[0] * self._size[1] * 4
+        self._memory = FrameBuffer(create=True, size=slots * frame_size)
+        self._view = memoryview(self._memory.buf)
+        self._frames = [
+            self._view[slot * frame_size : (slot + 1) * frame_size]
+            for slot in range(slots)
+        ]
+        # The mapping is released with the process, images might still use it:
+        atexit.register(self._stop)
+
+        context = multiprocessing.get_context("spawn")
+        self._connection, worker_connection = context.Pipe()
+        self._process = context.Process(
+            target=_run_worker,
+            args=(worker_connection, self._memory.name, self._size, config, slots),
+            name="render-worker",
+            daemon=True,
+        )
+        self._process.start()
+        if not self._connection.poll(START_TIMEOUT):
+            self._fail("worker didn't start")
+        else:
+            self._connection.recv()
+            logger.info("Started render worker with %d slots", slots)
+
+    def render(self, key: KeyBase) -> Image:
+        """
+        Renders an image for the given key, see ImageRenderer.render().
+        """
+        return self.render_animation(key.appearance).frames[0]
+
+    def render_animation(self, appearance: dict, key_index=None) -> Animation:
+        """
+        Renders the frames for the given appearance of a key, see
+        ImageRenderer.render_animation(). If the index of the key the frames
+        are shown on is given, their slots aren't reused until another
+        animation is rendered for that key.
+        """
+        with self._lock:
+            if self._fallback is not None:
+                return self._fallback.render_animation(appearance)
+
+            cache_key = tuple(sorted(appearance.items()))
+            if cache_key in self._animations:
+                self._animations.move_to_end(cache_key)
+                animation, slots = self._animations[cache_key]
+            else:
+                rendered = self._render(appearance, cache_key)
+                if rendered is None:
+                    # The worker failed:
+                    return self._fallback.render_animation(appearance)
+                animation, slots = rendered
+
+            if key_index is not None:
+                self._pinned[key_index] = slots
+
+            return animation
+
+    def _render(self, appearance, cache_key):
+        """
+        Renders the appearance in the worker and caches the animation if it's
+        cacheable. Returns a tuple (animation, slots), or None if the worker
+        failed. Has to be called with the lock held.
+        """
+        pinned = {slot for slots in self._pinned.values() for slot in slots}
+        try:
+            self._connection.send((appearance, pinned))
+            if not self._connection.poll(RENDER_TIMEOUT):
+                raise TimeoutError("no answer from worker")
+            result = self._connection.recv()
+        except (OSError, EOFError, TimeoutError) as e:
+            self._fail(e)
+            return None
+
+        if isinstance(result, Exception):
+            raise result
+        slots, durations = result
+
+        for slot in slots:
+            # The slot was overwritten, drop the animation it belonged to:
+            self._animations.pop(self._slot_owners.get(slot), None)
+            self._slot_owners[slot] = cache_key
+
+        # RGBX is mapped by Pillow instead of copied:
+        animation = Animation(
+            [
+                Image.frombuffer(
+                    "RGBX", self._size, self._frames[slot], "raw", "RGBX", 0, 1
+                )
+                for slot in slots
+            ],
+            durations,
+        )
+        if cacheable(appearance):
+            if len(self._animations) >= ANIMATION_CACHE_SIZE:
+                self._animations.popitem(last=False)
+            self._animations[cache_key] = (animation, tuple(slots))
+
+        return animation, tuple(slots)
+
+    def close(self):
+        """
+        Stops the worker and releases the frame buffer. All images returned
+        before become invalid, and have to be dropped before calling this, as
+        the frame buffer can't be unmapped while they are mapping it. If some
+        are still referenced, close() can be called again after dropping them.
+
+        :raises BufferError: if images returned before are still referenced
+        """
+        self._stop()
+        self._animations.clear()
+        self._slot_owners.clear()
+        self._pinned.clear()
+
+        in_use = []
+        for frame in self._frames:
+            try:
+                frame.release()
+            except BufferError:
+                in_use.append(frame)
+        self._frames = in_use
+        if in_use:
+            raise BufferError(f"{len(in_use)} frames are still referenced by images")
+
+        self._view.release()
+        self._memory.close()
+
+    def _stop(self):
+        """
+        Stops the worker and removes the name of the frame buffer, but keeps
+        it mapped for the images returned before.
+        """
+        if self._process.is_alive():
+            self._process.terminate()
+        try:
+            self._memory.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _fail(self, reason):
+        """
+        Switches to rendering in this process. Has to be called with the lock
+        held, or from the constructor.
+        """
+        logger.warning("Render worker failed (%s), rendering in process", reason)
+        self._stop()
+        self._fallback = ImageRenderer(self._size, self._config)
+
+
+def _run_worker(connection, memory_name, size, config, slots):
+    """
+    Main loop of the worker process, see RenderWorker.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    frame_size = size[0] * size[1] * 4
+    renderer = ImageRenderer(size, config)
+    next_slot = 0
+    connection.send(True)
+
+    while True:
+        try:
+            appearance, pinned = connection.recv()
+        except EOFError:
+            break
+
+        try:
+            animation = renderer.render_animation(appearance)
+            if len(animation.frames) > slots - len(pinned):
+                raise RuntimeError(
+                    f"{len(animation.frames)} frames don't fit into the free slots"
+                )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Raised again by the main process:
+            connection.send(e)
+            continue
+
+        used = []
+        for frame in animation.frames:
+            # Skip the slots of the frames shown on the keys:
+            while next_slot in pinned:
+                next_slot = (next_slot + 1) % slots
+            memory.buf[next_slot * frame_size : (next_slot + 1) * frame_size] = (
+                frame.convert("RGBX").tobytes()
+            )
+            used.append(next_slot)
+            next_slot = (next_slot + 1) % slots
+        connection.send((used, animation.durations))
+
+    memory.close()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+"""
+Layout of the texts on the keys: wrapping, truncation and the choice of the
+font size.
+"""
+
+import logging
+import functools
+from typing import List, NamedTuple, Optional, Tuple
+from PIL import Image, ImageDraw, ImageFont
+
+ELLIPSIS = "…"
+LAYOUT_CACHE_SIZE = 1024  # laid out texts kept in memory
+MASK_CACHE_SIZE = 256  # rendered text masks kept in memory
+logger = logging.getLogger("streamdeck.text")
+
+
+class TextLayout(NamedTuple):
+    """
+    Laid out text: the lines, their font size, the distance between their
+    baselines, the ascent of the font and the width of the box in pixels.
+    """
+
+    lines: Tuple[str, ...]
+    size: int
+    line_height: int
+    ascent: int
+    width: int
+
+    @property
+    def height(self) -> int:
+        """
+        Height of the text from its top to the baseline of the last line.
+        """
+        return (len(self.lines) - 1) * self.line_height + self.ascent
+
+
+class TextEngine:
+    """
+    Lays out texts in boxes, wrapping them to multiple lines and truncating
+    them with an ellipsis if they don't fit. The font size is chosen together
+    with the line breaks: the largest size between the minimum and maximum
+    font size is used for which the text fits completely, in at most the
+    given number of lines. Words are only broken between characters if the
+    text doesn't fit otherwise. If it doesn't fit at the minimum font size,
+    it's truncated at that size.
+
+    Layouts are cached per text and box, and the text masks rendered from
+    them per layout, so repeated texts are only composited.
+    """
+
+    def __init__(self, font: str, max_fontsize: int, min_fontsize: int = 1):
+        self._font_path = font
+        self._max_fontsize = max_fontsize
+        self._min_fontsize = max(min(min_fontsize, max_fontsize), 1)
+        self._fonts = {}
+
+        self.layout = functools.lru_cache(LAYOUT_CACHE_SIZE)(self._layout)
+        self.render_mask = functools.lru_cache(MASK_CACHE_SIZE)(self._render_mask)
+
+    def font(self, size: int) -> ImageFont.FreeTypeFont:
+        """
+        Returns the font in the given size.
+        """
+        if size not in self._fonts:
+            self._fonts[size] = ImageFont.truetype(self._font_path, size)
+
+        return self._fonts[size]
+
+    def draw(self, image: Image, layout: TextLayout, position: Tuple[int, int], fill):
+        """
+        Draws the laid out text with its top left corner at the given position,
+        centering the lines in the width of the layout.
+        """
+        mask = self.render_mask(layout)
+        image.paste(
+            fill, (*position, position[0] + mask.width, position[1] + mask.height), mask
+        )
+
+    def _layout(self, text: str, width: int, height: int, max_lines: int = 1):
+        """
+        Lays out the text in a box of the given size, see TextEngine. The
+        height is the space above the baseline of the last line, a single line
+        is always used even if it's higher. Used via layout(), which caches it.
+        """
+        for break_words in (False, True):
+            for size in range(self._max_fontsize, self._min_fontsize - 1, -1):
+                font = self.font(size)
+                ascent, descent = font.getmetrics()
+                lines = max(
+                    min(max_lines, (height - ascent) // (ascent + descent) + 1), 1
+                )
+                wrapped = self._wrap(text, font, width, break_words)
+                if wrapped is not None and len(wrapped) <= lines:
+                    return TextLayout(
+                        tuple(wrapped), size, ascent + descent, ascent, width
+                    )
+
+        logger.debug("Truncating text %r to %d lines", text, lines)
+        wrapped = wrapped[:lines]
+        last = wrapped[-1]
+        while last and font.getlength(last.rstrip() + ELLIPSIS) > width:
+            last = last[:-1]
+        wrapped[-1] = last.rstrip() + ELLIPSIS
+
+        return TextLayout(tuple(wrapped), size, ascent + descent, ascent, width)
+
+    @staticmethod
+    def _wrap(
+        text: str, font: ImageFont.FreeTypeFont, width: int, break_words: bool
+    ) -> Optional[List[str]]:
+        """
+        Breaks the text into lines that are at most the given width, at spaces
+        and line breaks in the text. Words wider than a line are broken
+        between characters if break_words is set, otherwise None is returned.
+        """
+        lines = []
+        for paragraph in text.split("\n"):
+            line = ""
+            for word in paragraph.split():
+                candidate = f"{line} {word}" if line else word
+                if font.getlength(candidate) <= width:
+                    line = candidate
+                    continue
+
+                if not break_words and font.getlength(word) > width:
+                    return None
+                if line:
+                    lines.append(line)
+                line = ""
+                for character in word:
+                    if line and font.getlength(line + character) > width:
+                        lines.append(line)
+                        line = ""
+                    line += character
+
+            lines.append(line)
+
+        return lines
+
+    def _render_mask(self, layout: TextLayout) -> Image:
+        """
+        Renders the laid out text as mask, with the lines centered in the
+        width of the layout. Used via render_mask(), which caches it.
+        """
+        font = self.font(layout.size)
+        mask = Image.new("L", (layout.width, layout.height + font.getmetrics()[1]))
+        draw = ImageDraw.Draw(mask)
+        for index, line in enumerate(layout.lines):
+            draw.text(
+                (layout.width // 2, layout.ascent + index * layout.line_height),
+                line,
+                font=font,
+                anchor="ms",
+                fill=255,
+            )
+
+        return mask
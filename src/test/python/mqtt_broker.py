@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+"""
+Minimal in-process MQTT 3.1.1 broker for the tests of the MQTT backend.
+"""
+
+import socket
+import struct
+import threading
+
+
+class MqttBroker:
+    """
+    Accepts clients on a free port of localhost and supports what the MQTT
+    backend uses: subscriptions (with + and # wildcards), retained messages
+    and publishing with QoS 0, 1 and 2. Messages published by clients and the
+    subscriptions are recorded for the tests.
+    """
+
+    def __init__(self):
+        self.published = []
+        self.subscriptions = []
+        self._retained = {}
+        self._clients = {}
+        self._lock = threading.Condition()
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        """
+        Closes the server socket and the connections of all clients.
+        """
+        self._server.close()
+        with self._lock:
+            clients = list(self._clients)
+        for connection in clients:
+            connection.close()
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False):
+        """
+        Sends a message with QoS 0 to the subscribed clients.
+        """
+        with self._lock:
+            if retain:
+                self._retained[topic] = payload
+            clients = [
+                connection
+                for connection, filters in self._clients.items()
+                if any(_matches(topic_filter, topic) for topic_filter in filters)
+            ]
+        for connection in clients:
+            self._send_publish(connection, topic, payload)
+
+    def wait_for(self, predicate, timeout: float = 5) -> bool:
+        """
+        Waits until the predicate, called with the lock held, returns true.
+        """
+        with self._lock:
+            return self._lock.wait_for(predicate, timeout)
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients[connection] = []
+            threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            ).start()
+
+    def _serve(self, connection):
+        try:
+            while True:
+                packet_type, flags, body = _read_packet(connection)
+                if packet_type == 1:  # CONNECT
+                    connection.sendall(b"\x20\x02\x00\x00")
+                elif packet_type == 3:  # PUBLISH
+                    self._received_publish(connection, flags, body)
+                elif packet_type == 6:  # PUBREL
+                    connection.sendall(b"\x70\x02" + body[:2])
+                elif packet_type == 8:  # SUBSCRIBE
+                    self._subscribe(connection, body)
+                elif packet_type == 12:  # PINGREQ
+                    connection.sendall(b"\xd0\x00")
+                elif packet_type == 14:  # DISCONNECT
+                    break
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            with self._lock:
+                self._clients.pop(connection, None)
+            connection.close()
+
+    def _received_publish(self, connection, flags, body):
+        qos = (flags >> 1) & 3
+        length = struct.unpack("!H", body[:2])[0]
+        topic = body[2 : 2 + length].decode()
+        body = body[2 + length :]
+        if qos > 0:
+            packet_id, body = body[:2], body[2:]
+        with self._lock:
+            self.published.append((topic, body, qos))
+            self._lock.notify_all()
+        if qos == 1:
+            connection.sendall(b"\x40\x02" + packet_id)
+        elif qos == 2:
+            connection.sendall(b"\x50\x02" + packet_id)
+
+    def _subscribe(self, connection, body):
+        packet_id, body = body[:2], body[2:]
+        filters = []
+        while body:
+            length = struct.unpack("!H", body[:2])[0]
+            filters.append((body[2 : 2 + length].decode(), body[2 + length]))
+            body = body[3 + length :]
+
+        granted = bytes(qos for _, qos in filters)
+        connection.sendall(_packet(0x90, packet_id + granted))
+        with self._lock:
+            self._clients[connection].extend(topic for topic, _ in filters)
+            self.subscriptions.extend(filters)
+            retained = [
+                (topic, payload)
+                for topic, payload in self._retained.items()
+                if any(_matches(topic_filter, topic) for topic_filter, _ in filters)
+            ]
+            self._lock.notify_all()
+        for topic, payload in retained:
+            self._send_publish(connection, topic, payload, retain=True)
+
+    @staticmethod
+    def _send_publish(connection, topic, payload, retain=False):
+        topic = topic.encode()
+        try:
+            connection.sendall(
+                _packet(
+                    0x31 if retain else 0x30,
+                    struct.pack("!H", len(topic)) + topic + payload,
+                )
+            )
+        except OSError:
+            pass
+
+
+def _matches(topic_filter, topic):
+    """
+    Returns whether the topic matches the filter.
+    """
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(levels) or level not in ("+", levels[index]):
+            return False
+
+    return len(filter_levels) == len(levels)
+
+
+def _packet(header, body):
+    """
+    Returns a packet with the given first byte and body.
+    """
+    length = bytearray()
+    remaining = len(body)
+    while True:
+        byte, remaining = remaining % 128, remaining // 128
+        length.append(byte | (128 if remaining else 0))
+        if not remaining:
+            break
+
+    return bytes([header]) + bytes(length) + body
+
+
+def _read_packet(connection):
+    """
+    Reads a packet, returns its type, flags and body.
+    """
+    header = _read(connection, 1)[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = _read(connection, 1)[0]
+        length += (byte & 127) * multiplier
+        multiplier *= 128
+        if not byte & 128:
+            break
+
+    return header >> 4, header & 15, _read(connection, length)
+
+
+def _read(connection, size):
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+
+    return data
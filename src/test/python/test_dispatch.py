@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+Tests of the dispatch queue of the backends.
+"""
+
+import threading
+import unittest
+from backends.dispatch import DispatchQueue
+
+
+class DispatchQueueTest(unittest.TestCase):
+    """
+    Queues entity changes and calls, and runs the worker until they were
+    dispatched.
+    """
+
+    def setUp(self):
+        self.dispatched = []
+        self.queue = DispatchQueue(self.dispatch, self.resync, max_size=3)
+
+    def dispatch(self, entity_id, old_info):
+        """
+        Records a dispatched entity change.
+        """
+        self.dispatched.append((entity_id, old_info))
+
+    def resync(self):
+        """
+        Records a resync.
+        """
+        self.dispatched.append("resync")
+
+    def drain(self):
+        """
+        Runs the worker until everything queued so far was dispatched.
+        """
+        done = threading.Event()
+        self.queue.put_call(done.set)
+        worker = threading.Thread(target=self.queue.run)
+        worker.start()
+        self.assertTrue(done.wait(5))
+        self.queue.stop()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+
+    def test_order(self):
+        self.queue.put("light.a", None)
+        self.queue.put_call(self.dispatched.append, "call")
+        self.queue.put("light.b", {"state": "off"})
+
+        self.drain()
+
+        self.assertEqual(
+            self.dispatched,
+            [("light.a", None), "call", ("light.b", {"state": "off"})],
+        )
+        self.assertEqual(self.queue.stats["dispatched"], 4)
+        self.assertEqual(self.queue.stats["queued"], 0)
+
+    def test_collapse(self):
+        self.queue.put("light.a", {"state": "off"})
+        self.queue.put("light.b", None)
+        self.queue.put("light.a", {"state": "on"})
+
+        self.drain()
+
+        # The first position and the oldest info are kept:
+        self.assertEqual(
+            self.dispatched, [("light.a", {"state": "off"}), ("light.b", None)]
+        )
+        self.assertEqual(self.queue.stats["collapsed"], 1)
+
+    def test_overflow(self):
+        self.queue.put_call(self.dispatched.append, "call")
+        with self.assertLogs("streamdeck.backends.dispatch", "WARNING"):
+            for index in range(4):
+                self.queue.put(f"light.{index}", None)
+        self.queue.put("light.5", None)
+
+        self.drain()
+
+        # Calls are never dropped, the entity changes are replaced by a
+        # resync, which includes all later changes:
+        self.assertEqual(self.dispatched, ["call", "resync"])
+        self.assertEqual(self.queue.stats["dropped"], 4)
+        self.assertEqual(self.queue.stats["collapsed"], 1)
+
+    def test_failing_handler(self):
+        def fail():
+            raise RuntimeError("handler failed")
+
+        self.queue.put_call(fail)
+        self.queue.put("light.a", None)
+
+        with self.assertLogs("streamdeck.backends.dispatch", "ERROR"):
+            self.drain()
+
+        self.assertEqual(self.dispatched, [("light.a", None)])
+
+    def test_stop(self):
+        worker = threading.Thread(target=self.queue.run)
+        worker.start()
+
+        self.queue.stop()
+        worker.join(5)
+
+        self.assertFalse(worker.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
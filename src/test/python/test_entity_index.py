@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""
+Tests of the entity index of the backends.
+"""
+
+import unittest
+from backends.entity_index import EntityIndex
+
+INFOS = {
+    "light.kitchen": {"attributes": {"device_class": None, "brightness": 100}},
+    "light.bedroom_ceiling": {"attributes": {"brightness": 50}},
+    "light.bedroom_lamp": {"attributes": {"brightness": 100}},
+    "sensor.kitchen_temperature": {"attributes": {"device_class": "temperature"}},
+    "sensor.bedroom_humidity": {"attributes": {"device_class": "humidity"}},
+}
+
+
+class EntityIndexTest(unittest.TestCase):
+    """
+    Queries an index of some lights and sensors.
+    """
+
+    def setUp(self):
+        self.index = EntityIndex()
+        for entity_id, info in INFOS.items():
+            self.index.update(entity_id, None, info)
+        self.index.set_areas(
+            {
+                "light.kitchen": "kitchen",
+                "sensor.kitchen_temperature": "kitchen",
+                "light.bedroom_ceiling": "bedroom",
+                "light.bedroom_lamp": "bedroom",
+            },
+            {"kitchen": "Kitchen", "bedroom": "Bedroom"},
+        )
+
+    def test_domain(self):
+        self.assertEqual(
+            self.index.query(domain="sensor"),
+            ["sensor.bedroom_humidity", "sensor.kitchen_temperature"],
+        )
+        self.assertEqual(self.index.query(domain="switch"), [])
+
+    def test_area(self):
+        # By ID and by name:
+        self.assertEqual(
+            self.index.query(area="kitchen"),
+            ["light.kitchen", "sensor.kitchen_temperature"],
+        )
+        self.assertEqual(
+            self.index.query(domain="light", area="Bedroom"),
+            ["light.bedroom_ceiling", "light.bedroom_lamp"],
+        )
+
+    def test_attributes(self):
+        self.assertEqual(
+            self.index.query(attributes={"device_class": "temperature"}),
+            ["sensor.kitchen_temperature"],
+        )
+
+        # Attributes that aren't indexed need the entity infos:
+        self.assertEqual(
+            self.index.query(
+                domain="light",
+                attributes={"brightness": 100},
+                get_info=INFOS.get,
+            ),
+            ["light.bedroom_lamp", "light.kitchen"],
+        )
+
+    def test_pattern(self):
+        self.assertEqual(
+            self.index.query(pattern="*.bedroom_*"),
+            [
+                "light.bedroom_ceiling",
+                "light.bedroom_lamp",
+                "sensor.bedroom_humidity",
+            ],
+        )
+
+    def test_update(self):
+        self.index.update(
+            "sensor.kitchen_temperature",
+            INFOS["sensor.kitchen_temperature"],
+            {"attributes": {"device_class": "power"}},
+        )
+        self.index.update("light.kitchen", INFOS["light.kitchen"], None)
+
+        self.assertEqual(
+            self.index.query(attributes={"device_class": "temperature"}), []
+        )
+        self.assertEqual(
+            self.index.query(attributes={"device_class": "power"}),
+            ["sensor.kitchen_temperature"],
+        )
+        self.assertEqual(
+            self.index.query(area="kitchen"), ["sensor.kitchen_temperature"]
+        )
+
+        # Areas are kept for entities that are added again:
+        self.index.update("light.kitchen", None, INFOS["light.kitchen"])
+        self.assertEqual(
+            self.index.query(area="kitchen"),
+            ["light.kitchen", "sensor.kitchen_temperature"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
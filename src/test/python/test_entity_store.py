@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+"""
+Tests of the entity store of the backends.
+"""
+
+import unittest
+from backends.entity_store import EntityRecord, EntityStore
+
+
+def info(state, **attributes):
+    """
+    Returns an entity info with the given state and attributes.
+    """
+    return {
+        "state": state,
+        "attributes": attributes,
+        "last_updated": "2024-01-01T00:00:00",
+    }
+
+
+class EntityStoreTest(unittest.TestCase):
+    """
+    Updates entity stores and checks their contents and versions.
+    """
+
+    def test_update(self):
+        store = EntityStore()
+
+        self.assertEqual(store.update("light.a", info("on")), (True, None))
+        changed, previous = store.update("light.a", info("off"))
+
+        self.assertTrue(changed)
+        self.assertEqual(previous["state"], "on")
+        self.assertEqual(store.get("light.a")["state"], "off")
+        self.assertIsInstance(store.get("light.a"), EntityRecord)
+        self.assertIsNone(store.get("light.b"))
+
+    def test_removal(self):
+        store = EntityStore()
+        store.update("light.a", info("on"))
+
+        changed, previous = store.update("light.a", None)
+
+        self.assertTrue(changed)
+        self.assertEqual(previous["state"], "on")
+        self.assertIsNone(store.get("light.a"))
+        self.assertNotIn("light.a", store.snapshot())
+
+    def test_versions(self):
+        store = EntityStore()
+        store.update_many({"light.a": info("on"), "light.b": info("on")})
+        version = store.version
+
+        store.update("light.a", info("on", brightness=100))
+        self.assertEqual(store.changed_since(version), ["light.a"])
+        self.assertEqual(store.changed_since(version, state_only=True), [])
+
+        store.update("light.b", info("off"))
+        self.assertEqual(store.changed_since(version, state_only=True), ["light.b"])
+        self.assertEqual(store.get_version("light.b", state_only=True), store.version)
+        self.assertEqual(store.get_version("light.c"), 0)
+
+    def test_ignored_fields(self):
+        store = EntityStore()
+        store.update("light.a", info("on"))
+        version = store.version
+
+        changed, _ = store.update(
+            "light.a", {**info("on"), "last_updated": "2024-01-02T00:00:00"}
+        )
+
+        self.assertFalse(changed)
+        self.assertEqual(store.version, version)
+
+    def test_snapshot_is_immutable(self):
+        store = EntityStore()
+        store.update("light.a", info("on"))
+        snapshot = store.snapshot()
+
+        store.update("light.a", info("off"))
+        store.update("light.b", info("on"))
+
+        self.assertEqual(snapshot["light.a"]["state"], "on")
+        self.assertNotIn("light.b", snapshot)
+        with self.assertRaises(TypeError):
+            snapshot["light.c"] = (
+                None  # pylint: disable=unsupported-assignment-operation
+            )
+
+    def test_attribute_filter(self):
+        store = EntityStore(["brightness"])
+        store.update("light.a", info("on", brightness=100, color_mode="xy"))
+        self.assertEqual(store.get("light.a")["attributes"], {"brightness": 100})
+
+        # Changes of attributes that aren't kept are ignored:
+        changed, _ = store.update(
+            "light.a", info("on", brightness=100, color_mode="hs")
+        )
+        self.assertFalse(changed)
+
+        version = store.version
+        store.set_attribute_filter(None)
+        store.update("light.a", info("on", brightness=100, color_mode="hs"))
+        self.assertEqual(store.changed_since(version), ["light.a"])
+        self.assertEqual(store.get("light.a")["attributes"]["color_mode"], "hs")
+
+
+class EntityRecordTest(unittest.TestCase):
+    """
+    Checks that entity records can be read like entity info dicts.
+    """
+
+    def test_mapping(self):
+        record = EntityRecord.from_info("light.a", info("on", brightness=100), None)
+
+        self.assertEqual(
+            dict(record),
+            {
+                "entity_id": "light.a",
+                "state": "on",
+                "attributes": {"brightness": 100},
+                "last_changed": None,
+            },
+        )
+        self.assertEqual(record.get("state"), "on")
+        self.assertIsNone(record.get("last_updated"))
+        with self.assertRaises(KeyError):
+            record["last_updated"]  # pylint: disable=pointless-statement
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+"""
+Tests of the HTTP polling backend against a local stub server.
+"""
+
+import json
+import time
+import threading
+import http.client
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from backends.http_poll import (
+    ConnectionPool,
+    HttpPollBackend,
+    compile_json_path,
+    extract_json_path,
+)
+
+TIMEOUT = 5  # seconds
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Serves a JSON document with an ETag at /status and records the requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.document = {}
+        self.version = 0
+        self.requests = []
+        self.condition = threading.Condition()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        """
+        Returns the URL of the given path on the server.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def set_document(self, document):
+        """
+        Changes the served document and its ETag.
+        """
+        with self.condition:
+            self.document = document
+            self.version += 1
+
+    def wait_for(self, predicate):
+        """
+        Waits until the predicate, called with the requests, returns true.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self.requests), TIMEOUT)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the StubServer.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        with self.server.condition:
+            etag = f'"{self.server.version}"'
+            body = json.dumps(self.server.document).encode()
+            self.server.requests.append(
+                ("GET", self.path, self.headers.get("If-None-Match"), None)
+            )
+            self.server.condition.notify_all()
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == "/close":
+            # Close the connection, as if it timed out while idle:
+            self.close_connection = True
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.condition:
+            self.server.requests.append(("POST", self.path, None, json.loads(body)))
+            self.server.condition.notify_all()
+
+        if self.path == "/drop":
+            # Close the connection without a response:
+            self.close_connection = True
+            return
+
+        self.send_response(204 if self.path == "/relay" else 500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class JsonPathTest(unittest.TestCase):
+    """
+    Tests of compile_json_path() and extract_json_path().
+    """
+
+    def test_extract(self):
+        document = {"power": {"values": [1, 2]}, "a b": True}
+        self.assertEqual(
+            extract_json_path(document, compile_json_path("$.power.values[1]")), 2
+        )
+        self.assertTrue(extract_json_path(document, compile_json_path("$['a b']")))
+        self.assertIsNone(extract_json_path(document, compile_json_path("$.x.y")))
+        self.assertEqual(extract_json_path(document, compile_json_path("$")), document)
+
+    def test_invalid(self):
+        for path in ("power", "$.a[x]", "$."):
+            with self.assertRaises(ValueError):
+                compile_json_path(path)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """
+    Tests of the retries of the ConnectionPool.
+    """
+
+    def setUp(self):
+        self.server = StubServer()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.pool = ConnectionPool(TIMEOUT)
+        self.addCleanup(self.pool.close)
+
+    def test_retry_get_on_closed_connection(self):
+        self.assertEqual(self.pool.request("GET", self.server.url("/close"))[0], 200)
+        time.sleep(0.1)
+
+        # The idle connection was closed by the server, so it's retried:
+        self.assertEqual(self.pool.request("GET", self.server.url("/status"))[0], 200)
+        self.assertEqual(
+            [request[1] for request in self.server.requests], ["/close", "/status"]
+        )
+
+    def test_no_retry_of_post(self):
+        self.assertEqual(self.pool.request("GET", self.server.url("/status"))[0], 200)
+
+        with self.assertRaises(http.client.HTTPException):
+            self.pool.request("POST", self.server.url("/drop"), "{}")
+        self.assertEqual(
+            [request[:2] for request in self.server.requests],
+            [("GET", "/status"), ("POST", "/drop")],
+        )
+
+
+class HttpPollBackendTest(unittest.TestCase):
+    """
+    Runs the backend with the stub server.
+    """
+
+    def setUp(self):
+        self.server = StubServer()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.server.set_document({"relay": True, "power": {"value": 12, "unit": "W"}})
+
+        self.backend = HttpPollBackend(
+            {
+                "switch.relay": {
+                    "url": self.server.url("/status"),
+                    "state": "$.relay",
+                    "services": {
+                        "turn_on": {
+                            "url": self.server.url("/relay"),
+                            "body": {"on": True},
+                        },
+                        "reset": {"url": self.server.url("/reset")},
+                    },
+                },
+                "sensor.power": {
+                    "url": self.server.url("/status"),
+                    "interval": 0.2,
+                    "state": "$.power.value",
+                    "attributes": {"unit_of_measurement": "$.power.unit"},
+                },
+            },
+            interval=60,
+        )
+        self.dispatcher_thread = threading.Thread(
+            target=self.backend.dispatcher.run, daemon=True
+        )
+        self.dispatcher_thread.start()
+        self.addCleanup(self.backend.dispatcher.stop)
+        threading.Thread(target=self.backend.run, daemon=True).start()
+        self.addCleanup(self.backend.stop)
+
+    def wait_for_state(self, entity_id, state):
+        """
+        Waits until the entity has the given state.
+        """
+        changed = threading.Event()
+
+        def handler(info):
+            if info["state"] == state:
+                changed.set()
+
+        self.backend.register_state_change_handler(entity_id, handler)
+        info = self.backend.get_entity_info(entity_id)
+        if info is None or info["state"] != state:
+            self.assertTrue(changed.wait(TIMEOUT), f"{entity_id} isn't {state}")
+
+    def call_service(self, service, data=None):
+        """
+        Calls the service and returns the result passed to the callback and
+        the thread it was called by.
+        """
+        results = []
+        done = threading.Event()
+
+        def callback(success, result):
+            results.append((success, result, threading.current_thread()))
+            done.set()
+
+        self.backend.call_service(
+            "switch",
+            service,
+            data,
+            target={"entity_id": "switch.relay"},
+            callback=callback,
+        )
+        self.assertTrue(done.wait(TIMEOUT), "no result")
+
+        return results[0]
+
+    def test_poll(self):
+        self.wait_for_state("switch.relay", "on")
+        self.wait_for_state("sensor.power", "12")
+        self.assertEqual(
+            self.backend.get_entity_info("sensor.power")["attributes"],
+            {"unit_of_measurement": "W"},
+        )
+
+        # Entities with the same URL share the requests, at the shortest
+        # interval, and unchanged documents are detected with the ETag:
+        self.assertTrue(self.server.wait_for(lambda requests: len(requests) >= 3))
+        self.assertEqual({request[1] for request in self.server.requests}, {"/status"})
+        self.assertEqual(self.server.requests[1][2], '"1"')
+
+        self.server.set_document({"relay": False, "power": {"value": 3}})
+        self.wait_for_state("switch.relay", "off")
+        self.wait_for_state("sensor.power", "3")
+
+    def test_call_service(self):
+        success, result, thread = self.call_service("turn_on", {"level": 2})
+        self.assertEqual((success, result), (True, {"status": 204}))
+        self.assertIs(thread, self.dispatcher_thread)
+        self.assertIn(
+            ("POST", "/relay", None, {"on": True, "level": 2}), self.server.requests
+        )
+
+    def test_call_service_failed(self):
+        success, result, thread = self.call_service("reset", {"hard": True})
+        self.assertEqual((success, result), (False, {"status": 500}))
+        self.assertIs(thread, self.dispatcher_thread)
+
+    def test_invalid_interval(self):
+        for interval in (0, -1):
+            with self.assertRaises(ValueError):
+                HttpPollBackend(
+                    {"sensor.x": {"url": self.server.url("/status")}},
+                    interval=interval,
+                )
+
+    def test_stop(self):
+        self.wait_for_state("sensor.power", "12")
+        self.backend.stop()
+        time.sleep(0.1)
+        count = len(self.server.requests)
+        time.sleep(0.5)
+        self.assertEqual(len(self.server.requests), count)
+
+        success, result, _ = self.call_service("turn_on")
+        self.assertFalse(success)
+        self.assertEqual(result["code"], "stopped")
+
+    def test_unknown_service(self):
+        success, result, _ = self.call_service("toggle")
+        self.assertFalse(success)
+        self.assertEqual(result["code"], "unknown_service")
+
+
+if __name__ == "__main__":
+    unittest.main()
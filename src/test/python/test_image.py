@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+"""
+Tests of the image renderer.
+"""
+
+import os.path
+import unittest
+from unittest import mock
+import image
+from image import ImageRenderer
+
+FONT = os.environ.get(
+    "STREAMDECK_TEST_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+
+@unittest.skipUnless(os.path.exists(FONT), f"Font {FONT} is missing")
+class ImageRendererTest(unittest.TestCase):
+    """
+    Renders appearances and checks the animation cache.
+    """
+
+    def setUp(self):
+        self.renderer = ImageRenderer(
+            (72, 72), {"font": FONT, "max_fontsize": 12, "padding": 4}
+        )
+
+    @staticmethod
+    def appearance(title, **kwargs):
+        """
+        Returns an appearance with the given title.
+        """
+        return {"title": title, "icon": "help", "icon_color": "black", **kwargs}
+
+    def test_cache_is_lru(self):
+        with mock.patch.object(image, "ANIMATION_CACHE_SIZE", 2):
+            first = self.renderer.render_animation(self.appearance("first"))
+            second = self.renderer.render_animation(self.appearance("second"))
+
+            # Using the first appearance makes the second one the oldest:
+            self.assertIs(
+                self.renderer.render_animation(self.appearance("first")), first
+            )
+            self.renderer.render_animation(self.appearance("third"))
+
+            self.assertIs(
+                self.renderer.render_animation(self.appearance("first")), first
+            )
+            self.assertIsNot(
+                self.renderer.render_animation(self.appearance("second")), second
+            )
+
+    def test_sparklines_are_not_cached(self):
+        cached = self.renderer.render_animation(self.appearance("cached"))
+        for value in range(10):
+            appearance = self.appearance(
+                "sensor", value=str(value), sparkline=(0.0, float(value))
+            )
+            self.assertEqual(
+                self.renderer.render_animation(appearance).frames[0].size, (72, 72)
+            )
+
+        self.assertIs(self.renderer.render_animation(self.appearance("cached")), cached)
+        self.assertIsNot(
+            self.renderer.render_animation(appearance),
+            self.renderer.render_animation(appearance),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
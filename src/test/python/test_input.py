@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+Tests of the input pipeline of the frontends.
+"""
+
+import threading
+import time
+import unittest
+from frontends.input import KeyInput, PressType
+
+
+class KeyInputTest(unittest.TestCase):
+    """
+    Feeds key events into a KeyInput and records the presses.
+    """
+
+    def setUp(self):
+        self.presses = []
+        self.pressed = threading.Semaphore(0)
+
+    def callback(self, key_index, press_type):
+        """
+        Records a press.
+        """
+        self.presses.append((key_index, press_type))
+        self.pressed.release()
+
+    def wait_for_presses(self, count):
+        """
+        Waits until the given number of presses were recorded.
+        """
+        for _ in range(count):
+            self.assertTrue(self.pressed.acquire(timeout=5), "no press")
+
+    def test_press_on_key_down(self):
+        key_input = KeyInput(self.callback)
+        key_input.key_down(1)
+        self.assertEqual(self.presses, [(1, PressType.PRESS)])
+        key_input.key_up(1)
+        self.assertEqual(self.presses, [(1, PressType.PRESS)])
+
+    def test_debounce(self):
+        key_input = KeyInput(self.callback, debounce=10)
+        for _ in range(3):
+            key_input.key_down(0)
+            key_input.key_up(0)
+        self.assertEqual(self.presses, [(0, PressType.PRESS)])
+
+    def test_long_press(self):
+        key_input = KeyInput(self.callback, long_press=0.05)
+        key_input.key_down(2)
+        self.wait_for_presses(1)
+        key_input.key_up(2)
+        self.assertEqual(self.presses, [(2, PressType.LONG_PRESS)])
+
+        key_input.key_down(2)
+        key_input.key_up(2)
+        self.assertEqual(self.presses[1:], [(2, PressType.PRESS)])
+
+    def test_double_press(self):
+        key_input = KeyInput(self.callback, double_press=0.2)
+        key_input.key_down(0)
+        key_input.key_up(0)
+        key_input.key_down(0)
+        key_input.key_up(0)
+        self.assertEqual(self.presses, [(0, PressType.DOUBLE_PRESS)])
+
+        key_input.key_down(0)
+        key_input.key_up(0)
+        self.assertEqual(self.presses[1:], [])
+        self.wait_for_presses(2)
+        self.assertEqual(self.presses[1:], [(0, PressType.PRESS)])
+
+    def test_press_on_key_down_without_handlers(self):
+        key_input = KeyInput(self.callback, long_press=0.05, double_press=0.05)
+        key_input.set_handlers(3, False, False)
+        key_input.key_down(3)
+        self.assertEqual(self.presses, [(3, PressType.PRESS)])
+
+        time.sleep(0.1)
+        key_input.key_up(3)
+        self.assertEqual(self.presses, [(3, PressType.PRESS)])
+
+    def test_only_long_press_handler(self):
+        key_input = KeyInput(self.callback, long_press=10, double_press=10)
+        key_input.set_handlers(4, True, False)
+        key_input.key_down(4)
+        self.assertEqual(self.presses, [])
+        key_input.key_up(4)
+        self.assertEqual(self.presses, [(4, PressType.PRESS)])
+
+
+if __name__ == "__main__":
+    unittest.main()
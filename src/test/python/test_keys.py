@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""
+Tests of the keys.
+"""
+
+import threading
+import unittest
+from backends.backend import Backend
+from keys.base import KeyPressResult
+from keys.home_assistant import HomeAssistantClimatePresetKey
+from keys.macro import MacroKey
+
+
+class RecordingBackend(Backend):
+    """
+    Backend that records service calls and reports them as successful, or
+    with the result given for the service (None: no result at all).
+    """
+
+    def __init__(self, entities=None, results=None, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+        self.results = results or {}
+        for entity_id, info in (entities or {}).items():
+            self._entities.update(entity_id, {"entity_id": entity_id, **info})
+
+    def run(self):
+        pass
+
+    def call_service(
+        self, domain, service, data=None, target=None, *, callback=None
+    ):  # pylint: disable=too-many-arguments
+        self.calls.append((domain, service, data, target))
+        success = self.results.get(service, True)
+        if callback is not None and success is not None:
+            callback(success, None)
+
+
+class ClimatePresetKeyTest(unittest.TestCase):
+    """
+    Presses a climate preset key and checks the selected presets.
+    """
+
+    def setUp(self):
+        self.backend = RecordingBackend(
+            {
+                "climate.living_room": {
+                    "state": "heat",
+                    "attributes": {"preset_mode": "eco"},
+                }
+            }
+        )
+        self.key = HomeAssistantClimatePresetKey(
+            {"entity_id": "climate.living_room", "coalesce": 0}, self.backend
+        )
+        self.addCleanup(self.key.release)
+
+    def selected_presets(self):
+        """
+        Returns the preset modes the key requested.
+        """
+        return [data["preset_mode"] for _, _, data, _ in self.backend.calls]
+
+    def test_press_selects_next_preset(self):
+        self.assertTrue(self.key.handles_long_press)
+        self.assertFalse(self.key.handles_double_press)
+
+        self.key.pressed()
+        self.key.pressed()
+
+        self.assertEqual(self.selected_presets(), ["comfort", "boost"])
+
+    def test_long_press_selects_previous_preset(self):
+        self.key.long_pressed()
+        self.key.long_pressed()
+
+        self.assertEqual(self.selected_presets(), ["frost", "boost"])
+        self.assertEqual(self.key.appearance["icon"], "rocket-launch")
+
+
+class MacroKeyTest(unittest.TestCase):
+    """
+    Runs macros and checks the service calls.
+    """
+
+    def setUp(self):
+        self.backend = RecordingBackend(results={"fail": False, "hang": None})
+        self.other = RecordingBackend()
+        self.done = threading.Event()
+
+    def run_macro(self, stages, **values):
+        """
+        Runs a macro with the given stages and waits until it completed.
+
+        :return: the services called on the backend of the key
+        """
+        key = MacroKey(
+            {"title": "Macro", "stages": stages, **values},
+            self.backend,
+            lambda _: self.done.set(),
+            {"other": self.other},
+        )
+        self.assertEqual(key.pressed(), (KeyPressResult.REDRAW, None))
+        self.assertTrue(self.done.wait(5))
+        self.assertFalse(key.appearance["pending"])
+
+        return [service for _, service, _, _ in self.backend.calls]
+
+    @staticmethod
+    def step(service, **kwargs):
+        """
+        Returns a step calling the given service.
+        """
+        return {"domain": "test", "service": service, **kwargs}
+
+    def test_stages(self):
+        services = self.run_macro(
+            [
+                [self.step("first"), self.step("parallel", backend="other")],
+                self.step("second"),
+            ]
+        )
+
+        self.assertEqual(services, ["first", "second"])
+        self.assertEqual(self.other.calls, [("test", "parallel", None, None)])
+
+    def test_failure(self):
+        with self.assertLogs("streamdeck.keys.macro", "ERROR"):
+            services = self.run_macro(
+                [[self.step("fail"), self.step("first")], self.step("second")]
+            )
+
+        self.assertEqual(services, ["fail", "first"])
+
+    def test_continue_on_error(self):
+        with self.assertLogs("streamdeck.keys.macro", "ERROR"):
+            services = self.run_macro(
+                [self.step("fail"), self.step("second")], continue_on_error=True
+            )
+
+        self.assertEqual(services, ["fail", "second"])
+
+    def test_unknown_backend(self):
+        with self.assertLogs("streamdeck.keys.macro", "ERROR"):
+            services = self.run_macro(
+                [self.step("first", backend="missing"), self.step("second")]
+            )
+
+        # The call isn't sent to the backend of the key instead:
+        self.assertEqual(services, [])
+
+    def test_timeout(self):
+        with self.assertLogs("streamdeck.keys.macro", "ERROR"):
+            services = self.run_macro(
+                [self.step("hang"), self.step("second")], timeout=0.1
+            )
+
+        self.assertEqual(services, ["hang"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+"""
+Tests of the MQTT backend against the in-process broker.
+"""
+
+import json
+import threading
+import unittest
+from types import SimpleNamespace
+from backends.mqtt import MqttBackend
+from mqtt_broker import MqttBroker
+
+TIMEOUT = 5  # seconds
+
+
+class MqttBackendTest(unittest.TestCase):
+    """
+    Runs the backend with a broker on localhost.
+    """
+
+    def setUp(self):
+        self.broker = MqttBroker()
+        self.addCleanup(self.broker.close)
+
+    def start_backend(self, entities, **kwargs):
+        """
+        Creates the backend and runs it and its dispatch queue.
+        """
+        backend = MqttBackend(
+            "127.0.0.1", entities, port=self.broker.port, batch_interval=0.01, **kwargs
+        )
+        threading.Thread(target=backend.dispatcher.run, daemon=True).start()
+        self.addCleanup(backend.dispatcher.stop)
+        threading.Thread(target=backend.run, daemon=True).start()
+        self.addCleanup(backend._client.loop_stop)
+        self.addCleanup(backend._client.disconnect)
+
+        return backend
+
+    def wait_for_state(self, backend, entity_id, state):
+        """
+        Waits until the entity has the given state.
+        """
+        changed = threading.Event()
+
+        def handler(info):
+            if info["state"] == state:
+                changed.set()
+
+        backend.register_state_change_handler(entity_id, handler)
+        info = backend.get_entity_info(entity_id)
+        if info is None or info["state"] != state:
+            self.assertTrue(changed.wait(TIMEOUT), f"{entity_id} isn't {state}")
+
+    def call_service(self, backend, service, entity_id):
+        """
+        Calls the service and returns the result passed to the callback.
+        """
+        results = []
+        done = threading.Event()
+
+        def callback(success, error):
+            results.append((success, error))
+            done.set()
+
+        backend.call_service(
+            "light", service, target={"entity_id": entity_id}, callback=callback
+        )
+        self.assertTrue(done.wait(TIMEOUT), "no result")
+
+        return results[0]
+
+    def test_subscribes_to_exact_topics(self):
+        entities = {
+            f"light.lamp_{index}": {"state_topic": f"zigbee2mqtt/lamp_{index}"}
+            for index in range(6)
+        }
+        backend = self.start_backend(entities)
+        self.assertTrue(
+            self.broker.wait_for(lambda: len(self.broker.subscriptions) == 6)
+        )
+        self.assertCountEqual(
+            [topic for topic, _ in self.broker.subscriptions],
+            [f"zigbee2mqtt/lamp_{index}" for index in range(6)],
+        )
+
+        # A sibling topic outside of the layout isn't received:
+        self.broker.publish("zigbee2mqtt/other", b"ON")
+        self.broker.publish("zigbee2mqtt/lamp_3", b"ON")
+        self.wait_for_state(backend, "light.lamp_3", "on")
+        self.assertEqual(backend.collapsed_messages, 0)
+
+    def test_retained_and_json_states(self):
+        self.broker.publish(
+            "zigbee2mqtt/desk",
+            json.dumps({"state": "OFF", "brightness": 12}).encode(),
+            retain=True,
+        )
+        backend = self.start_backend(
+            {"light.desk": {"state_topic": "zigbee2mqtt/desk"}}
+        )
+        self.wait_for_state(backend, "light.desk", "off")
+        self.assertEqual(
+            backend.get_entity_info("light.desk")["attributes"]["brightness"], 12
+        )
+
+        self.broker.publish("zigbee2mqtt/desk", json.dumps({"state": "ON"}).encode())
+        self.wait_for_state(backend, "light.desk", "on")
+
+    def test_inbox_keeps_latest_payload_per_topic(self):
+        backend = MqttBackend(
+            "127.0.0.1",
+            {
+                "sensor.a": {"state_topic": "sensors/a"},
+                "sensor.b": {"state_topic": "sensors/b"},
+            },
+            port=self.broker.port,
+        )
+        for topic, payload in (
+            ("sensors/a", b"1"),
+            ("sensors/b", b"10"),
+            ("sensors/a", b"2"),
+            ("sensors/a", b"3"),
+        ):
+            backend._on_message(
+                None, None, SimpleNamespace(topic=topic, payload=payload)
+            )
+
+        self.assertEqual(backend.collapsed_messages, 2)
+        self.assertEqual(
+            list(backend._inbox.items()), [("sensors/a", b"3"), ("sensors/b", b"10")]
+        )
+
+        backend._process_messages(list(backend._inbox.items()))
+        self.assertEqual(backend.get_entity_info("sensor.a")["state"], "3")
+        self.assertEqual(backend.get_entity_info("sensor.b")["state"], "10")
+
+    def test_publish_with_acknowledgement(self):
+        backend = self.start_backend(
+            {"light.desk": {"state_topic": "zigbee2mqtt/desk", "qos": 1}}
+        )
+        self.assertTrue(self.broker.wait_for(lambda: self.broker.subscriptions))
+
+        self.assertEqual(
+            self.call_service(backend, "turn_on", "light.desk"), (True, None)
+        )
+        self.assertEqual(self.broker.published, [("zigbee2mqtt/desk/set", b"ON", 1)])
+
+    def test_acknowledgement_before_publish_returned(self):
+        backend = self.start_backend(
+            {"light.desk": {"state_topic": "zigbee2mqtt/desk", "qos": 2}}
+        )
+        self.assertTrue(self.broker.wait_for(lambda: self.broker.subscriptions))
+
+        # Deliver an acknowledgement of the message before publish() returns:
+        publish = backend._client.publish
+
+        def publish_and_acknowledge(*args):
+            info = publish(*args)
+            backend._on_publish(
+                None, None, info.mid, SimpleNamespace(is_failure=False), None
+            )
+            return info
+
+        backend._client.publish = publish_and_acknowledge
+        self.assertEqual(
+            self.call_service(backend, "turn_off", "light.desk"), (True, None)
+        )
+        self.assertEqual(backend._early_acknowledgements, {})
+
+    def test_qos_0_messages_are_collapsed(self):
+        backend = self.start_backend(
+            {"light.desk": {"state_topic": "zigbee2mqtt/desk"}}
+        )
+        self.assertTrue(self.broker.wait_for(lambda: self.broker.subscriptions))
+
+        results = []
+        done = threading.Semaphore(0)
+
+        def callback(success, error):
+            results.append((success, error))
+            done.release()
+
+        with backend._condition:
+            # Queue both in the same batch:
+            for service in ("turn_on", "turn_off"):
+                backend.call_service(
+                    "light",
+                    service,
+                    target={"entity_id": "light.desk"},
+                    callback=callback,
+                )
+        for _ in range(2):
+            self.assertTrue(done.acquire(timeout=TIMEOUT))
+
+        self.assertEqual(results, [(True, None), (True, None)])
+        self.assertTrue(self.broker.wait_for(lambda: self.broker.published))
+        self.assertEqual(self.broker.published, [("zigbee2mqtt/desk/set", b"OFF", 0)])
+
+    def test_unknown_entity(self):
+        backend = self.start_backend(
+            {"light.desk": {"state_topic": "zigbee2mqtt/desk"}}
+        )
+        success, error = self.call_service(backend, "turn_on", "light.other")
+        self.assertFalse(success)
+        self.assertEqual(error["code"], "unknown_entity")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""
+Tests of the helpers for optimistic updates, coalesced and throttled actions.
+"""
+
+import threading
+import time
+import unittest
+from keys.optimistic import CoalescedAction, OptimisticValue, ThrottledAction
+
+
+class OptimisticValueTest(unittest.TestCase):
+    """
+    Predicts values and reconciles them with the confirmed ones.
+    """
+
+    def setUp(self):
+        self.rollbacks = []
+        self.rolled_back = threading.Event()
+        self.value = OptimisticValue("off", self.rollback, timeout=0.1)
+
+    def rollback(self, value):
+        """
+        Records a rollback.
+        """
+        self.rollbacks.append(value)
+        self.rolled_back.set()
+
+    def test_confirm(self):
+        token = self.value.predict("on")
+        self.assertEqual(self.value.value, "on")
+        self.assertTrue(self.value.pending)
+
+        self.value.result(token, True)
+        self.assertTrue(self.value.pending)
+        self.value.confirm("on")
+
+        self.assertEqual(self.value.value, "on")
+        self.assertFalse(self.value.pending)
+        self.assertFalse(self.rolled_back.wait(0.2))
+
+    def test_failure(self):
+        token = self.value.predict("on")
+
+        with self.assertLogs("streamdeck.keys.optimistic", "WARNING"):
+            self.value.result(token, False, {"code": "failed"})
+
+        self.assertEqual(self.value.value, "off")
+        self.assertEqual(self.rollbacks, ["off"])
+
+    def test_other_value(self):
+        token = self.value.predict("on")
+
+        # Not acknowledged yet, so the change isn't the result of the action:
+        self.value.confirm("unavailable")
+        self.assertEqual(self.value.value, "on")
+
+        self.value.result(token, True)
+        self.value.confirm("off")
+
+        self.assertFalse(self.value.pending)
+        self.assertEqual(self.rollbacks, ["off"])
+
+    def test_timeout(self):
+        with self.assertLogs("streamdeck.keys.optimistic", "WARNING"):
+            self.value.predict("on")
+            self.assertTrue(self.rolled_back.wait(5))
+
+        self.assertEqual(self.value.value, "off")
+        self.assertEqual(self.rollbacks, ["off"])
+
+    def test_outdated_result(self):
+        first = self.value.predict("on")
+        self.value.predict("off")
+
+        self.value.result(first, False)
+
+        # The failure of the first action doesn't roll back the second one:
+        self.assertTrue(self.value.pending)
+        self.assertEqual(self.rollbacks, [])
+
+
+class CoalescedActionTest(unittest.TestCase):
+    """
+    Triggers coalesced actions and counts their runs.
+    """
+
+    def setUp(self):
+        self.runs = []
+        self.ran = threading.Event()
+
+    def action(self):
+        """
+        Records a run.
+        """
+        self.runs.append(time.monotonic())
+        self.ran.set()
+
+    def test_burst(self):
+        action = CoalescedAction(self.action, 0.1)
+        for _ in range(5):
+            action.trigger()
+
+        self.assertTrue(self.ran.wait(5))
+        time.sleep(0.2)
+        self.assertEqual(len(self.runs), 1)
+
+    def test_without_delay(self):
+        action = CoalescedAction(self.action)
+        action.trigger()
+        action.trigger()
+
+        self.assertEqual(len(self.runs), 2)
+
+
+class ThrottledActionTest(CoalescedActionTest):
+    """
+    Triggers throttled actions and counts their runs.
+    """
+
+    def test_burst(self):
+        action = ThrottledAction(self.action, 0.1)
+        for _ in range(5):
+            action.trigger()
+
+        # The first trigger runs immediately, the others once at the end of
+        # the interval:
+        self.assertEqual(len(self.runs), 1)
+        time.sleep(0.3)
+        self.assertEqual(len(self.runs), 2)
+        self.assertGreaterEqual(self.runs[1] - self.runs[0], 0.1)
+
+    def test_without_delay(self):
+        action = ThrottledAction(self.action)
+        action.trigger()
+        action.trigger()
+
+        self.assertEqual(len(self.runs), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+"""
+Tests of the render worker.
+"""
+
+import gc
+import os.path
+import unittest
+from image import ImageRenderer
+from render_worker import RenderWorker
+
+FONT = os.environ.get(
+    "STREAMDECK_TEST_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+STYLE = {"font": FONT, "max_fontsize": 12, "padding": 4}
+APPEARANCE = {"title": "Light", "icon": "help", "icon_color": "red"}
+
+
+@unittest.skipUnless(os.path.exists(FONT), f"Font {FONT} is missing")
+class RenderWorkerTest(unittest.TestCase):
+    """
+    Renders appearances in a worker process.
+    """
+
+    def setUp(self):
+        self.worker = RenderWorker((72, 72), STYLE, slots=16)
+
+    def test_render(self):
+        frame = self.worker.render_animation(APPEARANCE, key_index=0).frames[0]
+        expected = ImageRenderer((72, 72), STYLE).render_animation(APPEARANCE)
+
+        self.assertEqual(frame.convert("RGB").tobytes(), expected.frames[0].tobytes())
+
+        del frame
+        self.worker.close()
+
+    def test_close_with_referenced_images(self):
+        frame = self.worker.render_animation(APPEARANCE, key_index=0).frames[0]
+
+        with self.assertRaises(BufferError):
+            self.worker.close()
+
+        del frame
+        gc.collect()
+        self.worker.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+"""
+Tests of the ring buffer of the sensor keys.
+"""
+
+import unittest
+from keys.ring_buffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+    """
+    Appends values to ring buffers and checks their contents.
+    """
+
+    def test_values(self):
+        buffer = RingBuffer(3)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.values().tolist(), [])
+
+        for value in range(5):
+            buffer.append(value)
+
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.values().tolist(), [2, 3, 4])
+
+    def test_invalid_capacity(self):
+        for capacity in (0, -1, 1.5):
+            with self.assertRaises(ValueError):
+                RingBuffer(capacity)
+
+
+if __name__ == "__main__":
+    unittest.main()
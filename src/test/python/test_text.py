@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+"""
+Tests of the text layout.
+"""
+
+import os.path
+import unittest
+from PIL import Image
+from text import ELLIPSIS, TextEngine
+
+FONT = os.environ.get(
+    "STREAMDECK_TEST_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+
+@unittest.skipUnless(os.path.exists(FONT), f"Font {FONT} is missing")
+class TextEngineTest(unittest.TestCase):
+    """
+    Lays out texts in boxes and checks that they fit.
+    """
+
+    def setUp(self):
+        self.engine = TextEngine(FONT, 16, 8)
+
+    def assert_fits(self, layout, width, height):
+        """
+        Asserts that all lines of the layout fit into the given box.
+        """
+        font = self.engine.font(layout.size)
+        for line in layout.lines:
+            self.assertLessEqual(font.getlength(line), width)
+        if len(layout.lines) > 1:
+            self.assertLessEqual(layout.height, height)
+
+    def test_single_line(self):
+        layout = self.engine.layout("Light", 64, 32)
+
+        self.assertEqual(layout.lines, ("Light",))
+        self.assertEqual(layout.size, 16)
+
+    def test_wrap(self):
+        layout = self.engine.layout("Living room ceiling", 64, 40, 2)
+
+        self.assertEqual(len(layout.lines), 2)
+        self.assertEqual(" ".join(layout.lines), "Living room ceiling")
+        self.assert_fits(layout, 64, 40)
+
+    def test_shrink(self):
+        # Too wide for one line at the maximum size:
+        layout = self.engine.layout("Dishwasher", 64, 32)
+
+        self.assertEqual(layout.lines, ("Dishwasher",))
+        self.assertLess(layout.size, 16)
+        self.assert_fits(layout, 64, 32)
+
+    def test_truncate(self):
+        layout = self.engine.layout("A very long title of a key " * 3, 64, 40, 2)
+
+        self.assertEqual(len(layout.lines), 2)
+        self.assertEqual(layout.size, 8)
+        self.assertTrue(layout.lines[-1].endswith(ELLIPSIS))
+        self.assert_fits(layout, 64, 40)
+
+    def test_break_words(self):
+        layout = self.engine.layout("Supercalifragilistic", 32, 40, 3)
+
+        self.assertGreater(len(layout.lines), 1)
+        self.assertEqual("".join(layout.lines), "Supercalifragilistic")
+        self.assert_fits(layout, 32, 40)
+
+    def test_cache(self):
+        self.assertIs(
+            self.engine.layout("Light", 64, 32), self.engine.layout("Light", 64, 32)
+        )
+        layout = self.engine.layout("Light", 64, 32)
+        self.assertIs(self.engine.render_mask(layout), self.engine.render_mask(layout))
+
+    def test_draw(self):
+        image = Image.new("RGBA", (64, 32), (255, 255, 255))
+        layout = self.engine.layout("Light", 64, 32)
+
+        self.engine.draw(image, layout, (0, 0), (0, 0, 0))
+
+        self.assertEqual(image.getextrema()[0], (0, 255))
+
+
+if __name__ == "__main__":
+    unittest.main()